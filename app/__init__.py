@@ -5,6 +5,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_migrate import Migrate
 from config import Config  # Import the configuration
+from app.pool import WaitCountingPool
 
 app = Flask(__name__)
 
@@ -14,11 +15,15 @@ app.config.from_object(Config)
 # Enable Cross-Origin Resource Sharing (CORS)
 CORS(app)
 
-# Initialize SQLAlchemy
+# Initialize SQLAlchemy, counting requests waiting on the connection pool
+# for admission control
+app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).setdefault(
+    "poolclass", WaitCountingPool
+)
 db = SQLAlchemy(app)
 
 # Set up database migration
 migrate = Migrate(app, db)
 
 # Import routes and models
-from app import routes, models
+from app import routes, models, admission, timeouts, querybudget, profiling, batch, transactions
@@ -0,0 +1,25 @@
+# app/admin.py
+
+import functools
+import hmac
+from flask import jsonify, request
+from . import app
+
+# Admin routes require the X-Admin-Token header to match ADMIN_TOKEN.
+# They are disabled when no ADMIN_TOKEN is configured.
+
+
+def is_admin_request():
+    token = app.config.get("ADMIN_TOKEN")
+    supplied = request.headers.get("X-Admin-Token", "")
+    return bool(token) and hmac.compare_digest(supplied, token)
+
+
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({"error": "Admin token required"}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,152 @@
+# app/admission.py
+
+import math
+import threading
+import time
+from flask import g, jsonify, request
+from . import app, db
+
+# Admission control in front of every route. A request is turned away early
+# instead of queueing on the connection pool when:
+#   - its client has run out of tokens in its token bucket (429),
+#   - its route already has the configured number of requests running (503),
+#   - the number of requests waiting on the connection pool is past the
+#     threshold for the route's priority, so cheap routes keep being served
+#     after heavy ones are shed (503). Requests answered from the catalog,
+#     the cache or the scheduler never wait on the pool and do not count.
+
+# Endpoints that are never limited, besides the /metrics/ routes
+EXEMPT = {"static"}
+
+# Client buckets are pruned once there are this many of them
+MAX_CLIENTS = 10000
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    # Take one token; returns 0 on success, else seconds until one is available
+    def take(self, rate, burst):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / rate
+
+
+class AdmissionController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}
+        self._buckets = {}
+        self._in_flight = 0
+        self._stats = {"admitted": 0, "rate_limited": 0, "route_full": 0, "shed": 0}
+        self._rejected_by_route = {}
+
+    def _reject(self, reason, endpoint, retry_after, status, message):
+        self._stats[reason] += 1
+        self._rejected_by_route[endpoint] = self._rejected_by_route.get(endpoint, 0) + 1
+        response = jsonify({"error": message})
+        response.status_code = status
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    # Requests waiting on the pool for a connection (see app/pool.py)
+    def _pool_queue(self):
+        waiting = getattr(db.engine.pool, "waiting", None)
+        return waiting() if waiting is not None else 0
+
+    def admit(self, endpoint):
+        config = app.config
+        priority = config["ADMISSION_PRIORITIES"].get(endpoint, "normal")
+        limit = config["ADMISSION_ROUTE_LIMITS"].get(
+            endpoint, config["ADMISSION_DEFAULT_ROUTE_LIMIT"]
+        )
+        client = request.remote_addr or "unknown"
+
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= MAX_CLIENTS:
+                    self._buckets.clear()
+                bucket = self._buckets[client] = TokenBucket(
+                    config["ADMISSION_CLIENT_BURST"]
+                )
+            wait = bucket.take(
+                config["ADMISSION_CLIENT_RATE"], config["ADMISSION_CLIENT_BURST"]
+            )
+            if wait:
+                return self._reject(
+                    "rate_limited", endpoint, wait, 429, "Too many requests"
+                )
+
+            if self._pool_queue() >= config["ADMISSION_QUEUE_THRESHOLDS"][priority]:
+                return self._reject(
+                    "shed",
+                    endpoint,
+                    config["ADMISSION_RETRY_AFTER"],
+                    503,
+                    "Service overloaded, try again shortly",
+                )
+
+            if self._running.get(endpoint, 0) >= limit:
+                return self._reject(
+                    "route_full",
+                    endpoint,
+                    config["ADMISSION_RETRY_AFTER"],
+                    503,
+                    "Too many concurrent requests for this route",
+                )
+
+            self._running[endpoint] = self._running.get(endpoint, 0) + 1
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+        g.admitted_endpoint = endpoint
+        return None
+
+    def release(self, endpoint):
+        with self._lock:
+            self._running[endpoint] -= 1
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+            stats["pool_queue"] = self._pool_queue()
+            stats["running"] = {k: v for k, v in self._running.items() if v}
+            stats["rejected_by_route"] = dict(self._rejected_by_route)
+        return stats
+
+
+controller = AdmissionController()
+
+
+@app.before_request
+def admit_request():
+    if not app.config["ADMISSION_ENABLED"]:
+        return None
+    if request.endpoint is None or request.endpoint in EXEMPT:
+        return None
+    if request.path.startswith("/metrics/"):
+        return None
+    return controller.admit(request.endpoint)
+
+
+@app.teardown_request
+def release_request(error=None):
+    endpoint = g.pop("admitted_endpoint", None)
+    if endpoint is not None:
+        controller.release(endpoint)
+
+
+# Route to get admission control counters
+@app.route("/metrics/admission", methods=["GET"])
+def admission_metrics():
+    return jsonify(controller.stats())
@@ -0,0 +1,492 @@
+# app/analytics.py
+
+import itertools
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from . import app, db, shards
+from .models import FilmActor, FilmCategory, Film, Inventory, Rental, RentalArchive
+
+# In-memory columnar copy of the rental fact table and the dimensions it is
+# grouped by. Grouped aggregations are answered with np.unique/np.bincount
+# over integer keys instead of GROUP BY queries on the OLTP database.
+#
+# New rentals are loaded past a rental_id watermark. Each catch-up also
+# rescans WATERMARK_SLACK ids below it for rentals that committed out of
+# order, skipping those already loaded. With store shards, inventory and
+# rentals are read from every shard, each past its own watermark.
+
+GROUPS = ("film", "category", "store", "actor")
+PERIODS = ("day", "month", None)
+
+# Rows fetched per round trip while loading new rentals
+FETCH_CHUNK = 10000
+
+# Number of ids per IN (...) lookup when checking open rentals for returns
+RETURN_CHUNK = 1000
+
+# Marks an open rental in the return_day column
+OPEN = np.iinfo(np.int32).max
+
+
+def _days(values):
+    # datetimes -> days since 1970-01-01
+    return np.array(values, dtype="datetime64[D]").astype(np.int32)
+
+
+def _month(days):
+    # days since epoch -> months since 1970-01
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int32)
+
+
+def _label(period, value):
+    if period == "day":
+        return str(np.datetime64(int(value), "D"))
+    return str(np.datetime64(int(value), "M"))
+
+
+# Map integer keys to dense codes 0..n-1, returning (distinct keys, codes).
+# Keys in a narrow range are coded with a bincount lookup table instead of a sort.
+def _encode(keys):
+    if len(keys) == 0:
+        return keys[:0], np.empty(0, np.int64)
+    low, high = int(keys.min()), int(keys.max())
+    if high - low > 4 * len(keys) + 1024:
+        return np.unique(keys, return_inverse=True)
+    present = np.bincount(keys - low, minlength=high - low + 1) > 0
+    distinct = np.flatnonzero(present)
+    lookup = np.cumsum(present) - 1
+    return distinct + low, lookup[keys - low]
+
+
+# Build a CSR mapping from sorted parent ids to child ids
+def _csr(parent_ids, pairs):
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    codes = np.searchsorted(parent_ids, pairs[:, 0])
+    keep = (codes < len(parent_ids)) & (
+        parent_ids[np.minimum(codes, len(parent_ids) - 1)] == pairs[:, 0]
+    )
+    codes, children = codes[keep], pairs[keep, 1]
+    order = np.argsort(codes, kind="stable")
+    indptr = np.zeros(len(parent_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(parent_ids)), out=indptr[1:])
+    return indptr, children[order]
+
+
+# Expand each fact row into one row per child of its parent.
+# Returns (fact row index, child id) arrays.
+def _expand(parent_codes, indptr, children):
+    starts = indptr[parent_codes]
+    counts = indptr[parent_codes + 1] - starts
+    rows = np.repeat(np.arange(len(parent_codes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, children[starts[rows] + offsets]
+
+
+class _Snapshot:
+    # Immutable set of arrays; refresh builds a new one and swaps it in
+    __slots__ = (
+        "watermarks",
+        "rental_id",
+        "rental_day",
+        "return_day",
+        "inventory_id",
+        "inventory_code",
+        "inventory_ids",
+        "inventory_film",
+        "inventory_store",
+        "film_ids",
+        "film_rate",
+        "category_indptr",
+        "category_ids",
+        "actor_indptr",
+        "actor_ids",
+    )
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            setattr(self, name, columns[name])
+
+
+def _empty():
+    return _Snapshot(
+        watermarks={},
+        rental_id=np.empty(0, np.int64),
+        rental_day=np.empty(0, np.int32),
+        return_day=np.empty(0, np.int32),
+        inventory_id=np.empty(0, np.int64),
+        inventory_code=np.empty(0, np.int64),
+        inventory_ids=np.empty(0, np.int64),
+        inventory_film=np.empty(0, np.int64),
+        inventory_store=np.empty(0, np.int64),
+        film_ids=np.empty(0, np.int64),
+        film_rate=np.empty(0, np.float64),
+        category_indptr=np.zeros(1, np.int64),
+        category_ids=np.empty(0, np.int64),
+        actor_indptr=np.zeros(1, np.int64),
+        actor_ids=np.empty(0, np.int64),
+    )
+
+
+class RentalAnalytics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = _empty()
+        self._last_refresh = None
+
+    # Reload the small dimension tables; inventory comes from every shard
+    def _load_dimensions(self, connection, stores):
+        films = connection.execute(
+            select(Film.film_id, Film.rental_rate).order_by(Film.film_id)
+        ).all()
+        film_ids = np.array([row[0] for row in films], dtype=np.int64)
+        film_rate = np.array([float(row[1] or 0) for row in films], dtype=np.float64)
+
+        inventory = sorted(
+            row
+            for _, store in stores
+            for row in store.execute(
+                select(Inventory.inventory_id, Inventory.film_id, Inventory.store_id)
+            )
+        )
+        inventory_ids = np.array([row[0] for row in inventory], dtype=np.int64)
+        inventory_film = np.searchsorted(
+            film_ids, np.array([row[1] for row in inventory], dtype=np.int64)
+        )
+        inventory_store = np.array([row[2] or 0 for row in inventory], dtype=np.int64)
+
+        category_indptr, category_ids = _csr(
+            film_ids,
+            connection.execute(
+                select(FilmCategory.film_id, FilmCategory.category_id)
+            ).all(),
+        )
+        actor_indptr, actor_ids = _csr(
+            film_ids,
+            connection.execute(select(FilmActor.film_id, FilmActor.actor_id)).all(),
+        )
+
+        return dict(
+            inventory_ids=inventory_ids,
+            inventory_film=inventory_film,
+            inventory_store=inventory_store,
+            film_ids=film_ids,
+            film_rate=film_rate,
+            category_indptr=category_indptr,
+            category_ids=category_ids,
+            actor_indptr=actor_indptr,
+            actor_ids=actor_ids,
+        )
+
+    # Fetch rentals past after_rental_id in fixed-size chunks, from the
+    # rental table and then the archive
+    def _load_new_rentals(self, connection, after_rental_id):
+        rental_id, rental_day, return_day, inventory_id = [], [], [], []
+        for table in (Rental, RentalArchive):
+            after = after_rental_id
+            while True:
+                rows = connection.execute(
+                    select(
+                        table.rental_id,
+                        table.rental_date,
+                        table.return_date,
+                        table.inventory_id,
+                    )
+                    .where(table.rental_id > after)
+                    .order_by(table.rental_id)
+                    .limit(FETCH_CHUNK)
+                ).all()
+                if not rows:
+                    break
+                ids, rented, returned, inventory = zip(*rows)
+                rental_id.append(np.array(ids, dtype=np.int64))
+                rental_day.append(_days(rented))
+                returned_day = np.full(len(rows), OPEN, dtype=np.int32)
+                closed = [i for i, value in enumerate(returned) if value is not None]
+                if closed:
+                    returned_day[closed] = _days([returned[i] for i in closed])
+                return_day.append(returned_day)
+                inventory_id.append(np.array(inventory, dtype=np.int64))
+                after = ids[-1]
+                if len(rows) < FETCH_CHUNK:
+                    break
+
+        return rental_id, rental_day, return_day, inventory_id
+
+    # Pick up return dates for rentals that were open at the last refresh,
+    # including any that have been returned and archived since
+    def _apply_returns(self, stores, rental_id, return_day):
+        open_ids = rental_id[return_day == OPEN]
+        for start in range(0, len(open_ids), RETURN_CHUNK):
+            chunk = [int(value) for value in open_ids[start : start + RETURN_CHUNK]]
+            for (_, connection), table in itertools.product(
+                stores, (Rental, RentalArchive)
+            ):
+                returned = connection.execute(
+                    select(table.rental_id, table.return_date).where(
+                        table.rental_id.in_(chunk), table.return_date.is_not(None)
+                    )
+                ).all()
+                if returned:
+                    positions = np.searchsorted(
+                        rental_id,
+                        np.array([row[0] for row in returned], dtype=np.int64),
+                    )
+                    return_day[positions] = _days([row[1] for row in returned])
+
+    # Load new rentals and returns since the last call, then swap in the result
+    def refresh(self, force=False):
+        interval = app.config["ANALYTICS_REFRESH_SECONDS"]
+        if (
+            not force
+            and self._last_refresh is not None
+            and time.monotonic() - self._last_refresh < interval
+        ):
+            return 0
+
+        with self._lock:
+            current = self._snapshot
+            slack = app.config["WATERMARK_SLACK"]
+            with db.engine.connect() as connection, shards.connect_each() as stores:
+                dimensions = self._load_dimensions(connection, stores)
+                watermarks = dict(current.watermarks)
+                new = tuple(
+                    [np.empty(0, dtype)]
+                    for dtype in (np.int64, np.int32, np.int32, np.int64)
+                )
+                for key, store in stores:
+                    floor = max(watermarks.get(key, 0) - slack, 0)
+                    loaded = self._load_new_rentals(store, floor)
+                    for column, chunks in zip(new, loaded):
+                        column.extend(chunks)
+                    if loaded[0]:
+                        high = max(int(chunk[-1]) for chunk in loaded[0])
+                        watermarks[key] = max(watermarks.get(key, 0), high)
+
+                # Merge the shards and both tables into rental_id order; a
+                # rental archived between two reads shows up twice, so keep one
+                # copy, and drop those already loaded from the rescanned windows
+                new_id, order = np.unique(np.concatenate(new[0]), return_index=True)
+                positions = np.searchsorted(current.rental_id, new_id)
+                loaded = positions < len(current.rental_id)
+                loaded[loaded] = current.rental_id[positions[loaded]] == new_id[loaded]
+                order = order[~loaded]
+                new_id = new_id[~loaded]
+                new_day, new_return, new_inventory = (
+                    np.concatenate(column)[order] for column in new[1:]
+                )
+                rental_id = np.concatenate([current.rental_id, new_id])
+                rental_day = np.concatenate([current.rental_day, new_day])
+                return_day = np.concatenate([current.return_day, new_return])
+                inventory_id = np.concatenate([current.inventory_id, new_inventory])
+
+                # Rentals that committed out of order go back into rental_id order
+                appended = (
+                    not len(new_id)
+                    or not len(current.rental_id)
+                    or new_id[0] > current.rental_id[-1]
+                )
+                if not appended:
+                    order = np.argsort(rental_id, kind="stable")
+                    rental_id = rental_id[order]
+                    rental_day = rental_day[order]
+                    return_day = return_day[order]
+                    inventory_id = inventory_id[order]
+                self._apply_returns(stores, rental_id, return_day)
+
+            # Re-code every rental only when the inventory ids changed or
+            # rentals were inserted out of order
+            if appended and np.array_equal(
+                dimensions["inventory_ids"], current.inventory_ids
+            ):
+                new_codes = np.searchsorted(
+                    current.inventory_ids,
+                    inventory_id[len(current.inventory_code) :],
+                )
+                inventory_code = np.concatenate([current.inventory_code, new_codes])
+            else:
+                inventory_code = np.searchsorted(
+                    dimensions["inventory_ids"], inventory_id
+                )
+
+            # Drop rentals pointing at inventory we no longer know about
+            known = inventory_code < len(dimensions["inventory_ids"])
+            known[known] = (
+                dimensions["inventory_ids"][inventory_code[known]]
+                == inventory_id[known]
+            )
+            inventory_code = np.where(known, inventory_code, -1)
+
+            self._snapshot = _Snapshot(
+                watermarks=watermarks,
+                rental_id=rental_id,
+                rental_day=rental_day,
+                return_day=return_day,
+                inventory_id=inventory_id,
+                inventory_code=inventory_code,
+                **dimensions,
+            )
+            self._last_refresh = time.monotonic()
+            return len(new_id)
+
+    # Rentals matching the date range, with their inventory codes
+    def _facts(self, snapshot, start=None, end=None):
+        mask = snapshot.inventory_code >= 0
+        if start is not None:
+            mask &= snapshot.rental_day >= _days([start])[0]
+        if end is not None:
+            mask &= snapshot.rental_day <= _days([end])[0]
+        return np.flatnonzero(mask)
+
+    # Group keys for each selected rental; rows may repeat for many-to-many groups
+    def _group_keys(self, snapshot, rows, by):
+        inventory = snapshot.inventory_code[rows]
+        film = snapshot.inventory_film[inventory]
+        if by == "film":
+            return rows, snapshot.film_ids[film]
+        if by == "store":
+            return rows, snapshot.inventory_store[inventory]
+        if by == "category":
+            expanded, keys = _expand(
+                film, snapshot.category_indptr, snapshot.category_ids
+            )
+        else:
+            expanded, keys = _expand(film, snapshot.actor_indptr, snapshot.actor_ids)
+        return rows[expanded], keys
+
+    # Sum one weight per rental by group and period
+    def _aggregate(self, by, period, start, end, weights, limit):
+        if by not in GROUPS:
+            raise ValueError(
+                f"Invalid group '{by}', expected one of {', '.join(GROUPS)}"
+            )
+        if period not in PERIODS:
+            raise ValueError("Invalid period, expected day or month")
+
+        self.refresh()
+        snapshot = self._snapshot
+        rows, keys = self._group_keys(snapshot, self._facts(snapshot, start, end), by)
+        if len(rows) == 0:
+            return []
+
+        group_ids, group_codes = _encode(keys)
+        if period is None:
+            period_ids, period_codes = np.zeros(1, np.int32), np.zeros(
+                len(rows), np.int64
+            )
+        else:
+            days = snapshot.rental_day[rows]
+            values = days if period == "day" else _month(days)
+            period_ids, period_codes = _encode(values)
+
+        values = weights(snapshot, rows)
+        totals = np.bincount(
+            group_codes * len(period_ids) + period_codes,
+            weights=values,
+            minlength=len(group_ids) * len(period_ids),
+        )
+        counts = np.bincount(
+            group_codes * len(period_ids) + period_codes,
+            minlength=len(group_ids) * len(period_ids),
+        )
+        cells = np.flatnonzero(counts)
+
+        if period is None:
+            # Whole range: rank groups by total, highest first
+            cells = cells[np.argsort(-totals[cells], kind="stable")]
+            if limit is not None:
+                cells = cells[:limit]
+
+        results = []
+        for cell in cells:
+            group, period_code = divmod(int(cell), len(period_ids))
+            result = {f"{by}_id": int(group_ids[group])}
+            if period is not None:
+                result["period"] = _label(period, period_ids[period_code])
+            result["rentals"] = int(counts[cell])
+            result["value"] = float(totals[cell])
+            results.append(result)
+        return results
+
+    # Rental counts by film, category, store or actor, per day, month or in total
+    def rentals(self, by="film", period=None, start=None, end=None, limit=None):
+        results = self._aggregate(
+            by,
+            period,
+            start,
+            end,
+            lambda snapshot, rows: np.ones(len(rows), dtype=np.float64),
+            limit,
+        )
+        for result in results:
+            del result["value"]
+        return results
+
+    # Rental revenue at each film's rental_rate, grouped like rentals()
+    def revenue(self, by="film", period=None, start=None, end=None, limit=None):
+        results = self._aggregate(
+            by,
+            period,
+            start,
+            end,
+            lambda snapshot, rows: snapshot.film_rate[
+                snapshot.inventory_film[snapshot.inventory_code[rows]]
+            ],
+            limit,
+        )
+        for result in results:
+            result["revenue"] = round(result.pop("value"), 2)
+        return results
+
+    # Share of days each copy (or each film's copies) spent rented out in [start, end]
+    def utilization(self, start, end, by="inventory", limit=None):
+        if by not in ("inventory", "film"):
+            raise ValueError("Invalid group, expected inventory or film")
+
+        self.refresh()
+        snapshot = self._snapshot
+        first, last = _days([start])[0], _days([end])[0]
+        span = int(last - first) + 1
+        if span <= 0:
+            raise ValueError("end must not be before start")
+
+        # Days each rental overlaps the window, open rentals run to the end
+        known = snapshot.inventory_code >= 0
+        rented_from = np.maximum(snapshot.rental_day[known], first)
+        rented_to = np.minimum(snapshot.return_day[known], last + 1)
+        overlap = np.clip(rented_to - rented_from, 0, None).astype(np.float64)
+        inventory = snapshot.inventory_code[known]
+
+        copies = len(snapshot.inventory_ids)
+        rented_days = np.bincount(inventory, weights=overlap, minlength=copies)
+        if by == "inventory":
+            ids = snapshot.inventory_ids
+            available_days = np.full(copies, span, dtype=np.float64)
+        else:
+            films = len(snapshot.film_ids)
+            rented_days = np.bincount(
+                snapshot.inventory_film, weights=rented_days, minlength=films
+            )
+            available_days = (
+                np.bincount(snapshot.inventory_film, minlength=films) * span
+            ).astype(np.float64)
+            ids = snapshot.film_ids
+
+        stocked = np.flatnonzero(available_days)
+        ratio = np.minimum(rented_days[stocked] / available_days[stocked], 1.0)
+        order = np.argsort(-ratio, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+
+        return [
+            {
+                f"{by}_id": int(ids[stocked[i]]),
+                "rented_days": int(rented_days[stocked[i]]),
+                "utilization": round(float(ratio[i]), 4),
+            }
+            for i in order
+        ]
+
+
+engine = RentalAnalytics()
@@ -0,0 +1,134 @@
+# app/archive.py
+
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, delete, insert, literal, select
+from . import app, db, rollups, shards
+from .models import (
+    Payment,
+    PaymentRentalArchive,
+    Rental,
+    RentalArchive,
+    RollupWatermark,
+)
+
+# Moves closed rentals older than ARCHIVE_AFTER_DAYS from rental into
+# rental_archive, so the aggregates that join rental only see open and recent
+# rows. Each batch is copied and deleted in its own short transaction.
+#
+# Counters stay correct: the leaderboard rollups are caught up first and only
+# rentals below the window their catch-ups rescan are archived, and the
+# analytics engine loads from both tables. History routes read the archive when asked to.
+#
+# With store shards, each shard archives its own rentals. Shards are not
+# rolled up: their leaderboard counts read rental_archive as well, so any
+# closed rental past the cutoff may be archived.
+#
+# Sakila's payment.rental_id is ON DELETE SET NULL, so deleting a rental
+# would cut its payments loose. Each batch first copies the payment ->
+# rental links of its rentals into payment_rental_archive; payment history
+# for archived rentals joins through that table.
+#
+# rental_archive and payment_rental_archive are created by misc/setup_db.py.
+
+# Columns shared by rental and rental_archive
+HISTORY_COLUMNS = (
+    "rental_id",
+    "rental_date",
+    "inventory_id",
+    "customer_id",
+    "return_date",
+    "staff_id",
+)
+
+_lock = threading.Lock()
+
+
+# Table expression for raw SQL history queries, aliased as "rental"; with
+# include_archive the archived rentals are unioned in
+def rental_source(include_archive):
+    if not include_archive:
+        return "rental"
+    columns = ", ".join(HISTORY_COLUMNS)
+    return (
+        f"(SELECT {columns} FROM rental"
+        f" UNION ALL SELECT {columns} FROM rental_archive) AS rental"
+    )
+
+
+# Archive closed rentals returned before the cutoff, oldest first.
+# Returns the number archived and whether any eligible rentals remain.
+def archive_rentals(older_than_days=None, batch_size=None, max_batches=None):
+    days = older_than_days or app.config["ARCHIVE_AFTER_DAYS"]
+    batch_size = batch_size or app.config["ARCHIVE_BATCH_SIZE"]
+    max_batches = max_batches or app.config["ARCHIVE_MAX_BATCHES"]
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    with _lock:
+        if shards.enabled():
+            high = None
+        else:
+            # A rental may leave the table only once the rollups have counted
+            # it and their catch-ups no longer rescan it
+            rollups.refresh_rollups(force=True)
+            mark = db.session.get(RollupWatermark, rollups.WATERMARK_NAME)
+            high = (mark.last_rental_id if mark else 0) - app.config["WATERMARK_SLACK"]
+            db.session.commit()
+
+        archived, remaining = 0, False
+        for shard in shards.engines():
+            with shard.connect() as connection:
+                shard_archived, shard_remaining = _archive_batches(
+                    connection, high, cutoff, batch_size, max_batches
+                )
+            archived += shard_archived
+            remaining = remaining or shard_remaining
+        return archived, remaining
+
+
+# Archive up to max_batches batches on one database, below rental_id high
+# if given. Returns the number archived and whether eligible rentals remain.
+def _archive_batches(connection, high, cutoff, batch_size, max_batches):
+    eligible = [Rental.return_date.is_not(None), Rental.return_date < cutoff]
+    if high is not None:
+        eligible.append(Rental.rental_id <= high)
+    columns = [getattr(Rental, name) for name in HISTORY_COLUMNS]
+    archived = 0
+    for _ in range(max_batches):
+        ids = (
+            connection.execute(
+                select(Rental.rental_id)
+                .where(*eligible)
+                .order_by(Rental.rental_id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            connection.rollback()
+            return archived, False
+
+        batch = Rental.rental_id.in_(ids) & Rental.return_date.is_not(None)
+        connection.execute(
+            insert(RentalArchive).from_select(
+                list(HISTORY_COLUMNS) + ["archived_at"],
+                select(*columns, literal(datetime.utcnow(), DateTime)).where(batch),
+            )
+        )
+        connection.execute(
+            insert(PaymentRentalArchive).from_select(
+                ["payment_id", "rental_id"],
+                select(Payment.payment_id, Payment.rental_id).where(
+                    Payment.rental_id.in_(ids)
+                ),
+            )
+        )
+        connection.execute(delete(Rental).where(batch))
+        connection.commit()
+        archived += len(ids)
+
+        if len(ids) < batch_size:
+            return archived, False
+
+    return archived, True
@@ -0,0 +1,169 @@
+# app/batch.py
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, jsonify, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+from . import admission, app, db, timeouts
+
+# One round trip for several GET requests. POST /batch takes
+#
+#   {"requests": [{"id": "films", "path": "/top_rented_movies?window=7d"},
+#                 "/check_customer/5", ...],
+#    "parallel": false}
+#
+# and dispatches every sub-request to its view function inside a nested
+# request context, returning {"responses": [{"id", "path", "status", "body"}]}
+# in request order. A failing sub-request only fails its own item.
+#
+# Run one after the other (the default), the sub-requests share the batch's
+# app context and so its db.session and the connection it holds. With
+# "parallel": true they run on a pool of BATCH_WORKERS threads, each with its
+# own session. Sub-requests carry the batch's headers (so admin tokens work),
+# go through admission control like the request they stand for (route
+# limits and the client's token bucket), get their own route's statement
+# deadline and count against the batch's query budget; profiling applies to
+# the batch as a whole. Only JSON bodies can be batched: streamed responses
+# (the rental export) and other formats (?format=msgpack) fail their item.
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config["BATCH_WORKERS"], thread_name_prefix="batch"
+            )
+    return _executor
+
+
+# (id, path) of each sub-request, or raise ValueError
+def _parse(items):
+    if not isinstance(items, list) or not items:
+        raise ValueError("'requests' must be a non-empty list")
+    limit = app.config["BATCH_MAX_REQUESTS"]
+    if len(items) > limit:
+        raise ValueError(f"At most {limit} requests per batch")
+
+    parsed = []
+    for position, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"path": item}
+        path = item.get("path") if isinstance(item, dict) else None
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError(f"Request {position} needs a path starting with '/'")
+        parsed.append((item.get("id", position), path))
+    return parsed
+
+
+def _environ(path):
+    path, _, query_string = path.partition("?")
+    headers = [
+        (name, value)
+        for name, value in request.headers
+        if name.lower() not in ("content-type", "content-length", "accept")
+    ]
+    headers.append(("Accept", "application/json"))
+    return EnvironBuilder(
+        path=path,
+        query_string=query_string,
+        method="GET",
+        headers=headers,
+        environ_base={"REMOTE_ADDR": request.remote_addr},
+    ).get_environ()
+
+
+# Status and body of a sub-request's response
+def _result(response):
+    if response.is_streamed:
+        response.close()
+        return 400, {"error": "Streamed responses cannot be batched"}
+    if not response.is_json:
+        return 406, {
+            "error": f"Only JSON responses can be batched, not {response.mimetype}"
+        }
+    return response.status_code, response.get_json()
+
+
+# Run one sub-request in a request context for environ
+def _dispatch(request_id, environ, inherited, shared):
+    if not shared:
+        # On a pool thread, with an app context (and session) of its own
+        with app.request_context(environ):
+            vars(g).update(inherited)
+            return (request_id, *_respond())
+
+    # The sub-request's context shares the batch's app context and g. Hide
+    # the batch's entries from it so its teardown hooks (admission release)
+    # act on the sub-request only, and put them back afterwards.
+    saved = dict(vars(g))
+    vars(g).clear()
+    vars(g).update(inherited)
+    try:
+        with app.request_context(environ):
+            return (request_id, *_respond())
+    finally:
+        vars(g).clear()
+        vars(g).update(saved)
+
+
+def _respond():
+    try:
+        if request.routing_exception is not None:
+            raise request.routing_exception
+        # Released by the sub-request's teardown
+        rejected = admission.admit_request()
+        if rejected is not None:
+            return _result(rejected)
+        timeouts.set_statement_deadline()
+        view = app.view_functions[request.url_rule.endpoint]
+        response = app.make_response(view(**request.view_args))
+    except HTTPException as error:
+        return error.code, {"error": error.description}
+    except Exception as error:
+        db.session.rollback()
+        try:
+            # Registered handlers, e.g. the statement timeout one
+            response = app.make_response(app.handle_user_exception(error))
+        except Exception:
+            app.logger.exception("Batch sub-request %s failed", request.path)
+            return 500, {"error": "Internal server error"}
+    return _result(response)
+
+
+# Route to run several GET requests in one round trip
+@app.route("/batch", methods=["POST"])
+def batch():
+    data = request.get_json(silent=True) or {}
+    try:
+        items = _parse(data.get("requests"))
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    # Sub-requests log their statements to the batch's query budget
+    inherited = {"query_log": g.query_log} if "query_log" in g else {}
+    calls = [(request_id, path, _environ(path)) for request_id, path in items]
+    if data.get("parallel") and len(calls) > 1:
+        futures = [
+            _pool().submit(_dispatch, request_id, environ, inherited, False)
+            for request_id, _, environ in calls
+        ]
+        results = [future.result() for future in futures]
+    else:
+        results = [
+            _dispatch(request_id, environ, inherited, True)
+            for request_id, _, environ in calls
+        ]
+
+    return jsonify(
+        {
+            "responses": [
+                {"id": request_id, "path": path, "status": status, "body": body}
+                for (request_id, status, body), (_, path, _) in zip(results, calls)
+            ]
+        }
+    )
@@ -0,0 +1,324 @@
+# app/cache.py
+
+import functools
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, jsonify, request
+from . import app
+
+# Result cache for whole responses, with pluggable backends:
+#   "memory" - per-process dict with TTL and LRU eviction
+#   "sqlite" - one SQLite file shared by every worker process on the host
+#   "client" - any redis-like client (get/set with ex=/delete/incr); tests and
+#              local runs use LocalCacheClient as a stand-in for a remote cache
+# Keys are namespaced and carry the namespace's version number. Write routes
+# call invalidate(namespace), which bumps the version so that every worker
+# stops seeing the old entries at once; those entries then age out.
+
+
+class MemoryCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                " key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_entry_accessed"
+                " ON cache_entry (accessed)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_version ("
+                " namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+
+    # One connection per thread; WAL lets workers read while another writes
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value, expires FROM cache_entry WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            connection.execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+            return None
+        connection.execute(
+            "UPDATE cache_entry SET accessed = ? WHERE key = ?", (time.time(), key)
+        )
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, expires, accessed)"
+            " VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value), now + ttl, now),
+        )
+        # Drop expired entries first, then the least recently used ones
+        (count,) = connection.execute("SELECT COUNT(*) FROM cache_entry").fetchone()
+        if count > self.max_entries:
+            connection.execute("DELETE FROM cache_entry WHERE expires < ?", (now,))
+            connection.execute(
+                "DELETE FROM cache_entry WHERE key IN ("
+                " SELECT key FROM cache_entry ORDER BY accessed"
+                " LIMIT max(0, (SELECT COUNT(*) FROM cache_entry) - ?))",
+                (self.max_entries,),
+            )
+
+    def version(self, namespace):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT version FROM cache_version WHERE namespace = ?", (namespace,)
+            )
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._connection().execute(
+            "INSERT INTO cache_version (namespace, version) VALUES (?, 1)"
+            " ON CONFLICT (namespace) DO UPDATE SET version = version + 1",
+            (namespace,),
+        )
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entry")
+
+
+class ClientCache:
+    # Adapter for a redis-like client; the client handles TTL and eviction
+    def __init__(self, client, prefix="sakila:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def version(self, namespace):
+        value = self.client.get(f"{self.prefix}version:{namespace}")
+        return int(value) if value is not None else 0
+
+    def bump(self, namespace):
+        self.client.incr(f"{self.prefix}version:{namespace}")
+
+    def clear(self):
+        # Bumping versions is how entries are dropped on a shared remote cache
+        pass
+
+
+class LocalCacheClient:
+    # In-process stand-in for a remote cache server, speaking the subset of
+    # the redis client API that ClientCache uses
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[name]
+                return None
+            self._data.move_to_end(name)
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (value, None if ex is None else time.time() + ex)
+            self._data.move_to_end(name)
+            # Like redis' volatile-lru policy, only keys with a TTL are evicted,
+            # so the version counters survive
+            if len(self._data) > self.max_entries:
+                for key in [k for k, (_, expires) in self._data.items() if expires]:
+                    if len(self._data) <= self.max_entries:
+                        break
+                    del self._data[key]
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def incr(self, name):
+        with self._lock:
+            value, expires = self._data.get(name, (b"0", None))
+            value = str(int(value) + 1).encode()
+            self._data[name] = (value, expires)
+            return int(value)
+
+
+_lock = threading.Lock()
+_backend = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+# Build the backend named by RESULT_CACHE_BACKEND on first use
+def backend():
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = create_backend(app.config)
+    return _backend
+
+
+def create_backend(config):
+    kind = config["RESULT_CACHE_BACKEND"]
+    max_entries = config["RESULT_CACHE_MAX_ENTRIES"]
+    if kind == "memory":
+        return MemoryCache(max_entries)
+    if kind == "sqlite":
+        path = config["RESULT_CACHE_PATH"] or os.path.join(
+            tempfile.gettempdir(), "sakila_result_cache.sqlite"
+        )
+        return SQLiteCache(path, max_entries)
+    if kind == "client":
+        return ClientCache(
+            config["RESULT_CACHE_CLIENT"] or LocalCacheClient(max_entries)
+        )
+    raise ValueError(f"Unknown RESULT_CACHE_BACKEND '{kind}'")
+
+
+# Replace the backend, e.g. with a ClientCache around a test double
+def use_backend(cache_backend):
+    global _backend
+    with _lock:
+        _backend = cache_backend
+
+
+# Drop every cached response in the namespace, in all workers
+def invalidate(namespace):
+    if not app.config["RESULT_CACHE_ENABLED"]:
+        return
+    backend().bump(namespace)
+    _count("invalidations")
+
+
+def _request_key(namespace, version):
+    from . import formats
+
+    return "|".join(
+        [
+            namespace,
+            str(version),
+            request.endpoint,
+            repr(sorted((request.view_args or {}).items())),
+            repr(sorted(request.args.items(multi=True))),
+            formats.negotiated_format(),
+        ]
+    )
+
+
+# Decorator caching a view's successful responses in the given namespace.
+# The view is called uncached whenever bypass() is true.
+def cached(namespace, ttl=None, bypass=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config["RESULT_CACHE_ENABLED"] or (bypass and bypass()):
+                return view(*args, **kwargs)
+
+            cache = backend()
+            key = _request_key(namespace, cache.version(namespace))
+            entry = cache.get(key)
+            if entry is not None:
+                _count("hits")
+                body, status, headers = entry
+                return Response(body, status=status, headers=headers)
+
+            _count("misses")
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(
+                    key,
+                    (response.get_data(), response.status_code, list(response.headers)),
+                    ttl or app.config["RESULT_CACHE_TTL"],
+                )
+                _count("stores")
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# Route to get result cache counters for this worker
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    with _lock:
+        stats = dict(_stats)
+    stats["backend"] = app.config["RESULT_CACHE_BACKEND"]
+    stats["enabled"] = app.config["RESULT_CACHE_ENABLED"]
+    return jsonify(stats)
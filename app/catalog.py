@@ -0,0 +1,204 @@
+# app/catalog.py
+
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import text
+from . import app, cache, db, shards, statements
+
+# Immutable in-memory snapshot of the film catalog (film, category,
+# film_category, actor, film_actor, plus copy counts from inventory).
+# Catalog read routes are answered from it without SQL. A new snapshot is
+# built off to the side and swapped in with one reference assignment, either
+# when the periodic version check sees a change or on an admin reload.
+#
+# With store shards, inventory lives on the shards: copy counts are summed
+# over every shard and the version check fingerprints each shard's inventory.
+
+CATALOG_TABLES = (
+    "film",
+    "category",
+    "film_category",
+    "actor",
+    "film_actor",
+    "inventory",
+)
+
+# Columns of the /all_films listing
+FILM_LIST_COLUMNS = (
+    "film_id",
+    "title",
+    "description",
+    "release_year",
+    "rating",
+    "special_features",
+)
+
+Actor = namedtuple("Actor", ["actor_id", "first_name", "last_name"])
+
+_lock = threading.Lock()
+_snapshot = None
+_last_check = 0.0
+
+
+class Catalog:
+    __slots__ = (
+        "version",
+        "loaded_at",
+        "film_columns",
+        "films",
+        "film_list",
+        "film_by_id",
+        "film_by_title",
+        "categories",
+        "film_ids_by_category",
+        "actors",
+        "actor_ids_by_film",
+        "copies_by_film",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    # Films whose category name contains the given text, like the SQL LIKE '%...%'
+    def films_in_categories_like(self, fragment):
+        fragment = fragment.casefold()
+        films = []
+        for category_id, name in self.categories.items():
+            if fragment in name.casefold():
+                films.extend(
+                    self.film_by_id[film_id]
+                    for film_id in self.film_ids_by_category.get(category_id, ())
+                )
+        return films
+
+    def film_titled(self, title):
+        return self.film_by_title.get(title.casefold())
+
+
+def _fingerprint(connection, table):
+    return tuple(
+        connection.execute(
+            text(f"SELECT COUNT(*), MAX(last_update) FROM {table}")
+        ).one()
+    )
+
+
+# Cheap fingerprint of the catalog tables: row count and last change per table
+def current_version(connection):
+    if not shards.enabled():
+        return tuple(_fingerprint(connection, table) for table in CATALOG_TABLES)
+    return tuple(
+        _fingerprint(connection, table)
+        for table in CATALOG_TABLES
+        if table != "inventory"
+    ) + tuple(shards.scatter(lambda connection: _fingerprint(connection, "inventory")))
+
+
+# Copies per film, counted on every shard when sharded
+def _copies_by_film(connection, films):
+    if not shards.enabled():
+        return {
+            film_id: copies
+            for film_id, _, copies in connection.execute(statements.MOVIE_COPIES_INFO)
+        }
+    copies_by_film = {film.film_id: 0 for film in films}
+    for partial in shards.scatter(
+        lambda connection: connection.execute(
+            text("SELECT film_id, COUNT(*) FROM inventory GROUP BY film_id")
+        ).all()
+    ):
+        for film_id, copies in partial:
+            if film_id in copies_by_film:
+                copies_by_film[film_id] += copies
+    return copies_by_film
+
+
+def load():
+    with db.engine.connect() as connection:
+        version = current_version(connection)
+
+        result = connection.execute(text("SELECT * FROM film ORDER BY film_id"))
+        film_columns = tuple(result.keys())
+        Film = namedtuple("Film", film_columns)
+        films = tuple(Film(*row) for row in result)
+
+        categories = {
+            category_id: name
+            for category_id, name in connection.execute(
+                text("SELECT category_id, name FROM category ORDER BY category_id")
+            )
+        }
+        film_ids_by_category = {}
+        for film_id, category_id in connection.execute(
+            text("SELECT film_id, category_id FROM film_category ORDER BY film_id")
+        ):
+            film_ids_by_category.setdefault(category_id, []).append(film_id)
+
+        actors = {
+            row[0]: Actor(*row)
+            for row in connection.execute(
+                text("SELECT actor_id, first_name, last_name FROM actor")
+            )
+        }
+        actor_ids_by_film = {}
+        for film_id, actor_id in connection.execute(
+            text("SELECT film_id, actor_id FROM film_actor ORDER BY actor_id")
+        ):
+            actor_ids_by_film.setdefault(film_id, []).append(actor_id)
+
+        copies_by_film = _copies_by_film(connection, films)
+
+    film_by_title = {}
+    for film in films:
+        film_by_title.setdefault(film.title.casefold(), film)
+
+    return Catalog(
+        version=version,
+        loaded_at=time.time(),
+        film_columns=film_columns,
+        films=films,
+        film_list=tuple(
+            tuple(getattr(film, column) for column in FILM_LIST_COLUMNS)
+            for film in films
+        ),
+        film_by_id={film.film_id: film for film in films},
+        film_by_title=film_by_title,
+        categories=categories,
+        film_ids_by_category={k: tuple(v) for k, v in film_ids_by_category.items()},
+        actors=actors,
+        actor_ids_by_film={k: tuple(v) for k, v in actor_ids_by_film.items()},
+        copies_by_film=copies_by_film,
+    )
+
+
+# Build a new snapshot and swap it in
+def reload():
+    global _snapshot, _last_check
+    with _lock:
+        _snapshot = load()
+        _last_check = time.monotonic()
+    return _snapshot
+
+
+# The current snapshot, loading it on first use and reloading it when the
+# throttled version check finds the catalog tables changed
+def current():
+    global _snapshot, _last_check
+    snapshot = _snapshot
+    if snapshot is None:
+        return reload()
+
+    interval = app.config["CATALOG_CHECK_SECONDS"]
+    if interval and time.monotonic() - _last_check >= interval:
+        with _lock:
+            if time.monotonic() - _last_check >= interval:
+                _last_check = time.monotonic()
+                with db.engine.connect() as connection:
+                    changed = current_version(connection) != _snapshot.version
+                if changed:
+                    _snapshot = load()
+                    cache.invalidate("catalog")
+        snapshot = _snapshot
+    return snapshot
@@ -0,0 +1,157 @@
+# app/costars.py
+
+import threading
+from collections import deque
+import numpy as np
+from . import catalog
+
+# Actor co-star graph built from the film_actor pairs of the in-memory
+# catalog. Actors are coded 0..n-1 in actor_id order and their co-stars are
+# stored in CSR form: the co-stars of code c are neighbors[indptr[c]:
+# indptr[c + 1]], ranked by shared films (then actor_id), with the number of
+# shared films in weights. A new graph is built whenever the catalog snapshot
+# is replaced, which happens when its version check sees film_actor change.
+
+
+class CoStarGraph:
+    __slots__ = (
+        "snapshot",
+        "actor_ids",
+        "indptr",
+        "neighbors",
+        "weights",
+        "film_ids_by_actor",
+    )
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+        memberships = [
+            (film_id, actor_id)
+            for film_id, actor_ids in snapshot.actor_ids_by_film.items()
+            for actor_id in actor_ids
+        ]
+        pairs = np.array(memberships, dtype=np.int64).reshape(-1, 2)
+        self.actor_ids = np.unique(
+            np.concatenate([np.fromiter(snapshot.actors, np.int64), pairs[:, 1]])
+        )
+
+        self.film_ids_by_actor = {}
+        for film_id, actor_id in memberships:
+            self.film_ids_by_actor.setdefault(actor_id, set()).add(film_id)
+
+        # Self-join the (film, actor) rows on film: every row is repeated once
+        # per cast member of its film
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        films = pairs[order, 0]
+        actors = np.searchsorted(self.actor_ids, pairs[order, 1])
+        starts = np.searchsorted(films, films, side="left")
+        sizes = np.searchsorted(films, films, side="right") - starts
+        rows = np.repeat(np.arange(len(films)), sizes)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        source, target = actors[rows], actors[starts[rows] + offsets]
+        distinct = source != target
+        source, target = source[distinct], target[distinct]
+
+        # Count shared films per co-star pair, then rank each actor's co-stars
+        keys, shared = np.unique((source << 32) | target, return_counts=True)
+        source, target = keys >> 32, keys & np.int64(0xFFFFFFFF)
+        order = np.lexsort((target, -shared, source))
+        self.neighbors = target[order]
+        self.weights = shared[order]
+        self.indptr = np.zeros(len(self.actor_ids) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(source, minlength=len(self.actor_ids)),
+            out=self.indptr[1:],
+        )
+
+    def code(self, actor_id):
+        position = np.searchsorted(self.actor_ids, actor_id)
+        if position < len(self.actor_ids) and self.actor_ids[position] == actor_id:
+            return int(position)
+        return None
+
+    # (actor_id, shared films) for the actor's top co-stars
+    def co_stars(self, actor_id, limit):
+        code = self.code(actor_id)
+        if code is None:
+            return None
+        start = self.indptr[code]
+        stop = min(self.indptr[code + 1], start + limit)
+        return list(
+            zip(
+                self.actor_ids[self.neighbors[start:stop]].tolist(),
+                self.weights[start:stop].tolist(),
+            )
+        )
+
+    def _neighbors(self, code):
+        return self.neighbors[self.indptr[code] : self.indptr[code + 1]].tolist()
+
+    # Shortest chain of co-stars from one actor to another, found by a
+    # bidirectional BFS that always expands the smaller frontier. Returns the
+    # actor_ids along the path, or None when the actors are not connected.
+    def shortest_path(self, from_actor_id, to_actor_id):
+        source, target = self.code(from_actor_id), self.code(to_actor_id)
+        if source is None or target is None:
+            return None
+        if source == target:
+            return [from_actor_id]
+
+        parents = ({source: None}, {target: None})
+        frontiers = (deque([source]), deque([target]))
+        meeting = None
+        while frontiers[0] and frontiers[1] and meeting is None:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, other = parents[side], parents[1 - side]
+            for _ in range(len(frontiers[side])):
+                code = frontiers[side].popleft()
+                for neighbor in self._neighbors(code):
+                    if neighbor in seen:
+                        continue
+                    seen[neighbor] = code
+                    if neighbor in other:
+                        meeting = neighbor
+                        break
+                    frontiers[side].append(neighbor)
+                if meeting is not None:
+                    break
+
+        if meeting is None:
+            return None
+
+        path = []
+        code = meeting
+        while code is not None:
+            path.append(code)
+            code = parents[0][code]
+        path.reverse()
+        code = parents[1][meeting]
+        while code is not None:
+            path.append(code)
+            code = parents[1][code]
+        return self.actor_ids[path].tolist()
+
+    # One film shared by each consecutive pair of actors on a path
+    def linking_films(self, path):
+        return [
+            min(self.film_ids_by_actor[a] & self.film_ids_by_actor[b])
+            for a, b in zip(path, path[1:])
+        ]
+
+
+_lock = threading.Lock()
+_graph = None
+
+
+# The graph for the current catalog snapshot, rebuilt when the snapshot changes
+def current():
+    global _graph
+    snapshot = catalog.current()
+    graph = _graph
+    if graph is None or graph.snapshot is not snapshot:
+        with _lock:
+            if _graph is None or _graph.snapshot is not snapshot:
+                _graph = CoStarGraph(snapshot)
+            graph = _graph
+    return graph
@@ -0,0 +1,111 @@
+# app/facets.py
+
+import threading
+import numpy as np
+from . import catalog
+
+# Faceted film filtering over the in-memory catalog. Every facet value has a
+# bitset over the catalog's films (bit i is films[i], in film_id order),
+# packed into uint8 words. A selection ANDs the facets together; within a
+# facet the chosen values are ORed ("any") or ANDed ("all"). Facet counts use
+# the usual disjunctive rule: each facet is counted against the selection on
+# the other facets, so a client can see what widening that facet would add.
+# The index is rebuilt whenever the catalog swaps in a new snapshot.
+
+FACETS = ("genre", "rating", "year", "feature")
+
+
+class FacetIndex:
+    __slots__ = ("snapshot", "size", "everything", "bitsets")
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        films = snapshot.films
+        self.size = len(films)
+        position = {film.film_id: i for i, film in enumerate(films)}
+
+        members = {facet: {} for facet in FACETS}
+        for i, film in enumerate(films):
+            if film.rating is not None:
+                members["rating"].setdefault(str(film.rating), []).append(i)
+            if film.release_year is not None:
+                members["year"].setdefault(str(film.release_year), []).append(i)
+            # special_features is a SET column: a comma-separated string
+            for feature in (film.special_features or "").split(","):
+                if feature:
+                    members["feature"].setdefault(feature, []).append(i)
+        for category_id, name in snapshot.categories.items():
+            members["genre"][name] = [
+                position[film_id]
+                for film_id in snapshot.film_ids_by_category.get(category_id, ())
+                if film_id in position
+            ]
+
+        self.everything = self._pack(range(self.size))
+        self.bitsets = {
+            facet: {value: self._pack(rows) for value, rows in values.items()}
+            for facet, values in members.items()
+        }
+
+    def _pack(self, rows):
+        bits = np.zeros(self.size, dtype=bool)
+        bits[list(rows)] = True
+        return np.packbits(bits, bitorder="little")
+
+    # Films matching one facet's chosen values, or None when it is not filtered
+    def _facet_match(self, facet, values, match_all):
+        if not values:
+            return None
+        empty = np.zeros_like(self.everything)
+        bitsets = [self.bitsets[facet].get(value, empty) for value in values]
+        combine = np.bitwise_and if match_all else np.bitwise_or
+        return combine.reduce(bitsets)
+
+    # selection maps facet -> (values, match_all). Returns the number of
+    # matching films, one page of them and the per-facet value counts.
+    def search(self, selection, offset, limit):
+        matches = {
+            facet: self._facet_match(facet, *selection.get(facet, ((), False)))
+            for facet in FACETS
+        }
+
+        def combined(skip=None):
+            result = self.everything
+            for facet, bits in matches.items():
+                if facet != skip and bits is not None:
+                    result = result & bits
+            return result
+
+        selected = combined()
+        rows = np.flatnonzero(
+            np.unpackbits(selected, count=self.size, bitorder="little")
+        )
+
+        counts = {}
+        for facet in FACETS:
+            base = combined(skip=facet)
+            counts[facet] = {
+                value: int(np.bitwise_count(base & bits).sum())
+                for value, bits in sorted(self.bitsets[facet].items())
+            }
+
+        films = self.snapshot.films
+        page = [films[i] for i in rows[offset : offset + limit]]
+        return len(rows), page, counts
+
+
+_lock = threading.Lock()
+_index = None
+
+
+# The index for the current catalog snapshot, rebuilt when the snapshot changes
+def current():
+    global _index
+    snapshot = catalog.current()
+    index = _index
+    if index is None or index.snapshot is not snapshot:
+        with _lock:
+            if _index is None or _index.snapshot is not snapshot:
+                _index = FacetIndex(snapshot)
+            index = _index
+    return index
@@ -0,0 +1,62 @@
+# app/formats.py
+
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are optional
+    msgpack = None
+
+# Content negotiation for list routes. Besides the default list of objects,
+# clients can ask for a columnar JSON body ({"columns": [...], "rows": [...]})
+# or a MessagePack body packed straight from the row tuples.
+
+JSON = "application/json"
+COLUMNAR = "application/vnd.sakila.columnar+json"
+MSGPACK = "application/x-msgpack"
+
+FORMATS = {"json": JSON, "columnar": COLUMNAR, "msgpack": MSGPACK}
+
+
+# Pick the response format from ?format= or else the Accept header
+def negotiated_format():
+    requested = request.args.get("format")
+    if requested in FORMATS:
+        return FORMATS[requested]
+    return request.accept_mimetypes.best_match([JSON, COLUMNAR, MSGPACK], default=JSON)
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    # SQLAlchemy rows pack as arrays
+    return tuple(value)
+
+
+# Respond with rows in the negotiated format; key wraps the default JSON list
+def rows_response(columns, rows, key=None):
+    columns = list(columns)
+    content_type = negotiated_format()
+
+    if content_type == MSGPACK:
+        if msgpack is None:
+            response = jsonify({"error": "MessagePack responses are not available"})
+            response.status_code = 406
+            return response
+        response = Response(
+            msgpack.packb({"columns": columns, "rows": rows}, default=_msgpack_default),
+            mimetype=MSGPACK,
+        )
+    elif content_type == COLUMNAR:
+        response = jsonify({"columns": columns, "rows": [tuple(row) for row in rows]})
+        response.mimetype = COLUMNAR
+    else:
+        data = [dict(zip(columns, row)) for row in rows]
+        response = jsonify({key: data} if key else data)
+
+    response.vary.add("Accept")
+    return response
@@ -13,8 +13,28 @@ class Film(db.Model):
     release_year = db.Column(db.Integer)
     rating = db.Column(db.String(10))
     special_features = db.Column(db.String(255))
+    rental_rate = db.Column(db.Numeric(4, 2))
+    rental_duration = db.Column(db.Integer)
     # Define the relationship with film_actor
     actors = db.relationship("FilmActor", back_populates="film")
+    # Define the relationship with category through film_category
+    categories = db.relationship(
+        "Category", secondary="film_category", order_by="Category.name", viewonly=True
+    )
+
+
+class Category(db.Model):
+    __tablename__ = "category"
+    category_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(25), nullable=False)
+
+
+class FilmCategory(db.Model):
+    __tablename__ = "film_category"
+    film_id = db.Column(db.Integer, db.ForeignKey("film.film_id"), primary_key=True)
+    category_id = db.Column(
+        db.Integer, db.ForeignKey("category.category_id"), primary_key=True
+    )
 
 
 class Actor(db.Model):
@@ -42,12 +62,14 @@ class Inventory(db.Model):
     inventory_id = db.Column(db.Integer, primary_key=True)
     film_id = db.Column(db.Integer, db.ForeignKey("film.film_id"))
     film = db.relationship("Film", backref="inventory")
+    store_id = db.Column(db.Integer)
     available_copies = db.Column(db.Integer)
 
 
 class Staff(db.Model):
     __tablename__ = "staff"
     staff_id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer)
 
 
 class Rental(db.Model):
@@ -63,7 +85,80 @@ class Rental(db.Model):
     staff = db.relationship("Staff")  
 
 
+class Payment(db.Model):
+    __tablename__ = "payment"
+    payment_id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.customer_id"))
+    staff_id = db.Column(db.Integer, db.ForeignKey("staff.staff_id"))
+    # ON DELETE SET NULL in Sakila
+    rental_id = db.Column(db.Integer, db.ForeignKey("rental.rental_id"))
+    amount = db.Column(db.Numeric(5, 2))
+    payment_date = db.Column(db.DateTime)
+
+
 class Customer(db.Model):
     __tablename__ = "customer"
     customer_id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer)
+    first_name = db.Column(db.String(45))
+    last_name = db.Column(db.String(45))
+    email = db.Column(db.String(50))
+    address_id = db.Column(db.Integer, db.ForeignKey("address.address_id"))
+    # Indexes backing the prefix search on /customers/search; stock Sakila
+    # only has idx_last_name, misc/setup_db.py creates the others
+    __table_args__ = (
+        db.Index("idx_last_name", "last_name"),
+        db.Index("idx_customer_first_name", "first_name"),
+        db.Index("idx_customer_email", "email"),
+    )
+
+
+class Address(db.Model):
+    __tablename__ = "address"
+    address_id = db.Column(db.Integer, primary_key=True)
+    address = db.Column(db.String(50))
+    city_id = db.Column(db.Integer)
+    phone = db.Column(db.String(20))
+    # Created by misc/setup_db.py
+    __table_args__ = (db.Index("idx_address_phone", "phone"),)
+
+
+# Daily per-film rental counts, maintained incrementally from the rental table
+class FilmRentalDaily(db.Model):
+    __tablename__ = "film_rental_daily"
+    film_id = db.Column(db.Integer, db.ForeignKey("film.film_id"), primary_key=True)
+    rental_day = db.Column(db.Date, primary_key=True)
+    rental_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index("idx_film_rental_daily_day", "rental_day"),)
 
+
+# Closed rentals moved out of the rental table by app/archive.py
+class RentalArchive(db.Model):
+    __tablename__ = "rental_archive"
+    rental_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rental_date = db.Column(db.DateTime)
+    inventory_id = db.Column(db.Integer)
+    customer_id = db.Column(db.Integer)
+    return_date = db.Column(db.DateTime)
+    staff_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index("idx_rental_archive_customer", "customer_id"),
+        db.Index("idx_rental_archive_rental_date", "rental_date"),
+    )
+
+
+# Payment -> rental links of archived rentals; deleting a rental sets
+# payment.rental_id to NULL, so app/archive.py keeps the link here
+class PaymentRentalArchive(db.Model):
+    __tablename__ = "payment_rental_archive"
+    payment_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rental_id = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index("idx_payment_rental_archive_rental", "rental_id"),)
+
+
+# Highest rental_id already folded into a rollup
+class RollupWatermark(db.Model):
+    __tablename__ = "rollup_watermark"
+    name = db.Column(db.String(64), primary_key=True)
+    last_rental_id = db.Column(db.Integer, nullable=False, default=0)
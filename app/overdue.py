@@ -0,0 +1,281 @@
+# app/overdue.py
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from . import app, catalog, shards
+from .models import Inventory, Rental
+
+# In-memory queue of open rentals ordered by due date. It is loaded from the
+# database once (open rentals plus every copy's rental_duration) and then kept
+# current by rent_movie and the return routes, so listing overdue rentals and
+# counting them per customer never scans the rental table.
+#
+# Open rentals sit in a min-heap keyed by due date. _advance() pops everything
+# that has come due into an "overdue" map and a per-customer map; both stay
+# sorted by due date because the heap yields entries in that order. Returned
+# rentals are dropped from the maps right away and skipped when they surface
+# in the heap.
+#
+# Each worker process keeps its own tracker and catches up with writes made
+# through other workers every OVERDUE_REFRESH_SECONDS. A refresh never rescans
+# the rental table: it reads rentals above a rental_id watermark (less
+# WATERMARK_SLACK ids, for inserts that committed out of order) and re-checks
+# the rentals it tracks by primary key, dropping those returned or deleted
+# since. Rentals opened or returned in this worker while a refresh reads the
+# database are recorded and applied on top of its result, so none are lost.
+#
+# With store shards, every shard is read and keeps its own watermark, since
+# each shard numbers its rentals from its own auto-increment range. Rental
+# durations come from the catalog snapshot's films.
+
+_CHECK_CHUNK = 1000
+
+
+class _OpenRental:
+    __slots__ = ("rental_id", "customer_id", "inventory_id", "rental_date", "due")
+
+    def __init__(self, rental_id, customer_id, inventory_id, rental_date, due):
+        self.rental_id = rental_id
+        self.customer_id = customer_id
+        self.inventory_id = inventory_id
+        self.rental_date = rental_date
+        self.due = due
+
+    def as_dict(self, now):
+        return {
+            "rental_id": self.rental_id,
+            "customer_id": self.customer_id,
+            "inventory_id": self.inventory_id,
+            "rental_date": self.rental_date,
+            "due_date": self.due,
+            "days_overdue": (now - self.due).days,
+        }
+
+
+class OverdueTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = None
+        self._watermarks = {}
+        self._opened_during_refresh = None
+        self._returned_during_refresh = None
+        self._duration_by_inventory = {}
+        self._heap = []
+        self._pending = {}
+        self._overdue = {}
+        self._overdue_by_customer = {}
+
+    def _film_duration(self, film_id):
+        film = catalog.current().film_by_id.get(film_id)
+        return None if film is None else film.rental_duration
+
+    def _duration(self, inventory_id):
+        duration = self._duration_by_inventory.get(inventory_id)
+        if duration is None:
+            # A copy added after the first load; look its film up once
+            found = shards.scatter(
+                lambda connection: connection.execute(
+                    select(Inventory.film_id).where(
+                        Inventory.inventory_id == inventory_id
+                    )
+                ).scalar()
+            )
+            film_id = next((film_id for film_id in found if film_id is not None), None)
+            duration = self._film_duration(film_id)
+            self._duration_by_inventory[inventory_id] = duration
+        return duration
+
+    def _due_for_refresh(self):
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at
+            > app.config["OVERDUE_REFRESH_SECONDS"]
+        )
+
+    # Catch up with one shard (the main database when unsharded): read its
+    # open rentals above its watermark and which of the tracked rentals it
+    # still has open. Returns (highest rental_id, opened, still open).
+    def _read(self, connection, watermark, tracked):
+        floor = max(watermark - app.config["WATERMARK_SLACK"], 0)
+        high = connection.execute(select(func.max(Rental.rental_id))).scalar()
+        opened = connection.execute(
+            select(
+                Rental.rental_id,
+                Rental.customer_id,
+                Rental.inventory_id,
+                Rental.rental_date,
+            ).where(
+                Rental.rental_id > floor,
+                Rental.rental_id <= (high or 0),
+                Rental.return_date.is_(None),
+            )
+        ).all()
+        still_open = set()
+        for start in range(0, len(tracked), _CHECK_CHUNK):
+            still_open.update(
+                connection.execute(
+                    select(Rental.rental_id).where(
+                        Rental.rental_id.in_(tracked[start : start + _CHECK_CHUNK]),
+                        Rental.return_date.is_(None),
+                    )
+                ).scalars()
+            )
+        return high or 0, opened, still_open
+
+    # Catch up with the database: on the first call load the rental duration
+    # of every copy, then read the open rentals above each shard's watermark
+    # and which of the tracked rentals are still open
+    def refresh(self):
+        with self._lock:
+            self._opened_during_refresh = []
+            self._returned_during_refresh = set()
+            tracked = list(self._pending) + list(self._overdue)
+            watermarks = dict(self._watermarks)
+
+        try:
+            opened, still_open = [], set()
+            with shards.connect_each() as connections:
+                for key, connection in connections:
+                    if self._loaded_at is None:
+                        self._duration_by_inventory.update(
+                            (inventory_id, self._film_duration(film_id))
+                            for inventory_id, film_id in connection.execute(
+                                select(Inventory.inventory_id, Inventory.film_id)
+                            )
+                        )
+                    high, shard_opened, shard_still_open = self._read(
+                        connection, watermarks.get(key, 0), tracked
+                    )
+                    watermarks[key] = max(watermarks.get(key, 0), high)
+                    opened.extend(shard_opened)
+                    still_open.update(shard_still_open)
+            opened = [(*row, self._duration(row.inventory_id)) for row in opened]
+        except Exception:
+            with self._lock:
+                self._opened_during_refresh = None
+                self._returned_during_refresh = None
+            raise
+
+        with self._lock:
+            returned = self._returned_during_refresh
+            opened += self._opened_during_refresh
+            self._opened_during_refresh = None
+            self._returned_during_refresh = None
+            self._drop(
+                rental_id for rental_id in tracked if rental_id not in still_open
+            )
+            for rental in opened:
+                if rental[0] not in returned:
+                    self._push(*rental)
+            self._watermarks = watermarks
+            self._loaded_at = time.monotonic()
+
+    # Refresh when due. Other requests keep reading the current queue while
+    # one refreshes it; only the first load is waited for.
+    def ensure_loaded(self):
+        if not self._due_for_refresh():
+            return
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._due_for_refresh():
+                self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _push(self, rental_id, customer_id, inventory_id, rental_date, duration):
+        if rental_date is None or duration is None:
+            return
+        if rental_id in self._pending or rental_id in self._overdue:
+            return
+        due = rental_date + timedelta(days=duration)
+        rental = _OpenRental(rental_id, customer_id, inventory_id, rental_date, due)
+        self._pending[rental_id] = rental
+        heapq.heappush(self._heap, (due, rental_id))
+
+    def _drop(self, rental_ids):
+        for rental_id in rental_ids:
+            if self._pending.pop(rental_id, None) is not None:
+                continue
+            rental = self._overdue.pop(rental_id, None)
+            if rental is None:
+                continue
+            remaining = self._overdue_by_customer[rental.customer_id]
+            del remaining[rental_id]
+            if not remaining:
+                del self._overdue_by_customer[rental.customer_id]
+
+    # Move every rental that has come due from the heap to the overdue map
+    def _advance(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            _, rental_id = heapq.heappop(self._heap)
+            rental = self._pending.pop(rental_id, None)
+            if rental is None:
+                continue
+            self._overdue[rental_id] = rental
+            self._overdue_by_customer.setdefault(rental.customer_id, {})[
+                rental_id
+            ] = rental
+
+    # Track a rental that was just opened. Before the first load it is only
+    # recorded while that load runs, since a later one reads it anyway.
+    def add(self, rental_id, customer_id, inventory_id, rental_date):
+        if self._loaded_at is None and self._opened_during_refresh is None:
+            return
+        duration = self._duration(inventory_id)
+        rental = (rental_id, customer_id, inventory_id, rental_date, duration)
+        with self._lock:
+            if self._opened_during_refresh is not None:
+                self._opened_during_refresh.append(rental)
+            if self._loaded_at is not None:
+                self._push(*rental)
+
+    # Stop tracking rentals that were returned
+    def remove(self, rental_ids):
+        with self._lock:
+            if self._returned_during_refresh is not None:
+                self._returned_during_refresh.update(rental_ids)
+            self._drop(rental_ids)
+
+    # One page of overdue rentals, most overdue first, and the total count
+    def overdue(self, offset, limit, customer_id=None, now=None):
+        now = now or datetime.utcnow()
+        self.ensure_loaded()
+        with self._lock:
+            self._advance(now)
+            if customer_id is None:
+                rentals = self._overdue
+            else:
+                rentals = self._overdue_by_customer.get(customer_id, {})
+            total = len(rentals)
+            page = [
+                rental.as_dict(now)
+                for rental in itertools.islice(rentals.values(), offset, offset + limit)
+            ]
+        return total, page
+
+    # Number of overdue rentals held by one customer
+    def customer_count(self, customer_id, now=None):
+        self.ensure_loaded()
+        with self._lock:
+            self._advance(now or datetime.utcnow())
+            return len(self._overdue_by_customer.get(customer_id, ()))
+
+    # Customers with the most overdue rentals
+    def top_customers(self, limit, now=None):
+        self.ensure_loaded()
+        with self._lock:
+            self._advance(now or datetime.utcnow())
+            counts = [
+                (customer_id, len(rentals))
+                for customer_id, rentals in self._overdue_by_customer.items()
+            ]
+        return heapq.nlargest(limit, counts, key=lambda item: (item[1], -item[0]))
+
+
+tracker = OverdueTracker()
@@ -0,0 +1,29 @@
+# app/pool.py
+
+import threading
+from sqlalchemy.pool import QueuePool
+
+# Connection pool that counts the threads waiting on it for a connection, so
+# admission control sheds on the pool's real wait queue (see app/admission.py)
+# rather than on every request in flight, most of which may never check out a
+# connection.
+
+
+class WaitCountingPool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiting_lock = threading.Lock()
+        self._waiting = 0
+
+    # Threads currently asking the pool for a connection
+    def waiting(self):
+        return self._waiting
+
+    def _do_get(self):
+        with self._waiting_lock:
+            self._waiting += 1
+        try:
+            return super()._do_get()
+        finally:
+            with self._waiting_lock:
+                self._waiting -= 1
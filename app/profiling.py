@@ -0,0 +1,248 @@
+# app/profiling.py
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+from flask import g, has_request_context, jsonify, request, send_file
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import admin, app
+
+# On-demand request profiling. When PROFILE_ENABLED is set, a request is
+# profiled if it is picked by PROFILE_SAMPLE_RATE or if it carries the
+# PROFILE_HEADER together with a valid admin token. The request runs under
+# cProfile and its SQL statements are timed; the result is written to
+# PROFILE_DIR as <id>.prof (pstats format, for snakeviz or pstats) plus
+# <id>.json (request details and SQL timings). Only the newest
+# PROFILE_MAX_FILES profiles are kept.
+#
+# With profiling disabled the only cost is one config lookup per request;
+# the SQL timing listeners are attached when the first profile starts.
+# Only one request is profiled at a time: on Python 3.12 a second active
+# profiler raises, and a profile there also records other threads' calls.
+# Requests arriving while a profile runs are served unprofiled, and a
+# failure to profile never fails the request.
+# Streamed response bodies are produced after the profile is written and are
+# not included.
+
+# Orderings offered for the function listing of a profile
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+_PROFILE_ID = re.compile(r"^\d{20}-[A-Za-z0-9_.]+$")
+
+_lock = threading.Lock()
+_listening = False
+# Held by the request being profiled
+_active = threading.Lock()
+
+
+def profile_dir():
+    return app.config["PROFILE_DIR"] or os.path.join(
+        tempfile.gettempdir(), "sakila_profiles"
+    )
+
+
+def _wanted():
+    if request.headers.get(app.config["PROFILE_HEADER"]):
+        return "header" if admin.is_admin_request() else None
+    rate = app.config["PROFILE_SAMPLE_RATE"]
+    if rate and random.random() < rate:
+        return "sampled"
+    return None
+
+
+def _listen():
+    global _listening
+    with _lock:
+        if not _listening:
+            event.listen(Engine, "before_cursor_execute", _before_statement)
+            event.listen(Engine, "after_cursor_execute", _after_statement)
+            _listening = True
+
+
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g:
+        started = conn.info["profile_started"].pop()
+        g.profile["sql"].append(
+            {
+                "statement": " ".join(statement.split()),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+        )
+
+
+@app.before_request
+def start_profile():
+    if not app.config["PROFILE_ENABLED"]:
+        return
+    trigger = _wanted()
+    if trigger is None:
+        return
+
+    if not _active.acquire(blocking=False):
+        return
+    try:
+        _listen()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    except Exception:
+        _active.release()
+        app.logger.exception("Could not start a profile")
+        return
+    g.profile = {
+        "profiler": profiler,
+        "trigger": trigger,
+        "started_at": datetime.utcnow().isoformat(),
+        "started": time.perf_counter(),
+        "sql": [],
+    }
+
+
+# Stop the profiler and let the next request be profiled
+def _stop(profile):
+    try:
+        profile["profiler"].disable()
+    finally:
+        _active.release()
+
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    _stop(profile)
+    duration = time.perf_counter() - profile["started"]
+
+    profile_id = f"{time.time_ns():020d}-{request.endpoint or 'unknown'}"
+    sql_ms = sum(statement["duration_ms"] for statement in profile["sql"])
+    details = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "trigger": profile["trigger"],
+        "started_at": profile["started_at"],
+        "duration_ms": round(duration * 1000, 3),
+        "sql_count": len(profile["sql"]),
+        "sql_ms": round(sql_ms, 3),
+        "sql": profile["sql"],
+    }
+
+    try:
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        profile["profiler"].dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+        with open(os.path.join(directory, f"{profile_id}.json"), "w") as handle:
+            json.dump(details, handle)
+        _prune(directory)
+    except Exception:
+        app.logger.exception("Could not save profile %s", profile_id)
+        return response
+
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+# A request that failed before after_request still stops its profile
+@app.teardown_request
+def discard_profile(error=None):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        _stop(profile)
+
+
+# Drop the oldest profiles beyond PROFILE_MAX_FILES
+def _prune(directory):
+    with _lock:
+        ids = _profile_ids(directory)
+        for profile_id in ids[: max(0, len(ids) - app.config["PROFILE_MAX_FILES"])]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+# Profile ids on disk, oldest first
+def _profile_ids(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name[: -len(".json")]
+        for name in os.listdir(directory)
+        if name.endswith(".json") and _PROFILE_ID.match(name[: -len(".json")])
+    )
+
+
+def _load(profile_id):
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(profile_dir(), f"{profile_id}.json")) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+# Route to list stored profiles, newest first
+@app.route("/admin/profiles", methods=["GET"])
+@admin.admin_required
+def list_profiles():
+    profiles = []
+    for profile_id in reversed(_profile_ids(profile_dir())):
+        details = _load(profile_id)
+        if details is not None:
+            details.pop("sql")
+            profiles.append(details)
+    return jsonify({"profiles": profiles})
+
+
+# Route to get one profile's SQL timings and its top functions
+@app.route("/admin/profiles/<profile_id>", methods=["GET"])
+@admin.admin_required
+def get_profile(profile_id):
+    details = _load(profile_id)
+    if details is None:
+        return jsonify({"error": "Profile not found"}), 404
+
+    sort = request.args.get("sort", "cumulative")
+    if sort not in SORT_KEYS:
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_KEYS)}"}), 400
+
+    output = io.StringIO()
+    stats = pstats.Stats(
+        os.path.join(profile_dir(), f"{profile_id}.prof"), stream=output
+    )
+    stats.sort_stats(sort)
+    stats.print_stats(request.args.get("top", 30, type=int))
+    details["functions"] = output.getvalue()
+    return jsonify(details)
+
+
+# Route to download one profile in pstats format
+@app.route("/admin/profiles/<profile_id>/download", methods=["GET"])
+@admin.admin_required
+def download_profile(profile_id):
+    if _load(profile_id) is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(
+        os.path.join(profile_dir(), f"{profile_id}.prof"),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{profile_id}.prof",
+    )
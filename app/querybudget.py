@@ -0,0 +1,62 @@
+# app/querybudget.py
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import app
+
+# Per-request SQL statement budgets. When QUERY_BUDGET_MODE is set, every
+# statement a request issues is recorded and the total is checked against the
+# route's entry in QUERY_BUDGETS after the view returns:
+#   "warn"  - log the routes that go over budget, with their statements
+#   "raise" - raise QueryBudgetExceeded; routes without a budget also fail,
+#             so a new route cannot slip in without declaring one
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, endpoint, budget, statements):
+        self.endpoint = endpoint
+        self.budget = budget
+        self.statements = statements
+        if budget is None:
+            headline = f"{endpoint} has no declared query budget"
+        else:
+            headline = (
+                f"{endpoint} issued {len(statements)} queries, budget is {budget}"
+            )
+        listing = "\n".join(
+            f"  {number}. {' '.join(statement.split())}"
+            for number, statement in enumerate(statements, 1)
+        )
+        super().__init__(f"{headline}\n{listing}")
+
+
+@app.before_request
+def start_query_log():
+    if app.config["QUERY_BUDGET_MODE"]:
+        g.query_log = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        log = g.get("query_log")
+        if log is not None:
+            log.append(statement)
+
+
+@app.after_request
+def check_query_budget(response):
+    statements = g.pop("query_log", None)
+    if statements is None or request.endpoint is None:
+        return response
+
+    budget = app.config["QUERY_BUDGETS"].get(request.endpoint)
+    if budget is not None and len(statements) <= budget:
+        return response
+
+    error = QueryBudgetExceeded(request.endpoint, budget, statements)
+    if app.config["QUERY_BUDGET_MODE"] == "raise":
+        raise error
+    app.logger.warning("Query budget exceeded: %s", error)
+    return response
@@ -0,0 +1,167 @@
+# app/recommendations.py
+
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from . import app, shards
+from .models import Inventory, Rental, RentalArchive
+
+# "Customers also rented" recommendations. The film x film co-occurrence
+# matrix (how many customers rented both films) is kept in sparse form as a
+# sorted array of (film_a << 32 | film_b) keys with their counts, and each
+# film's top RECOMMENDATIONS_TOP_K neighbours are precomputed. New rentals
+# past the rental_id watermark only add pairs for films a customer had not
+# rented before, and only the films those pairs touch are re-ranked.
+# Each catch-up also rescans WATERMARK_SLACK ids below the watermark for
+# rentals that committed out of order; rentals already folded in are films
+# their customer has rented before, so they add nothing. With store shards,
+# every shard is read past its own watermark.
+
+# Rows fetched per round trip while loading new rentals
+FETCH_CHUNK = 10000
+
+_LOW = np.int64(0xFFFFFFFF)
+
+
+# Keys of every pair (x, y) with x from a and y from b
+def _pairs(a, b):
+    return (np.repeat(a, len(b)) << 32) | np.tile(b, len(a))
+
+
+class Recommender:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watermarks = {}
+        self._last_refresh = None
+        self._films_by_customer = {}
+        self._pair_keys = np.empty(0, np.int64)
+        self._pair_counts = np.empty(0, np.int64)
+        self._neighbors = {}
+
+    # (customer_id, film_id) of one shard's rentals past its watermark less
+    # the slack, from the rental table and the archive, plus the highest
+    # rental_id seen
+    def _load_new_rentals(self, connection, watermark):
+        customers, films, high = [], [], watermark
+        floor = max(watermark - app.config["WATERMARK_SLACK"], 0)
+        for table in (Rental, RentalArchive):
+            after = floor
+            while True:
+                rows = connection.execute(
+                    select(table.rental_id, table.customer_id, Inventory.film_id)
+                    .join(Inventory, Inventory.inventory_id == table.inventory_id)
+                    .where(table.rental_id > after)
+                    .order_by(table.rental_id)
+                    .limit(FETCH_CHUNK)
+                ).all()
+                if not rows:
+                    break
+                ids, customer_ids, film_ids = zip(*rows)
+                customers.extend(customer_ids)
+                films.extend(film_ids)
+                after = ids[-1]
+                high = max(high, after)
+                if len(rows) < FETCH_CHUNK:
+                    break
+        return customers, films, high
+
+    # Co-occurrence keys added by films customers rent for the first time
+    def _new_pairs(self, customers, films):
+        first_time = {}
+        for customer_id, film_id in zip(customers, films):
+            if customer_id is None or film_id is None:
+                continue
+            if film_id in self._films_by_customer.get(customer_id, ()):
+                continue
+            first_time.setdefault(customer_id, set()).add(film_id)
+
+        parts = []
+        for customer_id, new in first_time.items():
+            seen = self._films_by_customer.setdefault(customer_id, set())
+            new_ids = np.fromiter(new, np.int64, len(new))
+            if seen:
+                old_ids = np.fromiter(seen, np.int64, len(seen))
+                parts.append(_pairs(new_ids, old_ids))
+                parts.append(_pairs(old_ids, new_ids))
+            if len(new_ids) > 1:
+                keys = _pairs(new_ids, new_ids)
+                parts.append(keys[(keys >> 32) != (keys & _LOW)])
+            seen.update(new)
+        return np.concatenate(parts) if parts else np.empty(0, np.int64)
+
+    # Top-K neighbours, by co-rental count then film_id, of the given films
+    def _rank(self, films, keys, counts):
+        top_k = app.config["RECOMMENDATIONS_TOP_K"]
+        rows = np.isin(keys >> 32, films)
+        film_a, film_b, count = keys[rows] >> 32, keys[rows] & _LOW, counts[rows]
+        order = np.lexsort((film_b, -count, film_a))
+        film_a, film_b, count = film_a[order], film_b[order], count[order]
+
+        starts = np.flatnonzero(np.r_[True, film_a[1:] != film_a[:-1]])
+        sizes = np.diff(np.r_[starts, len(film_a)])
+
+        ranked = {}
+        for film_id, start, size in zip(
+            film_a[starts], starts, np.minimum(sizes, top_k)
+        ):
+            ranked[int(film_id)] = tuple(
+                zip(
+                    film_b[start : start + size].tolist(),
+                    count[start : start + size].tolist(),
+                )
+            )
+        return ranked
+
+    # Fold rentals past the watermark into the matrix and re-rank the films
+    # they touched. Returns the number of new co-occurrence increments.
+    def refresh(self, force=False):
+        interval = app.config["RECOMMENDATIONS_REFRESH_SECONDS"]
+        if (
+            not force
+            and self._last_refresh is not None
+            and time.monotonic() - self._last_refresh < interval
+        ):
+            return 0
+
+        with self._lock:
+            customers, films, watermarks = [], [], dict(self._watermarks)
+            with shards.connect_each() as connections:
+                for key, connection in connections:
+                    shard_customers, shard_films, watermarks[key] = (
+                        self._load_new_rentals(connection, watermarks.get(key, 0))
+                    )
+                    customers.extend(shard_customers)
+                    films.extend(shard_films)
+
+            delta = self._new_pairs(customers, films)
+            if len(delta):
+                keys, inverse = np.unique(
+                    np.concatenate([self._pair_keys, delta]), return_inverse=True
+                )
+                counts = np.bincount(
+                    inverse,
+                    weights=np.concatenate(
+                        [self._pair_counts, np.ones(len(delta), np.int64)]
+                    ),
+                    minlength=len(keys),
+                ).astype(np.int64)
+
+                ranked = self._rank(np.unique(delta >> 32), keys, counts)
+                neighbors = dict(self._neighbors)
+                neighbors.update(ranked)
+
+                self._pair_keys, self._pair_counts = keys, counts
+                self._neighbors = neighbors
+
+            self._watermarks = watermarks
+            self._last_refresh = time.monotonic()
+            return len(delta)
+
+    # Up to limit (film_id, co-rental count) pairs for a film, best first
+    def recommend(self, film_id, limit):
+        self.refresh()
+        return self._neighbors.get(film_id, ())[:limit]
+
+
+engine = Recommender()
@@ -0,0 +1,246 @@
+# app/rollups.py
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import Date, Integer, bindparam, func, select, union_all, update
+from . import app, db
+from .models import (
+    Actor,
+    Film,
+    FilmActor,
+    FilmRentalDaily,
+    Inventory,
+    Rental,
+    RentalArchive,
+    RollupWatermark,
+)
+
+# Daily per-film rental rollups backing the leaderboard routes.
+# New rentals are folded into film_rental_daily by rental_id high-water mark,
+# so a windowed top-N sums one bucket per film per day instead of scanning
+# the raw rental table by rental_date. The tables are created by
+# misc/setup_db.py.
+#
+# An id below the mark can still commit after it was set, so each catch-up
+# rescans WATERMARK_SLACK ids below the mark as well. The (film, day)
+# buckets those rentals fall in are recounted from scratch, archived rentals
+# included, rather than incremented, so a rental is never counted twice.
+
+WATERMARK_NAME = "film_rental_daily"
+
+_lock = threading.Lock()
+_last_refresh = 0.0
+
+
+# Parse a window such as "7d", "30d" or "365d" into a number of days.
+# None, "" and "all" mean all time.
+def parse_window(value):
+    if value is None or value in ("", "all"):
+        return None
+    if value.endswith("d") and value[:-1].isdigit() and int(value[:-1]) > 0:
+        return int(value[:-1])
+    raise ValueError(f"Invalid window '{value}', expected e.g. 7d, 30d, 365d or all")
+
+
+# Clamp a requested leaderboard size to the configured bounds
+def parse_limit(value):
+    if value is None:
+        return app.config["LEADERBOARD_DEFAULT_LIMIT"]
+    return max(1, min(value, app.config["LEADERBOARD_MAX_LIMIT"]))
+
+
+# First day included in a window of the given size (today counts as day one)
+def window_start(days):
+    if days is None:
+        return None
+    return (datetime.utcnow() - timedelta(days=days - 1)).date()
+
+
+def _as_date(value):
+    # MySQL returns DATE() as a date, SQLite as an ISO string
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# Rentals up to rental_id high in each of the (film, day) buckets, counted
+# over the rental and rental_archive tables. Touched days are normally the
+# last day or two, so one rental_date range spanning them stays narrow.
+def _recount(buckets, high):
+    days = [day for _, day in buckets]
+    start = datetime.combine(min(days), datetime.min.time())
+    end = datetime.combine(max(days) + timedelta(days=1), datetime.min.time())
+    history = union_all(
+        *(
+            select(table.rental_id, table.rental_date, table.inventory_id).where(
+                table.rental_id <= high,
+                table.rental_date >= start,
+                table.rental_date < end,
+            )
+            for table in (Rental, RentalArchive)
+        )
+    ).subquery()
+    rental_day = func.date(history.c.rental_date)
+    counts = db.session.execute(
+        select(Inventory.film_id, rental_day, func.count(history.c.rental_id))
+        .join(Inventory, Inventory.inventory_id == history.c.inventory_id)
+        .where(Inventory.film_id.in_({film_id for film_id, _ in buckets}))
+        .group_by(Inventory.film_id, rental_day)
+    ).all()
+    counts = {(film_id, _as_date(day)): count for film_id, day, count in counts}
+    return {bucket: counts.get(bucket, 0) for bucket in buckets}
+
+
+# Fold rentals newer than the watermark into the daily buckets.
+# Returns the number of rentals processed.
+def refresh_rollups(force=False):
+    global _last_refresh
+    if (
+        not force
+        and time.monotonic() - _last_refresh < app.config["ROLLUP_REFRESH_SECONDS"]
+    ):
+        return 0
+
+    with _lock:
+        mark = db.session.get(RollupWatermark, WATERMARK_NAME)
+        if mark is None:
+            mark = RollupWatermark(name=WATERMARK_NAME, last_rental_id=0)
+            db.session.add(mark)
+            db.session.commit()
+        low = mark.last_rental_id
+        floor = max(low - app.config["WATERMARK_SLACK"], 0)
+
+        # Fix the upper bound first so concurrent inserts land in the next batch
+        high = db.session.query(func.max(Rental.rental_id)).scalar() or 0
+        if high <= floor:
+            db.session.commit()
+            _last_refresh = time.monotonic()
+            return 0
+
+        # Buckets holding the new rentals and those rescanned below the mark
+        rental_day = func.date(Rental.rental_date)
+        touched = db.session.execute(
+            select(Inventory.film_id, rental_day)
+            .join(Inventory, Inventory.inventory_id == Rental.inventory_id)
+            .where(Rental.rental_id > floor, Rental.rental_id <= high)
+            .where(Rental.rental_date.is_not(None))
+            .distinct()
+        ).all()
+        touched = {(film_id, _as_date(day)) for film_id, day in touched}
+        counts = _recount(touched, high) if touched else {}
+
+        # Load only the touched films' buckets on those days, then set or
+        # create them
+        existing = {}
+        if touched:
+            existing = {
+                (bucket.film_id, bucket.rental_day): bucket
+                for bucket in FilmRentalDaily.query.filter(
+                    FilmRentalDaily.rental_day.in_({day for _, day in touched}),
+                    FilmRentalDaily.film_id.in_({film_id for film_id, _ in touched}),
+                )
+            }
+        for (film_id, day), count in counts.items():
+            bucket = existing.get((film_id, day))
+            if bucket is not None:
+                bucket.rental_count = count
+            elif count:
+                db.session.add(
+                    FilmRentalDaily(film_id=film_id, rental_day=day, rental_count=count)
+                )
+
+        # Advance the watermark only if nobody else did in the meantime,
+        # otherwise drop this batch and leave the buckets to that refresh
+        advanced = db.session.execute(
+            update(RollupWatermark)
+            .where(
+                RollupWatermark.name == WATERMARK_NAME,
+                RollupWatermark.last_rental_id == low,
+            )
+            .values(last_rental_id=max(low, high))
+        ).rowcount
+        if advanced != 1:
+            db.session.rollback()
+            return 0
+
+        db.session.commit()
+        _last_refresh = time.monotonic()
+        return max(high - low, 0)
+
+
+# Leaderboard statements are built once at import time with bound parameters,
+# so each request only binds values and reuses SQLAlchemy's compiled form
+_film_rental_count = func.sum(FilmRentalDaily.rental_count)
+
+_TOP_FILMS = (
+    select(
+        Film.film_id,
+        Film.title,
+        Film.description,
+        Film.release_year,
+        Film.rating,
+        Film.special_features,
+        _film_rental_count.label("rental_count"),
+    )
+    .join(FilmRentalDaily, Film.film_id == FilmRentalDaily.film_id)
+    .group_by(Film.film_id)
+    .order_by(_film_rental_count.desc(), Film.film_id)
+    .limit(bindparam("limit", type_=Integer))
+)
+_TOP_FILMS_FOR_ACTOR = _TOP_FILMS.join(
+    FilmActor, Film.film_id == FilmActor.film_id
+).where(FilmActor.actor_id == bindparam("actor_id", type_=Integer))
+
+_TOP_ACTORS = (
+    select(
+        Actor.actor_id,
+        Actor.first_name,
+        Actor.last_name,
+        func.concat(Actor.first_name, " ", Actor.last_name).label("full_name"),
+        func.count(func.distinct(FilmActor.film_id)).label("film_count"),
+        _film_rental_count.label("rental_count"),
+    )
+    .join(FilmActor, Actor.actor_id == FilmActor.actor_id)
+    .join(FilmRentalDaily, FilmActor.film_id == FilmRentalDaily.film_id)
+    .group_by(Actor.actor_id, Actor.first_name, Actor.last_name)
+    .order_by(_film_rental_count.desc(), Actor.actor_id)
+    .limit(bindparam("limit", type_=Integer))
+)
+
+
+def _windowed(statement):
+    return statement.where(FilmRentalDaily.rental_day >= bindparam("start", type_=Date))
+
+
+# Keyed by (windowed, for one actor)
+TOP_FILMS = {
+    (False, False): _TOP_FILMS,
+    (True, False): _windowed(_TOP_FILMS),
+    (False, True): _TOP_FILMS_FOR_ACTOR,
+    (True, True): _windowed(_TOP_FILMS_FOR_ACTOR),
+}
+TOP_ACTORS = {False: _TOP_ACTORS, True: _windowed(_TOP_ACTORS)}
+
+
+# Top films by rental count within the window, optionally for a single actor
+def top_films(days=None, limit=5, actor_id=None):
+    refresh_rollups()
+
+    start = window_start(days)
+    statement = TOP_FILMS[(start is not None, actor_id is not None)]
+    return db.session.execute(
+        statement, {"limit": limit, "start": start, "actor_id": actor_id}
+    ).all()
+
+
+# Top actors by rentals of their films within the window
+def top_actors(days=None, limit=5):
+    refresh_rollups()
+
+    start = window_start(days)
+    return db.session.execute(
+        TOP_ACTORS[start is not None], {"limit": limit, "start": start}
+    ).all()
@@ -1,16 +1,47 @@
 # app/routes.py
 
-from datetime import datetime
-from flask import jsonify, request
-from sqlalchemy import Text, text, func
-from . import app
+import csv
+import io
+import itertools
+import json
+from datetime import datetime, timedelta
+from flask import Response, jsonify, request, stream_with_context
+from sqlalchemy import bindparam, text, insert, select, update
+from sqlalchemy.orm import selectinload
+from . import (
+    admin,
+    analytics,
+    archive,
+    app,
+    cache,
+    catalog,
+    costars,
+    facets,
+    formats,
+    overdue,
+    recommendations,
+    rollups,
+    scheduler,
+    shards,
+    singleflight,
+    transactions,
+)
 from .models import *
 
 
+# Read the window= and limit= parameters shared by the leaderboard routes
+def leaderboard_args():
+    days = rollups.parse_window(request.args.get("window"))
+    limit = rollups.parse_limit(request.args.get("limit", type=int))
+    return days, limit
+
+
 # Route to check if a customer ID exists
 @app.route("/check_customer/<int:customer_id>")
 def check_customer(customer_id):
     # Check if the customer ID exists in the database
+    if shards.enabled():
+        return jsonify({"customer_exists": shards.customer_exists(customer_id)})
     customer_exists = (
         Customer.query.filter_by(customer_id=customer_id).first() is not None
     )
@@ -21,6 +52,8 @@ def check_customer(customer_id):
 @app.route("/check_movie_availability/<int:film_id>")
 def check_movie_availability(film_id):
     # Check if the movie with the given ID is available in the inventory
+    if shards.enabled():
+        return jsonify({"movie_available": shards.film_available(film_id)})
     inventory = (
         Inventory.query.filter_by(film_id=film_id)
         .filter(Inventory.available_copies > 0)
@@ -31,79 +64,83 @@ def check_movie_availability(film_id):
 
 # Route to rent a movie to a customer
 @app.route("/rent_movie/<int:inventory_id>/<int:customer_id>", methods=["POST"])
+@transactions.retrying
 def rent_movie(inventory_id, customer_id):
     # Get the current date and time
     rental_date = datetime.utcnow()
 
-    # Hardcode the staff ID for now
-    staff_id = 1
+    # Find the store holding the copy (unless the client says) and record
+    # the rental on that store's database under one of its staff
+    store_id = request.args.get("store_id", type=int)
+    if shards.enabled() and store_id not in (None, *app.config["STORE_SHARDS"]):
+        return jsonify({"error": f"Unknown store ID#{store_id}"}), 400
+    if store_id is None:
+        store_id = shards.store_of_inventory(inventory_id)
+        if store_id is None:
+            return jsonify({"error": f"Inventory ID#{inventory_id} not found"}), 404
+    staff_id = shards.staff_for_store(store_id)
 
     # Insert a new rental record into the database
-    new_rental = Rental(
-        rental_date=rental_date,
-        inventory_id=inventory_id,
-        customer_id=customer_id,
-        staff_id=staff_id,
+    with shards.begin(store_id) as connection:
+        result = connection.execute(
+            insert(Rental).values(
+                rental_date=rental_date,
+                inventory_id=inventory_id,
+                customer_id=customer_id,
+                staff_id=staff_id,
+            )
+        )
+        rental_id = result.inserted_primary_key[0]
+
+    # Fold the new rental into the leaderboard rollups and the overdue queue
+    # (sharded leaderboards query the shards directly)
+    if not shards.enabled():
+        transactions.after_commit(rollups.refresh_rollups, True)
+    transactions.after_commit(
+        overdue.tracker.add, rental_id, customer_id, inventory_id, rental_date
     )
-    db.session.add(new_rental)
-    db.session.commit()
+    cache.invalidate("rentals")
 
     return jsonify({"message": f"Movie rented successfully to ID#{customer_id}"})
 
 
 # Route to display all films
 @app.route("/all_films")
+@cache.cached("catalog")
 def display_films():
-    # Retrieve all films from the database
-    films = Film.query.all()
+    # Read the films from the in-memory catalog
+    snapshot = catalog.current()
 
-    # Convert the list of films to JSON format
-    films_data = [
-        {
-            "film_id": film.film_id,
-            "title": film.title,
-            "description": film.description,
-            "release_year": film.release_year,
-            "rating": film.rating,
-            "special_features": film.special_features,
-        }
-        for film in films
-    ]
-    return jsonify({"films": films_data})
+    # Return the films in the format the client asked for
+    return formats.rows_response(
+        catalog.FILM_LIST_COLUMNS, snapshot.film_list, "films"
+    )
 
 
-# Route to get the top 5 most rented movies
+# Route to get the most rented movies, optionally within a time window
 @app.route("/top_rented_movies")
+@cache.cached("rentals", bypass=scheduler.serving)
+@singleflight.coalesce
 def top_rented_movies():
-    # Query the database to get the top 5 most rented movies
-    top_movies = (
-        db.session.query(
-            Film.title,
-            Film.description,
-            Film.release_year,
-            Film.rating,
-            Film.special_features,
-            func.count(Rental.rental_id).label("rental_count"),
-        )
-        .join(Inventory, Film.film_id == Inventory.film_id)
-        .join(Rental, Inventory.inventory_id == Rental.inventory_id)
-        .group_by(Film.film_id)
-        .order_by(func.count(Rental.rental_id).desc())
-        .limit(5)
-        .all()
-    )
+    try:
+        days, limit = leaderboard_args()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    # Read the latest leaderboard built from the daily rental rollups
+    top_movies = scheduler.top_films(days, limit)
 
     # Convert the result to a list of dictionaries
     top_movies_data = [
         {
-            "title": title,
-            "description": description,
-            "releaseYear": release_year,
-            "rating": rating,
-            "specialFeatures": special_features,
-            "rentalCount": rental_count,
+            "title": movie.title,
+            "description": movie.description,
+            "releaseYear": movie.release_year,
+            "rating": movie.rating,
+            "specialFeatures": movie.special_features,
+            "rentalCount": movie.rental_count,
         }
-        for title, description, release_year, rating, special_features, rental_count in top_movies
+        for movie in top_movies
     ]
 
     return jsonify({"top_movies": top_movies_data})
@@ -111,9 +148,10 @@ def top_rented_movies():
 
 # Route to get additional details for a specific movie
 @app.route("/movie_details/<string:title>")
+@cache.cached("catalog")
 def movie_details(title):
-    # Query the database to get details of the movie with the given title
-    movie = Film.query.filter_by(title=title).first()
+    # Look up the movie with the given title in the in-memory catalog
+    movie = catalog.current().film_titled(title)
 
     if movie:
         # Return movie details as JSON
@@ -129,24 +167,130 @@ def movie_details(title):
         return jsonify({"error": "Movie not found"})
 
 
-# Route to get the top actors based on movie count
+# Route to get a film with its actors, categories and availability in one response
+@app.route("/film_details/<int:film_id>")
+def film_details(film_id):
+    # Load the film and its relationships eagerly: one query for the film and
+    # one per relationship, however many actors, categories or copies it has.
+    # Sharded, the copies are on the store shards instead.
+    options = [
+        selectinload(Film.actors).joinedload(FilmActor.actor),
+        selectinload(Film.categories),
+    ]
+    if not shards.enabled():
+        options.append(selectinload(Film.inventory))
+    film = db.session.execute(
+        select(Film).where(Film.film_id == film_id).options(*options)
+    ).scalar_one_or_none()
+
+    if film is None:
+        return jsonify({"error": "Movie not found"}), 404
+
+    # One more query, or one per shard, for the copies that are rented out
+    if shards.enabled():
+        inventory_ids, available = shards.film_copies(film_id)
+    else:
+        inventory_ids = [copy.inventory_id for copy in film.inventory]
+        rented_out = set()
+        if inventory_ids:
+            rented_out = set(
+                db.session.execute(
+                    select(Rental.inventory_id).where(
+                        Rental.inventory_id.in_(inventory_ids),
+                        Rental.return_date.is_(None),
+                    )
+                ).scalars()
+            )
+        available = [
+            inventory_id
+            for inventory_id in inventory_ids
+            if inventory_id not in rented_out
+        ]
+
+    return jsonify(
+        {
+            "film_id": film.film_id,
+            "title": film.title,
+            "description": film.description,
+            "releaseYear": film.release_year,
+            "rating": film.rating,
+            "specialFeatures": film.special_features,
+            "actors": [
+                {
+                    "actor_id": link.actor.actor_id,
+                    "first_name": link.actor.first_name,
+                    "last_name": link.actor.last_name,
+                }
+                for link in sorted(film.actors, key=lambda link: link.actor_id)
+            ],
+            "categories": [
+                {"category_id": category.category_id, "name": category.name}
+                for category in film.categories
+            ],
+            "availability": {
+                "number_of_copies": len(inventory_ids),
+                "number_of_rentals_out": len(inventory_ids) - len(available),
+                "remaining_copies": len(available),
+                "available_inventory_ids": available,
+            },
+        }
+    )
+
+
+# Route to get the films most often rented by customers who rented this one
+@app.route("/recommendations/<int:film_id>")
+def film_recommendations(film_id):
+    snapshot = catalog.current()
+    film = snapshot.film_by_id.get(film_id)
+    if film is None:
+        return jsonify({"error": "Film not found"}), 404
+
+    limit = request.args.get("limit", app.config["RECOMMENDATIONS_TOP_K"], type=int)
+    limit = max(1, min(limit, app.config["RECOMMENDATIONS_TOP_K"]))
+
+    # Read the precomputed neighbours and name them from the catalog
+    recommended = [
+        {
+            "film_id": other_id,
+            "title": snapshot.film_by_id[other_id].title,
+            "co_rentals": count,
+        }
+        for other_id, count in recommendations.engine.recommend(film_id, limit)
+        if other_id in snapshot.film_by_id
+    ]
+    return jsonify(
+        {"film_id": film_id, "title": film.title, "recommendations": recommended}
+    )
+
+
+# Route to get the top actors based on movie count, or on rentals within a time window
 @app.route("/top_actors")
+@cache.cached("rentals", bypass=scheduler.serving)
+@singleflight.coalesce
 def top_actors():
-    # Query the database to get the top actors based on movie count
-    top_actors = (
-        db.session.query(
-            Actor.actor_id,
-            Actor.first_name,
-            Actor.last_name,
-            func.concat(Actor.first_name, " ", Actor.last_name).label("full_name"),
-            func.count(FilmActor.film_id).label("film_count"),
-        )
-        .join(FilmActor, Actor.actor_id == FilmActor.actor_id)
-        .group_by(Actor.actor_id, Actor.first_name, Actor.last_name)
-        .order_by(-func.count(FilmActor.film_id))
-        .limit(5)
-        .all()
-    )
+    try:
+        days, limit = leaderboard_args()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if request.args.get("window"):
+        # Rank actors by rentals of their films within the window
+        top_actors = scheduler.top_actors(days, limit)
+        top_actors_data = [
+            {
+                "actor_id": actor.actor_id,
+                "first_name": actor.first_name,
+                "last_name": actor.last_name,
+                "full_name": actor.full_name,
+                "film_count": actor.film_count,
+                "rental_count": actor.rental_count,
+            }
+            for actor in top_actors
+        ]
+        return jsonify({"top_actors": top_actors_data})
+
+    # Get the top actors based on movie count
+    top_actors = scheduler.actors_by_film_count(limit)
 
     # Convert the result to a list of dictionaries
     top_actors_data = [
@@ -163,49 +307,111 @@ def top_actors():
     return jsonify({"top_actors": top_actors_data})
 
 
-# Route to get the top 5 movies for a specific actor
+# Route to get the most rented movies for a specific actor, optionally within a time window
 @app.route("/top_movies_for_actor/<int:actor_id>")
+@cache.cached("rentals")
+@singleflight.coalesce
 def top_movies_for_actor(actor_id):
-    # Query the database to get the top 5 movies for the actor with the given ID
-    top_movies = (
-        db.session.query(
-            Film.film_id, Film.title, func.count(Rental.rental_id).label("rental_count")
-        )
-        .join(FilmActor, Film.film_id == FilmActor.film_id)
-        .join(Actor, FilmActor.actor_id == Actor.actor_id)
-        .join(Inventory, Film.film_id == Inventory.film_id)
-        .join(Rental, Inventory.inventory_id == Rental.inventory_id)
-        .filter(Actor.actor_id == actor_id)
-        .group_by(Film.film_id, Film.title)
-        .order_by(func.count(Rental.rental_id).desc())
-        .limit(5)
-        .all()
-    )
+    try:
+        days, limit = leaderboard_args()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    # Sum the daily rental rollups of the actor's films, or the rentals on
+    # every shard when sharded
+    if shards.enabled():
+        top_movies = shards.top_films(days, limit, actor_id=actor_id)
+    else:
+        top_movies = rollups.top_films(days, limit, actor_id=actor_id)
 
     # Convert the result to a list of dictionaries
     top_movies_data = [
-        {"film_id": film_id, "title": title, "rental_count": rental_count}
-        for film_id, title, rental_count in top_movies
+        {
+            "film_id": movie.film_id,
+            "title": movie.title,
+            "rental_count": movie.rental_count,
+        }
+        for movie in top_movies
     ]
 
     return jsonify({"top_movies": top_movies_data})
 
 
+# Route to get an actor's co-stars ranked by the number of films they share
+@app.route("/co_stars/<int:actor_id>")
+def co_stars(actor_id):
+    limit = request.args.get("limit", app.config["CO_STARS_DEFAULT_LIMIT"], type=int)
+    limit = max(1, min(limit, app.config["CO_STARS_MAX_LIMIT"]))
+
+    # Read the co-stars from the in-memory co-star graph
+    graph = costars.current()
+    ranked = graph.co_stars(actor_id, limit)
+    if ranked is None:
+        return jsonify({"error": "Actor not found"}), 404
+
+    actors = graph.snapshot.actors
+    return jsonify(
+        {
+            "actor_id": actor_id,
+            "co_stars": [
+                {
+                    "actor_id": other_id,
+                    "first_name": actors[other_id].first_name,
+                    "last_name": actors[other_id].last_name,
+                    "shared_films": shared,
+                }
+                for other_id, shared in ranked
+                if other_id in actors
+            ],
+        }
+    )
+
+
+# Route to get the shortest chain of co-stars linking two actors
+@app.route("/actor_path/<int:from_actor_id>/<int:to_actor_id>")
+def actor_path(from_actor_id, to_actor_id):
+    graph = costars.current()
+    if graph.code(from_actor_id) is None or graph.code(to_actor_id) is None:
+        return jsonify({"error": "Actor not found"}), 404
+
+    path = graph.shortest_path(from_actor_id, to_actor_id)
+    if path is None:
+        return jsonify({"degrees": None, "path": [], "films": []})
+
+    actors = graph.snapshot.actors
+    films = graph.snapshot.film_by_id
+    return jsonify(
+        {
+            "degrees": len(path) - 1,
+            "path": [
+                {
+                    "actor_id": actor_id,
+                    "first_name": actors[actor_id].first_name if actor_id in actors else None,
+                    "last_name": actors[actor_id].last_name if actor_id in actors else None,
+                }
+                for actor_id in path
+            ],
+            "films": [
+                {
+                    "film_id": film_id,
+                    "title": films[film_id].title if film_id in films else None,
+                }
+                for film_id in graph.linking_films(path)
+            ],
+        }
+    )
+
+
 # Route to get information about movie copies
 @app.route("/movie_copies_info")
+@cache.cached("catalog")
 def movie_copies_info():
-    # Query to get information about the total number of copies, rentals, and remaining copies per movie
-    movie_copies_info = (
-        db.session.query(
-            Film.film_id,
-            Film.title.label("film_title"),
-            func.count(Inventory.inventory_id).label("number_of_copies"),
-        )
-        .outerjoin(Inventory, Film.film_id == Inventory.film_id)
-        .group_by(Film.film_id, Film.title)
-        .order_by(Film.film_id, func.count(Inventory.inventory_id).desc())
-        .all()
-    )
+    # Read the number of copies per movie from the in-memory catalog
+    snapshot = catalog.current()
+    movie_copies_info = [
+        (film.film_id, film.title, snapshot.copies_by_film.get(film.film_id, 0))
+        for film in snapshot.films
+    ]
 
     # Convert the result to a list of dictionaries
     movie_copies_data = [
@@ -222,80 +428,20 @@ def movie_copies_info():
 
 # Route to get information about movies
 @app.route("/movie_info")
+@cache.cached("rentals", bypass=scheduler.serving)
 def movie_info():
     # Get the movie_id from the query parameters
     movie_id = request.args.get("movie_id", type=int)
 
+    # Read the latest availability snapshot
+    columns, rows, by_film = scheduler.movie_info()
+
     # If movie_id is not provided, return information for all movies
     if movie_id is None:
-        # Query to get information about the total number of copies, rentals, and remaining copies for all movies
-        results = (
-            db.session.query(
-                Film.film_id,
-                Film.title.label("film_title"),
-                db.func.coalesce(db.func.count(Inventory.inventory_id), 0).label(
-                    "number_of_copies"
-                ),
-                db.func.coalesce(db.func.count(Rental.rental_id), 0).label(
-                    "number_of_rentals_out"
-                ),
-                db.func.coalesce(
-                    db.func.count(Inventory.inventory_id)
-                    - db.func.count(Rental.rental_id),
-                    0,
-                ).label("remaining_copies"),
-            )
-            .outerjoin(Inventory, Film.film_id == Inventory.film_id)
-            .outerjoin(
-                Rental,
-                (Inventory.inventory_id == Rental.inventory_id)
-                & (Rental.return_date.is_(None)),
-            )
-            .group_by(Film.film_id, Film.title)
-            .order_by(Film.film_id)
-            .all()
-        )
-
-        films_info = []
-        for result in results:
-            films_info.append(
-                {
-                    "film_id": result.film_id,
-                    "film_title": result.film_title,
-                    "number_of_copies": result.number_of_copies,
-                    "number_of_rentals_out": result.number_of_rentals_out,
-                    "remaining_copies": result.remaining_copies,
-                }
-            )
-
-        return jsonify(films_info)
+        return formats.rows_response(columns, rows)
 
     # If movie_id is provided, return information for the specific movie
-    result = (
-        db.session.query(
-            Film.film_id,
-            Film.title.label("film_title"),
-            db.func.coalesce(db.func.count(Inventory.inventory_id), 0).label(
-                "number_of_copies"
-            ),
-            db.func.coalesce(db.func.count(Rental.rental_id), 0).label(
-                "number_of_rentals_out"
-            ),
-            db.func.coalesce(
-                db.func.count(Inventory.inventory_id) - db.func.count(Rental.rental_id),
-                0,
-            ).label("remaining_copies"),
-        )
-        .outerjoin(Inventory, Film.film_id == Inventory.film_id)
-        .outerjoin(
-            Rental,
-            (Inventory.inventory_id == Rental.inventory_id)
-            & (Rental.return_date.is_(None)),
-        )
-        .filter(Film.film_id == movie_id)
-        .group_by(Film.film_id, Film.title)
-        .first()
-    )
+    result = by_film.get(movie_id)
 
     if result is None:
         return jsonify({"error": "Movie not found"}), 404
@@ -314,6 +460,14 @@ def movie_info():
 # Route to get remaining inventory for a movie
 @app.route('/remaining_inventory/<int:film_id>', methods=['GET'])
 def remaining_inventory(film_id):
+    # Copies live on their store's shard; the film title comes from the catalog
+    if shards.enabled():
+        film = catalog.current().film_by_id.get(film_id)
+        if film is None:
+            return jsonify([])
+        return jsonify([{'inventory_id': inventory_id, 'film_id': film_id, 'film_title': film.title}
+                        for inventory_id in shards.copies_in_store(film_id)])
+
     # SQL query to get remaining inventory for a movie
     query = """
         SELECT
@@ -332,16 +486,23 @@ def remaining_inventory(film_id):
         ORDER BY
             i.inventory_id;
     """
-    with db.engine.connect() as connection:
+    with transactions.connect() as connection:
         result = connection.execute(text(query), {'film_id': film_id})  # Use text() function
         # Convert each row to a dictionary
         data = [dict(row._mapping) for row in result]
         return jsonify(data)
 
 
-# Route to fetch customer list
+# Route to fetch customer list, or one page of it with rental summary columns
 @app.route('/customers', methods=['GET'])
 def get_customer_list():
+    if 'limit' in request.args:
+        return customer_page()
+    return all_customers()
+
+
+@cache.cached("customers")
+def all_customers():
     # SQL query to fetch customer list with additional details
     query = """
             SELECT 
@@ -367,46 +528,219 @@ def get_customer_list():
             ORDER BY
                 customer.customer_id;
         """
-    with db.engine.connect() as connection:
+    if shards.enabled():
+        # Every shard lists its own customers; merge them back into id order
+        columns, rows = shards.gather(text(query))
+        rows.sort(key=lambda row: row.customer_id)
+        return formats.rows_response(columns, rows)
+    with transactions.connect() as connection:
         result = connection.execute(text(query))
-        # Convert each row to a dictionary
-        data = [dict(row._mapping) for row in result]
-        return jsonify(data)
+        # Return the rows in the format the client asked for
+        return formats.rows_response(result.keys(), result.all())
+
+
+def customer_page():
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', type=int) or app.config['CUSTOMER_PAGE_DEFAULT_LIMIT']
+    limit = max(1, min(limit, app.config['CUSTOMER_PAGE_MAX_LIMIT']))
+    if shards.enabled():
+        return sharded_customer_page(offset, limit)
+
+    # One statement per page: the page of customers, and one grouped
+    # subquery over rental (and archived rentals, for lifetime counts)
+    # restricted to the customer ids on that page
+    query = """
+            WITH page AS (
+                SELECT customer_id
+                FROM customer
+                ORDER BY customer_id
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT 
+                customer.customer_id,
+                customer.first_name,
+                customer.last_name,
+                customer.email,
+                address.address,
+                city.city,
+                country.country,
+                address.phone,
+                customer.store_id,
+                customer.create_date AS registration_date,
+                customer.last_update,
+                COALESCE(summary.lifetime_rentals, 0) AS lifetime_rentals,
+                COALESCE(summary.open_rentals, 0) AS open_rentals,
+                summary.last_rental_date
+            FROM 
+                page
+            JOIN 
+                customer ON customer.customer_id = page.customer_id
+            JOIN 
+                address ON customer.address_id = address.address_id
+            JOIN 
+                city ON address.city_id = city.city_id
+            JOIN 
+                country ON city.country_id = country.country_id
+            LEFT JOIN (
+                SELECT
+                    history.customer_id,
+                    COUNT(*) AS lifetime_rentals,
+                    SUM(CASE WHEN history.return_date IS NULL THEN 1 ELSE 0 END) AS open_rentals,
+                    MAX(history.rental_date) AS last_rental_date
+                FROM (
+                    SELECT customer_id, rental_date, return_date
+                    FROM rental
+                    WHERE customer_id IN (SELECT customer_id FROM page)
+                    UNION ALL
+                    SELECT customer_id, rental_date, return_date
+                    FROM rental_archive
+                    WHERE customer_id IN (SELECT customer_id FROM page)
+                ) AS history
+                GROUP BY
+                    history.customer_id
+            ) AS summary ON summary.customer_id = customer.customer_id
+            ORDER BY
+                customer.customer_id;
+        """
+    with transactions.connect() as connection:
+        result = connection.execute(text(query), {'limit': limit, 'offset': offset})
+        # Return the rows in the format the client asked for
+        return formats.rows_response(result.keys(), result.all())
+
+
+# The same page when customers are spread over store shards. The page is cut
+# from the first offset + limit ids of every shard, then each shard returns
+# the page's customers it holds and a summary of the rentals it holds for
+# them, since customers rent from every store; the summaries are added up.
+def sharded_customer_page(offset, limit):
+    ids_sql = """
+            SELECT customer_id
+            FROM customer
+            ORDER BY customer_id
+            LIMIT :limit
+        """
+    found = shards.scatter(lambda connection: connection.execute(text(ids_sql), {'limit': offset + limit}).scalars().all())
+    page_ids = sorted(customer_id for ids in found for customer_id in ids)[offset:offset + limit]
+
+    customers_sql = text("""
+            SELECT 
+                customer.customer_id,
+                customer.first_name,
+                customer.last_name,
+                customer.email,
+                address.address,
+                city.city,
+                country.country,
+                address.phone,
+                customer.store_id,
+                customer.create_date AS registration_date,
+                customer.last_update
+            FROM 
+                customer
+            JOIN 
+                address ON customer.address_id = address.address_id
+            JOIN 
+                city ON address.city_id = city.city_id
+            JOIN 
+                country ON city.country_id = country.country_id
+            WHERE
+                customer.customer_id IN :ids
+        """).bindparams(bindparam('ids', expanding=True))
+    summary_sql = text("""
+            SELECT
+                history.customer_id,
+                COUNT(*) AS lifetime_rentals,
+                SUM(CASE WHEN history.return_date IS NULL THEN 1 ELSE 0 END) AS open_rentals,
+                MAX(history.rental_date) AS last_rental_date
+            FROM (
+                SELECT customer_id, rental_date, return_date
+                FROM rental
+                WHERE customer_id IN :ids
+                UNION ALL
+                SELECT customer_id, rental_date, return_date
+                FROM rental_archive
+                WHERE customer_id IN :ids
+            ) AS history
+            GROUP BY
+                history.customer_id
+        """).bindparams(bindparam('ids', expanding=True))
+
+    def read_page(connection):
+        customers = connection.execute(customers_sql, {'ids': page_ids})
+        columns, rows = list(customers.keys()), customers.all()
+        return columns, rows, connection.execute(summary_sql, {'ids': page_ids}).all()
+
+    results = shards.scatter(read_page)
+    customers = {row.customer_id: row for _, rows, _ in results for row in rows}
+    totals = {}
+    for _, _, summary in results:
+        for customer_id, lifetime_rentals, open_rentals, last_rental_date in summary:
+            total = totals.get(customer_id)
+            if total is not None:
+                lifetime_rentals += total[0]
+                open_rentals += total[1]
+                if last_rental_date is None or (total[2] is not None and total[2] > last_rental_date):
+                    last_rental_date = total[2]
+            totals[customer_id] = (lifetime_rentals, open_rentals, last_rental_date)
+
+    columns = results[0][0] + ['lifetime_rentals', 'open_rentals', 'last_rental_date']
+    rows = [tuple(customers[customer_id]) + totals.get(customer_id, (0, 0, None))
+            for customer_id in page_ids if customer_id in customers]
+    return formats.rows_response(columns, rows)
+
+
+# Route to filter films on any combination of genre, rating, year and special feature
+@app.route('/films_filter', methods=['GET'])
+def films_filter():
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', app.config['FILMS_FILTER_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['FILMS_FILTER_MAX_LIMIT']))
+
+    # Each facet takes repeated or comma-separated values, matched with
+    # <facet>_match=any (default) or all
+    selection = {}
+    for facet in facets.FACETS:
+        values = [value for arg in request.args.getlist(facet) for value in arg.split(',') if value]
+        match = request.args.get(f'{facet}_match', 'any')
+        if match not in ('any', 'all'):
+            return jsonify({'error': f'{facet}_match must be any or all'}), 400
+        selection[facet] = (values, match == 'all')
+
+    # Intersect the facet bitsets of the in-memory catalog
+    total, films, counts = facets.current().search(selection, offset, limit)
+
+    return jsonify({
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'films': [
+            {column: getattr(film, column) for column in catalog.FILM_LIST_COLUMNS}
+            for film in films
+        ],
+        'facets': counts,
+    })
 
 # Route to fetch movie list based on requested genre
 @app.route('/films_by_genre', methods=['GET'])
+@cache.cached("catalog")
 def films_by_genre():
     # Get the genre name from the request or use an empty string if not provided
     genre_name = request.args.get('genre_name', '')
 
-    with db.engine.connect() as connection:
-        # SQL query to retrieve films by genre
-        sql = """
-            SELECT film.*
-            FROM film
-            JOIN film_category ON film.film_id = film_category.film_id
-            JOIN category ON film_category.category_id = category.category_id
-            WHERE category.name LIKE :genre_name
-        """
+    # Match the genre against the in-memory catalog
+    snapshot = catalog.current()
+    films = snapshot.films_in_categories_like(genre_name)
 
-        # Execute the query
-        result = connection.execute(text(sql), {'genre_name': '%' + genre_name + '%'})
+    # Return the films in the format the client asked for
+    return formats.rows_response(snapshot.film_columns, films, 'films')
 
-        # Fetch all results
-        results = result.fetchall()
-
-        # Convert results to a list of dictionaries
-        films = [dict(row._mapping)for row in results]
-
-        return jsonify({'films': films})
-    
 # Route to fetch movie list based on requested actor name
 @app.route('/films_by_actor', methods=['GET'])
 def films_by_actor():
     # Get the genre name from the request or use an empty string if not provided
     actor_name = request.args.get('actor_name', '')
 
-    with db.engine.connect() as connection:
+    with transactions.connect() as connection:
         # SQL query to retrieve films by actor
         sql = """
             SELECT film.*
@@ -419,13 +753,8 @@ def films_by_actor():
         # Execute the query
         result = connection.execute(text(sql), {'actor_name': '%' + actor_name + '%'})
 
-        # Fetch all results
-        results = result.fetchall()
-
-        # Convert results to a list of dictionaries
-        films = [dict(row._mapping)for row in results]
-
-        return jsonify({'films': films})
+        # Return the films in the format the client asked for
+        return formats.rows_response(result.keys(), result.fetchall(), 'films')
 
 # Route to fetch movie list based on requested movie title
 @app.route('/films_by_title', methods=['GET'])
@@ -433,7 +762,7 @@ def films_by_title():
     # Get the genre name from the request or use an empty string if not provided
     title = request.args.get('title', '')
 
-    with db.engine.connect() as connection:
+    with transactions.connect() as connection:
         # SQL query to retrieve films by title
         sql = """
             SELECT *
@@ -444,21 +773,93 @@ def films_by_title():
         # Execute the query
         result = connection.execute(text(sql), {'title': '%' + title + '%'})
 
-        # Fetch all results
-        results = result.fetchall()
-
-        # Convert results to a list of dictionaries
-        films = [dict(row._mapping)for row in results]
-
-        return jsonify({'films': films})
+        # Return the films in the format the client asked for
+        return formats.rows_response(result.keys(), result.fetchall(), 'films')
     
     
+# Columns a customer search can match on, by search field
+CUSTOMER_SEARCH_FIELDS = {
+    'last_name': 'customer.last_name',
+    'first_name': 'customer.first_name',
+    'email': 'customer.email',
+    'phone': 'address.phone',
+}
+
+
+# Route to search customers by name, email or phone prefix
+@app.route('/customers/search', methods=['GET'])
+def search_customers():
+    prefix = request.args.get('q', '')
+    field = request.args.get('field', 'any')
+    limit = request.args.get('limit', app.config['CUSTOMER_SEARCH_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['CUSTOMER_SEARCH_MAX_LIMIT']))
+
+    if not prefix:
+        return jsonify({'error': 'q is required'}), 400
+    if field != 'any' and field not in CUSTOMER_SEARCH_FIELDS:
+        return jsonify({'error': f"Invalid field '{field}'"}), 400
+    fields = list(CUSTOMER_SEARCH_FIELDS) if field == 'any' else [field]
+
+    # Escape LIKE wildcards so the pattern stays a plain prefix: 'prefix%' is
+    # sargable, so each lookup is an index range scan capped at one page
+    pattern = prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+
+    # One page per field; sharded, every shard looks up its own customers
+    def search(connection):
+        columns, pages = [], {}
+        for name in fields:
+            column = CUSTOMER_SEARCH_FIELDS[name]
+            sql = f"""
+                SELECT
+                    customer.customer_id,
+                    customer.first_name,
+                    customer.last_name,
+                    customer.email,
+                    address.phone,
+                    customer.store_id
+                FROM
+                    customer
+                JOIN
+                    address ON customer.address_id = address.address_id
+                WHERE
+                    {column} LIKE :pattern ESCAPE '!'
+                ORDER BY
+                    {column}, customer.customer_id
+                LIMIT :limit
+            """
+            result = connection.execute(text(sql), {'pattern': pattern, 'limit': limit})
+            columns = list(result.keys())
+            pages[name] = result.all()
+        return columns, pages
+
+    found = shards.scatter(search)
+    columns = found[0][0]
+    matches = {}
+    for name in fields:
+        page = [row for _, pages in found for row in pages[name]]
+        if len(found) > 1:
+            # Cut the shards' pages for this field back to the first page overall
+            page = sorted(page, key=lambda row: ((getattr(row, name) or '').casefold(), row.customer_id))[:limit]
+        for row in page:
+            matches[row.customer_id] = row
+
+    # Merge the per-field pages and keep one page overall
+    rows = sorted(
+        matches.values(),
+        key=lambda row: (row.last_name or '', row.first_name or '', row.customer_id),
+    )[:limit]
+    return formats.rows_response(columns, rows, 'customers')
+
+
 # Route to add a customer
 @app.route('/add_customer', methods=['POST'])
+@transactions.retrying
 def add_customer():
     # Extracting data from the request
     data = request.json
-    store_id = 1 #We are combining both stores for the sake of the project timeline
+    store_id = data.get('store_id', app.config['DEFAULT_STORE_ID'])
+    if shards.enabled() and store_id not in app.config['STORE_SHARDS']:
+        return jsonify({'error': f'Unknown store ID#{store_id}'}), 400
     first_name = data.get('first_name')
     last_name = data.get('last_name')
     email = data.get('email')
@@ -470,16 +871,18 @@ def add_customer():
         VALUES (:store_id, :first_name, :last_name, :email, :address_id)
     """
 
-    with db.engine.connect() as connection:
+    # The customer lives on their store's database
+    with shards.begin(store_id) as connection:
         # Execute the query
         connection.execute(text(sql), {'store_id': store_id, 'first_name': first_name, 'last_name': last_name,
                                        'email': email, 'address_id': address_id})
-        connection.commit()
+    cache.invalidate('customers')
 
     return jsonify({'message': 'Customer added successfully'})
 
 # Route to update a customer
 @app.route('/update_customer/<int:customer_id>', methods=['PUT'])
+@transactions.retrying
 def update_customer(customer_id):
     # Extracting data from the request
     data = request.json
@@ -494,16 +897,16 @@ def update_customer(customer_id):
         WHERE customer_id = :customer_id
     """
 
-    with db.engine.connect() as connection:
-        # Execute the query
-        connection.execute(text(sql), {'first_name': first_name, 'last_name': last_name,
-                                       'email': email, 'customer_id': customer_id})
-        connection.commit()
+    # Execute the query on every shard, since only the customer's store knows them
+    shards.apply(lambda connection: connection.execute(text(sql), {'first_name': first_name, 'last_name': last_name,
+                                                                   'email': email, 'customer_id': customer_id}))
+    cache.invalidate('customers')
 
     return jsonify({'message': 'Customer updated successfully'})
 
 #Route to Delete a Customer
 @app.route('/delete_customer/<int:customer_id>', methods=['DELETE']) 
+@transactions.retrying
 def delete_customer(customer_id):
     # SQL query to delete a customer
     sql = """
@@ -511,10 +914,9 @@ def delete_customer(customer_id):
         WHERE customer_id = :customer_id
     """
 
-    with db.engine.connect() as connection:
-        # Execute the query
-        connection.execute(text(sql), {'customer_id': customer_id})
-        connection.commit()
+    # Execute the query on every shard, since only the customer's store knows them
+    shards.apply(lambda connection: connection.execute(text(sql), {'customer_id': customer_id}))
+    cache.invalidate('customers')
 
     return jsonify({'message': 'Customer deleted successfully'})
 
@@ -522,8 +924,13 @@ def delete_customer(customer_id):
 # Route to fetch rental information for a customer
 @app.route('/customer_rentals/<int:customer_id>', methods=['GET'])
 def get_customer_rentals(customer_id):
+    # Archived rentals are included only when asked for
+    include_archive = request.args.get('include_archive', 'false').lower() in ('1', 'true', 'yes')
+    if shards.enabled():
+        return sharded_customer_rentals(customer_id, include_archive)
+
     # SQL query to fetch rental information for the customer
-    sql = """
+    sql = f"""
         SELECT 
             rental.rental_id,
             film.title,
@@ -531,7 +938,7 @@ def get_customer_rentals(customer_id):
             rental.rental_date,
             rental.return_date
         FROM 
-            rental
+            {archive.rental_source(include_archive)}
         INNER JOIN 
             inventory ON rental.inventory_id = inventory.inventory_id
         INNER JOIN 
@@ -542,7 +949,7 @@ def get_customer_rentals(customer_id):
             rental.return_date IS NULL DESC, rental.return_date DESC
     """
 
-    with db.engine.connect() as connection:
+    with transactions.connect() as connection:
         # Execute the query
         result = connection.execute(text(sql), {'customer_id': customer_id})
         # Fetch all results
@@ -553,39 +960,446 @@ def get_customer_rentals(customer_id):
 
 
         return jsonify({'rentals': rentals})
+
+
+# The same when sharded: the customer's rentals are on the shards of the
+# stores they rented from, and film titles come from the catalog snapshot
+def sharded_customer_rentals(customer_id, include_archive):
+    sql = f"""
+        SELECT 
+            rental.rental_id,
+            inventory.film_id,
+            rental.inventory_id,
+            rental.rental_date,
+            rental.return_date
+        FROM 
+            {archive.rental_source(include_archive)}
+        INNER JOIN 
+            inventory ON rental.inventory_id = inventory.inventory_id
+        WHERE 
+            rental.customer_id = :customer_id
+    """
+    _, results = shards.gather(text(sql), {'customer_id': customer_id})
+
+    # Open rentals first, then the most recently returned
+    results.sort(key=lambda row: row.rental_id)
+    results = ([row for row in results if row.return_date is None] +
+               sorted((row for row in results if row.return_date is not None), key=lambda row: row.return_date,
+                      reverse=True))
+
+    films = catalog.current().film_by_id
+    rentals = [{'rental_id': row.rental_id, 'title': films[row.film_id].title, 'inventory_id': row.inventory_id,
+                'rental_date': row.rental_date, 'return_date': row.return_date}
+               for row in results if row.film_id in films]
+    return jsonify({'rentals': rentals})
     
 # Route to update the return date of a rental
 @app.route('/update_return_date/<int:rental_id>', methods=['PUT'])
+@transactions.retrying
 def update_return_date(rental_id):
     # Get the current timestamp
     current_timestamp = datetime.now()
 
-    # SQL query to check if the return date is null
+    # SQL query to close the rental only if it is still open
+    update_sql = """
+        UPDATE rental
+        SET return_date = :current_timestamp
+        WHERE rental_id = :rental_id AND return_date IS NULL
+    """
+
+    # SQL query to find out why nothing was updated
     check_sql = """
         SELECT return_date FROM rental WHERE rental_id = :rental_id
     """
 
-    with db.engine.connect() as connection:
-        # Execute the query to check return date
-        result = connection.execute(text(check_sql), {'rental_id': rental_id})
-        rental = result.fetchone()
-
-        if rental is None:
-            # If rental doesn't exist
+    # The rental lives on the shard of the store it was rented from
+    store_id = None
+    if shards.enabled():
+        store_id = shards.store_of_rental(rental_id)
+        if store_id is None:
             return jsonify({'error': 'Rental not found'}),404
 
-        if rental[0] is not None:
+    with shards.begin(store_id) as connection:
+        # Execute the query to update return date
+        result = connection.execute(text(update_sql), {'current_timestamp': current_timestamp, 'rental_id': rental_id})
+
+        if result.rowcount == 0:
+            rental = connection.execute(text(check_sql), {'rental_id': rental_id}).fetchone()
+
+            if rental is None:
+                # If rental doesn't exist
+                return jsonify({'error': 'Rental not found'}),404
+
             # If return date is not null, throw an error
             return jsonify({'error': 'Rental already Returned'}),400
+    overdue.tracker.remove([rental_id])
+    cache.invalidate('rentals')
+
+    return jsonify({'message': 'Return date updated successfully'})
+
+
+# Route to return a batch of rentals by rental_id or by scanned inventory_id
+@app.route('/return_rentals', methods=['POST'])
+@transactions.retrying
+def return_rentals():
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    if ('rental_ids' in data) == ('inventory_ids' in data):
+        return jsonify({'error': 'Provide either rental_ids or inventory_ids'}), 400
+
+    key = 'rental_ids' if 'rental_ids' in data else 'inventory_ids'
+    values = data[key]
+    # bool is a subclass of int, so reject it explicitly
+    if not isinstance(values, list) or any(isinstance(value, bool) or not isinstance(value, int) for value in values):
+        return jsonify({'error': f'{key} must be a list of integers'}), 400
+    ids = list(dict.fromkeys(values))
+    if not ids:
+        return jsonify({'error': f'{key} must not be empty'}), 400
+    if len(ids) > app.config['RETURN_BATCH_MAX']:
+        return jsonify({'error': f"At most {app.config['RETURN_BATCH_MAX']} items per batch"}), 400
+
+    column = Rental.rental_id if key == 'rental_ids' else Rental.inventory_id
+    current_timestamp = datetime.now()
+
+    # Close every matching open rental with a single conditional UPDATE
+    close = (
+        update(Rental)
+        .where(column.in_(ids), Rental.return_date.is_(None))
+        .values(return_date=current_timestamp)
+    )
 
-        # SQL query to update the return date of a rental
-        update_sql = """
-            UPDATE rental
-            SET return_date = :current_timestamp
-            WHERE rental_id = :rental_id
+    # Runs once per shard (once on the main database when unsharded)
+    def close_open_rentals(connection):
+        if connection.dialect.update_returning:
+            closed = connection.execute(close.returning(Rental.rental_id, Rental.inventory_id)).all()
+        else:
+            # Without UPDATE ... RETURNING (MySQL), lock the open rows first and
+            # then close exactly those by rental_id
+            closed = connection.execute(
+                select(Rental.rental_id, Rental.inventory_id)
+                .where(column.in_(ids), Rental.return_date.is_(None))
+                .with_for_update()
+            ).all()
+            if closed:
+                connection.execute(
+                    update(Rental)
+                    .where(Rental.rental_id.in_([rental_id for rental_id, _ in closed]))
+                    .values(return_date=current_timestamp)
+                )
+
+        # Only rental ids that were not closed need a second look
+        closed_ids = {rental_id for rental_id, _ in closed}
+        missing = [item for item in ids if item not in closed_ids]
+        known = set()
+        if missing and key == 'rental_ids':
+            known = set(connection.execute(select(Rental.rental_id).where(Rental.rental_id.in_(missing))).scalars())
+        return closed, known
+
+    closed, known = [], set()
+    for shard_closed, shard_known in shards.apply(close_open_rentals):
+        closed.extend(shard_closed)
+        known |= shard_known
+
+    closed_by_item = {}
+    for rental_id, inventory_id in closed:
+        item = rental_id if key == 'rental_ids' else inventory_id
+        closed_by_item.setdefault(item, []).append(rental_id)
+
+    if closed:
+        overdue.tracker.remove([rental_id for rental_id, _ in closed])
+        cache.invalidate('rentals')
+
+    results = []
+    for item in ids:
+        if item in closed_by_item:
+            results.append({key[:-1]: item, 'status': 'returned', 'rental_ids': closed_by_item[item]})
+        elif key == 'inventory_ids':
+            results.append({key[:-1]: item, 'status': 'no_open_rental'})
+        elif item in known:
+            results.append({key[:-1]: item, 'status': 'already_returned'})
+        else:
+            results.append({key[:-1]: item, 'status': 'not_found'})
+
+    return jsonify({'returned': len(closed), 'results': results})
+
+
+# Route to list overdue rentals, most overdue first, optionally for one customer
+@app.route('/overdue_rentals', methods=['GET'])
+def overdue_rentals():
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', app.config['OVERDUE_PAGE_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['OVERDUE_PAGE_MAX_LIMIT']))
+    customer_id = request.args.get('customer_id', type=int)
+
+    # Read the page from the in-memory overdue queue
+    total, rentals = overdue.tracker.overdue(offset, limit, customer_id)
+
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'rentals': rentals})
+
+
+# Route to get the customers with the most overdue rentals
+@app.route('/overdue_rentals/customers', methods=['GET'])
+def overdue_customers():
+    limit = request.args.get('limit', app.config['OVERDUE_PAGE_DEFAULT_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['OVERDUE_PAGE_MAX_LIMIT']))
+
+    customers = [
+        {'customer_id': customer_id, 'overdue_count': count}
+        for customer_id, count in overdue.tracker.top_customers(limit)
+    ]
+    return jsonify({'customers': customers})
+
+
+# Route to get the number of overdue rentals held by a customer
+@app.route('/overdue_rentals/customers/<int:customer_id>', methods=['GET'])
+def customer_overdue_count(customer_id):
+    count = overdue.tracker.customer_count(customer_id)
+    return jsonify({'customer_id': customer_id, 'overdue_count': count})
+
+
+# Route to get rental counts grouped by film, category, store or actor
+@app.route("/analytics/rentals", methods=["GET"])
+def analytics_rentals():
+    try:
+        results = analytics.engine.rentals(
+            by=request.args.get("by", "film"),
+            period=request.args.get("period"),
+            start=request.args.get("start"),
+            end=request.args.get("end"),
+            limit=request.args.get("limit", type=int),
+        )
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({"rentals": results})
+
+
+# Route to get rental revenue grouped by film, category, store or actor
+@app.route("/analytics/revenue", methods=["GET"])
+def analytics_revenue():
+    try:
+        results = analytics.engine.revenue(
+            by=request.args.get("by", "film"),
+            period=request.args.get("period"),
+            start=request.args.get("start"),
+            end=request.args.get("end"),
+            limit=request.args.get("limit", type=int),
+        )
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({"revenue": results})
+
+
+# Route to get the share of days copies spent rented out, last 30 days by default
+@app.route("/analytics/utilization", methods=["GET"])
+def analytics_utilization():
+    end = request.args.get("end") or datetime.utcnow().date().isoformat()
+    start = request.args.get("start")
+
+    try:
+        if not start:
+            start = (datetime.fromisoformat(end) - timedelta(days=29)).date().isoformat()
+        results = analytics.engine.utilization(
+            start,
+            end,
+            by=request.args.get("by", "inventory"),
+            limit=request.args.get("limit", type=int),
+        )
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({"utilization": results})
+
+
+# Columns written by the rental export, in order
+EXPORT_COLUMNS = [
+    "rental_id",
+    "rental_date",
+    "return_date",
+    "inventory_id",
+    "store_id",
+    "film_id",
+    "film_title",
+    "customer_id",
+    "customer_name",
+]
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+# Route to stream rentals in a date range as CSV or NDJSON
+@app.route("/export/rentals", methods=["GET"])
+def export_rentals():
+    export_format = request.args.get("format", "csv")
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    # Rentals are exported in rental_id order, so a client can resume an
+    # interrupted export by passing the last rental_id it received
+    include_archive = request.args.get("include_archive", "false").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+    filters = ["rental.rental_id > :after_rental_id"]
+    params = {"after_rental_id": request.args.get("after_rental_id", 0, type=int)}
+    for name, column, kind, operator in (
+        ("start", "rental.rental_date", datetime.fromisoformat, ">="),
+        ("end", "rental.rental_date", datetime.fromisoformat, "<"),
+        ("store_id", "inventory.store_id", int, "="),
+        ("customer_id", "rental.customer_id", int, "="),
+    ):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            params[name] = kind(value)
+        except ValueError:
+            return jsonify({"error": f"Invalid {name} '{value}'"}), 400
+        filters.append(f"{column} {operator} :{name}")
+
+    sql = f"""
+        SELECT
+            rental.rental_id,
+            rental.rental_date,
+            rental.return_date,
+            rental.inventory_id,
+            inventory.store_id,
+            film.film_id,
+            film.title AS film_title,
+            customer.customer_id,
+            CONCAT(customer.first_name, ' ', customer.last_name) AS customer_name
+        FROM
+            {archive.rental_source(include_archive)}
+        INNER JOIN
+            inventory ON rental.inventory_id = inventory.inventory_id
+        INNER JOIN
+            film ON inventory.film_id = film.film_id
+        INNER JOIN
+            customer ON rental.customer_id = customer.customer_id
+        WHERE
+            {" AND ".join(filters)}
+        ORDER BY
+            rental.rental_id
+    """
+    chunk_size = app.config["EXPORT_CHUNK_SIZE"]
+
+    # Server-side cursor: rows arrive chunk_size at a time, and each chunk is
+    # written out before the next one is fetched
+    def chunks():
+        with db.engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, yield_per=chunk_size
+            ).execute(text(sql), params)
+            yield from result.partitions()
+
+    # Sharded, every shard streams its rentals in rental_id order and the
+    # streams are merged; titles come from the catalog snapshot and customer
+    # names are looked up once per chunk, since customers rent from any store
+    def sharded_chunks():
+        shard_sql = f"""
+            SELECT
+                rental.rental_id,
+                rental.rental_date,
+                rental.return_date,
+                rental.inventory_id,
+                inventory.store_id,
+                inventory.film_id,
+                rental.customer_id
+            FROM
+                {archive.rental_source(include_archive)}
+            INNER JOIN
+                inventory ON rental.inventory_id = inventory.inventory_id
+            WHERE
+                {" AND ".join(filters)}
+            ORDER BY
+                rental.rental_id
         """
-        # Execute the query to update return date
-        connection.execute(text(update_sql), {'current_timestamp': current_timestamp, 'rental_id': rental_id})
-        connection.commit()
+        rows = shards.stream(
+            text(shard_sql), params, chunk_size, key=lambda row: row.rental_id
+        )
+        films = catalog.current().film_by_id
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            names = shards.customer_names({row.customer_id for row in chunk})
+            yield [
+                (
+                    row.rental_id,
+                    row.rental_date,
+                    row.return_date,
+                    row.inventory_id,
+                    row.store_id,
+                    row.film_id,
+                    films[row.film_id].title,
+                    row.customer_id,
+                    names[row.customer_id],
+                )
+                for row in chunk
+                if row.film_id in films and row.customer_id in names
+            ]
+
+    def generate():
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        for rows in sharded_chunks() if shards.enabled() else chunks():
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(
+                    [_export_value(value) for value in row] for row in rows
+                )
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(
+                        dict(
+                            zip(
+                                EXPORT_COLUMNS,
+                                (_export_value(value) for value in row),
+                            )
+                        )
+                    )
+                    + "\n"
+                    for row in rows
+                )
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=rentals.{export_format}"
+        },
+    )
+
 
-    return jsonify({'message': 'Return date updated successfully'})
\ No newline at end of file
+# Route to reload the in-memory film catalog
+@app.route("/admin/catalog/reload", methods=["POST"])
+@admin.admin_required
+def reload_catalog():
+    snapshot = catalog.reload()
+    cache.invalidate("catalog")
+    return jsonify({"message": "Catalog reloaded", "films": len(snapshot.films)})
+
+
+# Route to move old closed rentals into the archive table
+@app.route("/admin/archive/rentals", methods=["POST"])
+@admin.admin_required
+def archive_rentals():
+    archived, remaining = archive.archive_rentals(
+        older_than_days=request.args.get("older_than_days", type=int),
+        max_batches=request.args.get("max_batches", type=int),
+    )
+    return jsonify({"archived": archived, "remaining": remaining})
@@ -0,0 +1,280 @@
+# app/scheduler.py
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify
+from . import app, db, rollups, shards, statements
+
+# Background refresh of precomputed aggregates. Each registered job computes
+# a snapshot (a leaderboard, the per-film availability table) on a thread
+# pool, every interval seconds give or take SCHEDULER_JITTER, and never runs
+# twice at the same time. Routes read the latest snapshot with
+# stale-while-revalidate semantics: a stale snapshot is still served while a
+# refresh is queued behind it, and only the very first read of a job waits
+# for a computation. Every job runs once as soon as the scheduler starts.
+#
+# With SCHEDULER_ENABLED off, reads compute the aggregate inline as before.
+
+# Seconds between checks for jobs that are due
+TICK_SECONDS = 0.5
+
+
+class _Job:
+    __slots__ = (
+        "name",
+        "compute",
+        "interval_setting",
+        "value",
+        "computed_at",
+        "next_run",
+        "running",
+        "ready",
+        "runs",
+        "failures",
+        "last_duration",
+        "last_error",
+    )
+
+    def __init__(self, name, compute, interval_setting):
+        self.name = name
+        self.compute = compute
+        self.interval_setting = interval_setting
+        self.value = None
+        self.computed_at = None
+        self.next_run = 0.0
+        self.running = False
+        self.ready = threading.Event()
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+        self.last_error = None
+
+    @property
+    def interval(self):
+        return app.config[self.interval_setting]
+
+
+class RefreshScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name, compute, interval_setting):
+        self._jobs[name] = _Job(name, compute, interval_setting)
+
+    def __contains__(self, name):
+        return name in self._jobs
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._executor = ThreadPoolExecutor(
+                max_workers=app.config["SCHEDULER_WORKERS"],
+                thread_name_prefix="refresh",
+            )
+            self._thread = threading.Thread(
+                target=self._loop, name="refresh-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, executor = self._thread, self._executor
+            self._thread = self._executor = None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            executor.shutdown(wait=True)
+
+    def _loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            now = time.monotonic()
+            for job in list(self._jobs.values()):
+                if job.next_run <= now:
+                    self._submit(job)
+
+    # Queue a run of the job unless one is already queued or running
+    def _submit(self, job):
+        with self._lock:
+            if job.running or self._executor is None:
+                return
+            job.running = True
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                value = job.compute()
+        except Exception as error:
+            job.failures += 1
+            job.last_error = repr(error)
+            app.logger.exception("Refresh of %s failed", job.name)
+        else:
+            job.value = value
+            job.computed_at = time.monotonic()
+            job.last_error = None
+        finally:
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+            jitter = app.config["SCHEDULER_JITTER"]
+            job.next_run = time.monotonic() + job.interval * (
+                1 + random.uniform(-jitter, jitter)
+            )
+            with self._lock:
+                job.running = False
+            job.ready.set()
+
+    # The latest snapshot of a job; stale snapshots are served while a
+    # refresh runs in the background
+    def get(self, name):
+        job = self._jobs[name]
+        if not app.config["SCHEDULER_ENABLED"]:
+            return job.compute()
+
+        self.start()
+        if job.computed_at is None:
+            # Nothing to serve yet: wait for the first run, or compute inline
+            # if it is slow or failed
+            self._submit(job)
+            job.ready.wait(app.config["SCHEDULER_FIRST_RUN_TIMEOUT"])
+            if job.computed_at is None:
+                return job.compute()
+        elif time.monotonic() - job.computed_at > job.interval:
+            self._submit(job)
+        return job.value
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            name: {
+                "age_seconds": (
+                    None if job.computed_at is None else round(now - job.computed_at, 3)
+                ),
+                "interval_seconds": job.interval,
+                "last_duration_ms": (
+                    None
+                    if job.last_duration is None
+                    else round(job.last_duration * 1000, 3)
+                ),
+                "running": job.running,
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_error": job.last_error,
+            }
+            for name, job in self._jobs.items()
+        }
+
+
+jobs = RefreshScheduler()
+
+
+def _window_name(days):
+    return "all" if days is None else f"{days}d"
+
+
+# Rental leaderboards scatter-gather across the store shards when sharded;
+# the actor ranking by film count only reads the catalog tables
+def _top_films(days, limit):
+    if shards.enabled():
+        return shards.top_films(days, limit)
+    return rollups.top_films(days, limit)
+
+
+def _top_actors(days, limit):
+    if shards.enabled():
+        return shards.top_actors(days, limit)
+    return rollups.top_actors(days, limit)
+
+
+def _actors_by_film_count(limit):
+    return db.session.execute(
+        statements.TOP_ACTORS_BY_FILM_COUNT, {"limit": limit}
+    ).all()
+
+
+def _register_leaderboards():
+    limit = app.config["LEADERBOARD_MAX_LIMIT"]
+    for days in app.config["SCHEDULER_LEADERBOARD_WINDOWS"]:
+        name = _window_name(days)
+        jobs.register(
+            f"top_films:{name}",
+            lambda days=days: _top_films(days, limit),
+            "SCHEDULER_LEADERBOARD_SECONDS",
+        )
+        jobs.register(
+            f"top_actors:{name}",
+            lambda days=days: _top_actors(days, limit),
+            "SCHEDULER_LEADERBOARD_SECONDS",
+        )
+    jobs.register(
+        "actors_by_film_count",
+        lambda: _actors_by_film_count(limit),
+        "SCHEDULER_LEADERBOARD_SECONDS",
+    )
+
+
+def _movie_info():
+    if shards.enabled():
+        return shards.movie_info()
+    results = db.session.execute(statements.MOVIE_INFO_ALL)
+    rows = results.all()
+    return list(results.keys()), rows, {row.film_id: row for row in rows}
+
+
+_register_leaderboards()
+jobs.register("movie_info", _movie_info, "SCHEDULER_AVAILABILITY_SECONDS")
+
+
+# Whether routes read scheduled snapshots. Those routes skip the result
+# cache then: an entry stored after a write's invalidation would keep an old
+# snapshot for the whole cache TTL, past the job's next refresh.
+def serving():
+    return app.config["SCHEDULER_ENABLED"]
+
+
+# Top films for a window, from the scheduled snapshot when there is one
+def top_films(days, limit):
+    name = f"top_films:{_window_name(days)}"
+    if app.config["SCHEDULER_ENABLED"] and name in jobs:
+        return jobs.get(name)[:limit]
+    return _top_films(days, limit)
+
+
+# Top actors by rentals of their films within a window, from the scheduled
+# snapshot when there is one
+def top_actors(days, limit):
+    name = f"top_actors:{_window_name(days)}"
+    if app.config["SCHEDULER_ENABLED"] and name in jobs:
+        return jobs.get(name)[:limit]
+    return _top_actors(days, limit)
+
+
+# Top actors by number of films, from the scheduled snapshot when there is one
+def actors_by_film_count(limit):
+    if app.config["SCHEDULER_ENABLED"]:
+        return jobs.get("actors_by_film_count")[:limit]
+    return _actors_by_film_count(limit)
+
+
+# Copies, rentals out and remaining copies per film: (columns, rows, by film_id)
+def movie_info():
+    return jobs.get("movie_info")
+
+
+# Route to get refresh scheduler freshness and duration metrics
+@app.route("/metrics/scheduler", methods=["GET"])
+def scheduler_metrics():
+    return jsonify(
+        {
+            "enabled": app.config["SCHEDULER_ENABLED"],
+            "jobs": jobs.stats(),
+        }
+    )
@@ -0,0 +1,469 @@
+# app/shards.py
+
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, create_engine, func, select, union_all
+from . import app, catalog, db, rollups, transactions
+from .models import Customer, Inventory, Rental, RentalArchive, Staff
+
+# Store-aware database routing. STORE_SHARDS maps each store_id to the URI of
+# the database holding that store's staff, customers, inventory and rentals;
+# the catalog tables (film, actor, category, ...) stay on the main database.
+# When sharding is on, every store must be listed. With STORE_SHARDS empty,
+# every store lives on the main database.
+#
+# Each shard holds the Sakila schema with its store's rows, plus the
+# address, city and country rows of its customers, and the app's archive
+# tables (misc/setup_db.py creates them on every shard). A rental lives on
+# the shard of the store that stocks the copy, which need not be the
+# customer's own store. Customer and rental ids are only unique across
+# shards if each shard is given its own auto-increment range.
+#
+# Single-store writes go straight to their store's shard; returns, which
+# only know a rental or copy id, find the shard holding it or run on every
+# shard. Global leaderboards and availability scatter one grouped query to
+# every shard in parallel and merge the partial per-film counts. A film's
+# rentals are split across the stores that stock it, so shards return all
+# their per-film counts (bounded by the catalog size) rather than a local
+# top N, which could miss the global leaders.
+#
+# Customer lookups, listings and searches, a customer's rentals and the
+# export scatter to every shard and merge the results in Python, taking film
+# titles from the catalog snapshot. The catalog's copy counts, overdue
+# tracking, analytics, recommendations and archiving read every shard, and
+# the background catch-ups keep one rental_id watermark per shard.
+
+RankedFilm = namedtuple(
+    "RankedFilm",
+    [
+        "film_id",
+        "title",
+        "description",
+        "release_year",
+        "rating",
+        "special_features",
+        "rental_count",
+    ],
+)
+MovieInfo = namedtuple(
+    "MovieInfo",
+    [
+        "film_id",
+        "film_title",
+        "number_of_copies",
+        "number_of_rentals_out",
+        "remaining_copies",
+    ],
+)
+RankedActor = namedtuple(
+    "RankedActor",
+    [
+        "actor_id",
+        "first_name",
+        "last_name",
+        "full_name",
+        "film_count",
+        "rental_count",
+    ],
+)
+
+_lock = threading.Lock()
+_engines = {}
+_executor = None
+_staff_by_store = {}
+
+
+# Copies rented from rental and rental_archive, rented since :start if asked
+def _history(since):
+    parts = []
+    for table in (Rental, RentalArchive):
+        part = select(table.inventory_id)
+        if since:
+            part = part.where(table.rental_date >= bindparam("start", type_=DateTime))
+        parts.append(part)
+    return union_all(*parts).subquery("history")
+
+
+def _film_rental_counts(history):
+    return (
+        select(Inventory.film_id, func.count().label("rental_count"))
+        .join(history, history.c.inventory_id == Inventory.inventory_id)
+        .group_by(Inventory.film_id)
+    )
+
+
+# Shards are not rolled up, so archived rentals are counted from the archive
+FILM_RENTAL_COUNTS = _film_rental_counts(_history(since=False))
+FILM_RENTAL_COUNTS_SINCE = _film_rental_counts(_history(since=True))
+INVENTORY_STORE = select(Inventory.store_id).where(
+    Inventory.inventory_id == bindparam("inventory_id")
+)
+RENTAL_STORE = (
+    select(Inventory.store_id)
+    .join(Rental, Rental.inventory_id == Inventory.inventory_id)
+    .where(Rental.rental_id == bindparam("rental_id"))
+)
+_open_rental = (Rental.inventory_id == Inventory.inventory_id) & (
+    Rental.return_date.is_(None)
+)
+# Same join as statements.MOVIE_INFO_ALL, without the catalog's film table
+FILM_COPIES_AND_RENTALS_OUT = (
+    select(
+        Inventory.film_id,
+        func.count(Inventory.inventory_id),
+        func.count(Rental.rental_id),
+    )
+    .outerjoin(Rental, _open_rental)
+    .group_by(Inventory.film_id)
+)
+FILM_COPIES_IN_STORE = (
+    select(Inventory.inventory_id)
+    .outerjoin(Rental, _open_rental)
+    .where(Inventory.film_id == bindparam("film_id"), Rental.rental_id.is_(None))
+)
+FILM_AVAILABLE = (
+    select(Inventory.inventory_id)
+    .where(Inventory.film_id == bindparam("film_id"), Inventory.available_copies > 0)
+    .limit(1)
+)
+# Every copy of a film, with the id of its open rental if it is rented out
+FILM_COPIES = (
+    select(Inventory.inventory_id, Rental.rental_id)
+    .outerjoin(Rental, _open_rental)
+    .where(Inventory.film_id == bindparam("film_id"))
+)
+CUSTOMER_EXISTS = select(Customer.customer_id).where(
+    Customer.customer_id == bindparam("customer_id")
+)
+CUSTOMER_NAMES = select(
+    Customer.customer_id, Customer.first_name, Customer.last_name
+).where(Customer.customer_id.in_(bindparam("customer_ids", expanding=True)))
+STORE_STAFF = (
+    select(Staff.staff_id)
+    .where(Staff.store_id == bindparam("store_id"))
+    .order_by(Staff.staff_id)
+    .limit(1)
+)
+
+
+def enabled():
+    return bool(app.config["STORE_SHARDS"])
+
+
+# Engine of the database holding the store's data
+def engine(store_id):
+    uri = app.config["STORE_SHARDS"].get(store_id)
+    if uri is None:
+        return db.engine
+    with _lock:
+        shard = _engines.get(uri)
+        if shard is None:
+            shard = _engines[uri] = create_engine(uri, pool_pre_ping=True)
+    return shard
+
+
+# Run a block of reads on the store's database; stores on the main database
+# use the request's connection
+def connect(store_id):
+    if store_id in app.config["STORE_SHARDS"]:
+        return engine(store_id).connect()
+    return transactions.connect()
+
+
+# Run a block of writes on the store's database and commit them
+@contextmanager
+def begin(store_id):
+    if store_id not in app.config["STORE_SHARDS"]:
+        with transactions.begin() as connection:
+            yield connection
+        return
+    with engine(store_id).begin() as connection:
+        yield connection
+    transactions.committed()
+
+
+# Run fn(connection) in a transaction on every shard in turn, committing each
+def apply(fn):
+    if not enabled():
+        with transactions.begin() as connection:
+            return [fn(connection)]
+    results = []
+    for shard in engines():
+        with shard.begin() as connection:
+            results.append(fn(connection))
+        transactions.committed()
+    return results
+
+
+# One engine per distinct shard
+def engines():
+    distinct = {}
+    for store_id in app.config["STORE_SHARDS"]:
+        shard = engine(store_id)
+        distinct[id(shard)] = shard
+    return list(distinct.values()) or [db.engine]
+
+
+# Run fn(connection) on every shard in parallel; results in shard order
+def scatter(fn):
+    global _executor
+    if not enabled():
+        with transactions.connect() as connection:
+            return [fn(connection)]
+    shards = engines()
+    if len(shards) == 1:
+        with shards[0].connect() as connection:
+            return [fn(connection)]
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config["SHARD_WORKERS"], thread_name_prefix="shard"
+            )
+
+    def run(shard):
+        with shard.connect() as connection:
+            return fn(connection)
+
+    futures = [_executor.submit(run, shard) for shard in shards]
+    return [future.result(app.config["SHARD_TIMEOUT"]) for future in futures]
+
+
+# Rows of a statement from every shard: (columns, rows in shard order)
+def gather(statement, params=None):
+    def run(connection):
+        result = connection.execute(statement, params or {})
+        return list(result.keys()), result.all()
+
+    results = scatter(run)
+    return results[0][0], [row for _, rows in results for row in rows]
+
+
+# A connection to every shard, or to the main database when unsharded, as
+# (key, connection) pairs; background catch-ups keep a watermark per key
+@contextmanager
+def connect_each():
+    with ExitStack() as stack:
+        yield [
+            (str(shard.url), stack.enter_context(shard.connect()))
+            for shard in engines()
+        ]
+
+
+# Rows of a statement from every shard, streamed chunk_size at a time from
+# each one and merged in key order. Each shard must return its rows in that
+# order.
+def stream(statement, params, chunk_size, key):
+    def rows(shard):
+        with shard.connect() as connection:
+            yield from connection.execution_options(
+                stream_results=True, yield_per=chunk_size
+            ).execute(statement, params)
+
+    return heapq.merge(*(rows(shard) for shard in engines()), key=key)
+
+
+# Store stocking the copy, or None if no shard has it
+def store_of_inventory(inventory_id):
+    found = scatter(
+        lambda connection: connection.execute(
+            INVENTORY_STORE, {"inventory_id": inventory_id}
+        ).scalar()
+    )
+    return next((store_id for store_id in found if store_id is not None), None)
+
+
+# Store holding the rental, or None if no shard has it
+def store_of_rental(rental_id):
+    found = scatter(
+        lambda connection: connection.execute(
+            RENTAL_STORE, {"rental_id": rental_id}
+        ).scalar()
+    )
+    return next((store_id for store_id in found if store_id is not None), None)
+
+
+# Whether any shard has the customer
+def customer_exists(customer_id):
+    found = scatter(
+        lambda connection: connection.execute(
+            CUSTOMER_EXISTS, {"customer_id": customer_id}
+        ).first()
+    )
+    return any(row is not None for row in found)
+
+
+# "first_name last_name" by customer_id, for the customers any shard has
+def customer_names(customer_ids):
+    if not customer_ids:
+        return {}
+    names = {}
+    for partial in scatter(
+        lambda connection: connection.execute(
+            CUSTOMER_NAMES, {"customer_ids": list(customer_ids)}
+        ).all()
+    ):
+        for customer_id, first_name, last_name in partial:
+            names[customer_id] = (
+                None
+                if first_name is None or last_name is None
+                else f"{first_name} {last_name}"
+            )
+    return names
+
+
+# A staff member of the store to record rentals under, looked up once per store
+def staff_for_store(store_id):
+    staff_id = _staff_by_store.get(store_id)
+    if staff_id is None:
+        with connect(store_id) as connection:
+            staff_id = connection.execute(STORE_STAFF, {"store_id": store_id}).scalar()
+        if staff_id is None:
+            return app.config["DEFAULT_STAFF_ID"]
+        _staff_by_store[store_id] = staff_id
+    return staff_id
+
+
+# Rentals per film summed over every shard, within the window if given
+def _film_counts(days):
+    start = rollups.window_start(days)
+    if start is None:
+        statement, params = FILM_RENTAL_COUNTS, {}
+    else:
+        statement = FILM_RENTAL_COUNTS_SINCE
+        params = {"start": datetime.combine(start, datetime.min.time())}
+
+    totals = Counter()
+    for partial in scatter(
+        lambda connection: connection.execute(statement, params).all()
+    ):
+        for film_id, count in partial:
+            totals[film_id] += count
+    return totals
+
+
+def _ranked(totals, limit):
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+# Top films by rentals across all stores, optionally for a single actor
+def top_films(days=None, limit=5, actor_id=None):
+    snapshot = catalog.current()
+    films = snapshot.film_by_id
+    totals = _film_counts(days)
+    if actor_id is not None:
+        totals = {
+            film_id: count
+            for film_id, count in totals.items()
+            if actor_id in snapshot.actor_ids_by_film.get(film_id, ())
+        }
+    return [
+        RankedFilm(
+            film_id,
+            films[film_id].title,
+            films[film_id].description,
+            films[film_id].release_year,
+            films[film_id].rating,
+            films[film_id].special_features,
+            count,
+        )
+        for film_id, count in _ranked(totals, limit)
+        if film_id in films
+    ]
+
+
+# Top actors by rentals of their films across all stores
+def top_actors(days=None, limit=5):
+    snapshot = catalog.current()
+    rentals, films = Counter(), Counter()
+    for film_id, count in _film_counts(days).items():
+        for actor_id in snapshot.actor_ids_by_film.get(film_id, ()):
+            rentals[actor_id] += count
+            films[actor_id] += 1
+
+    ranked = []
+    for actor_id, count in _ranked(rentals, limit):
+        actor = snapshot.actors.get(actor_id)
+        if actor is None:
+            continue
+        ranked.append(
+            RankedActor(
+                actor_id,
+                actor.first_name,
+                actor.last_name,
+                f"{actor.first_name} {actor.last_name}",
+                films[actor_id],
+                count,
+            )
+        )
+    return ranked
+
+
+# Copies, open rentals and remaining copies per film across all stores:
+# (columns, rows, by film_id), like the unsharded availability snapshot
+def movie_info():
+    copies, rentals_out = Counter(), Counter()
+    for partial in scatter(
+        lambda connection: connection.execute(FILM_COPIES_AND_RENTALS_OUT).all()
+    ):
+        for film_id, film_copies, film_rentals_out in partial:
+            copies[film_id] += film_copies
+            rentals_out[film_id] += film_rentals_out
+
+    rows = [
+        MovieInfo(
+            film.film_id,
+            film.title,
+            copies[film.film_id],
+            rentals_out[film.film_id],
+            copies[film.film_id] - rentals_out[film.film_id],
+        )
+        for film in catalog.current().films
+    ]
+    return list(MovieInfo._fields), rows, {row.film_id: row for row in rows}
+
+
+# Copies of a film that are not rented out, in any store, by inventory_id
+def copies_in_store(film_id):
+    found = scatter(
+        lambda connection: connection.execute(
+            FILM_COPIES_IN_STORE, {"film_id": film_id}
+        )
+        .scalars()
+        .all()
+    )
+    return sorted(inventory_id for partial in found for inventory_id in partial)
+
+
+# Whether any store has a copy of the film with available_copies left
+def film_available(film_id):
+    found = scatter(
+        lambda connection: connection.execute(
+            FILM_AVAILABLE, {"film_id": film_id}
+        ).first()
+    )
+    return any(row is not None for row in found)
+
+
+# Every copy of a film in any store and the ones not rented out, both by
+# inventory_id
+def film_copies(film_id):
+    copies = sorted(
+        row
+        for partial in scatter(
+            lambda connection: connection.execute(
+                FILM_COPIES, {"film_id": film_id}
+            ).all()
+        )
+        for row in partial
+    )
+    inventory_ids = list(dict.fromkeys(inventory_id for inventory_id, _ in copies))
+    rented_out = {inventory_id for inventory_id, rental_id in copies if rental_id}
+    available = [
+        inventory_id for inventory_id in inventory_ids if inventory_id not in rented_out
+    ]
+    return inventory_ids, available
@@ -0,0 +1,120 @@
+# app/singleflight.py
+
+import functools
+import threading
+from flask import Response, jsonify, request
+from . import app
+
+# Collapses identical in-flight requests: the first caller for a key runs the
+# view, later callers with the same key wait for it and share the response.
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "shared": 0,
+            "timeouts": 0,
+            "errors": 0,
+        }
+
+    # Run fn() once per key at a time; concurrent callers get the same result
+    # or the same exception. Returns (result, shared).
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["executions"] += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as error:
+                call.error = error
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise SingleFlightTimeout(f"Timed out waiting for {key[0]}")
+        if call.error is not None:
+            raise call.error
+        with self._lock:
+            self._stats["shared"] += 1
+        return call.result, True
+
+    # Counters; "shared" is the number of executions saved
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+group = SingleFlight()
+
+
+# Key a request by route and its normalized parameters
+def request_key():
+    return (
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+    )
+
+
+# Decorator for views whose identical concurrent requests should share one execution
+def coalesce(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Share only the finished body, status and headers; each caller gets
+        # its own Response object for after_request handlers to modify
+        def execute():
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers)
+
+        try:
+            (body, status, headers), shared = group.do(
+                request_key(), execute, timeout=app.config["SINGLEFLIGHT_TIMEOUT"]
+            )
+        except SingleFlightTimeout as error:
+            return jsonify({"error": str(error)}), 504
+
+        return Response(body, status=status, headers=headers)
+
+    return wrapper
+
+
+# Route to get single-flight counters
+@app.route("/metrics/singleflight", methods=["GET"])
+def singleflight_metrics():
+    return jsonify(group.stats())
@@ -0,0 +1,57 @@
+# app/statements.py
+
+from sqlalchemy import Integer, bindparam, func, select
+from .models import Actor, Film, FilmActor, Inventory, Rental
+
+# Hot-path queries built once at import time. Routes execute them with bound
+# parameters, so a request skips rebuilding the query chain and SQLAlchemy
+# serves the SQL string from its compiled cache.
+
+# Actors ranked by number of films
+_film_count = func.count(FilmActor.film_id)
+TOP_ACTORS_BY_FILM_COUNT = (
+    select(
+        Actor.actor_id,
+        Actor.first_name,
+        Actor.last_name,
+        func.concat(Actor.first_name, " ", Actor.last_name).label("full_name"),
+        _film_count.label("film_count"),
+    )
+    .join(FilmActor, Actor.actor_id == FilmActor.actor_id)
+    .group_by(Actor.actor_id, Actor.first_name, Actor.last_name)
+    .order_by(-_film_count)
+    .limit(bindparam("limit", type_=Integer))
+)
+
+# Number of copies per film
+_copies = func.count(Inventory.inventory_id)
+MOVIE_COPIES_INFO = (
+    select(
+        Film.film_id,
+        Film.title.label("film_title"),
+        _copies.label("number_of_copies"),
+    )
+    .outerjoin(Inventory, Film.film_id == Inventory.film_id)
+    .group_by(Film.film_id, Film.title)
+    .order_by(Film.film_id, _copies.desc())
+)
+
+# Copies, open rentals and remaining copies per film
+_rentals_out = func.count(Rental.rental_id)
+_movie_info = (
+    select(
+        Film.film_id,
+        Film.title.label("film_title"),
+        func.coalesce(_copies, 0).label("number_of_copies"),
+        func.coalesce(_rentals_out, 0).label("number_of_rentals_out"),
+        func.coalesce(_copies - _rentals_out, 0).label("remaining_copies"),
+    )
+    .outerjoin(Inventory, Film.film_id == Inventory.film_id)
+    .outerjoin(
+        Rental,
+        (Inventory.inventory_id == Rental.inventory_id)
+        & (Rental.return_date.is_(None)),
+    )
+    .group_by(Film.film_id, Film.title)
+)
+MOVIE_INFO_ALL = _movie_info.order_by(Film.film_id)
@@ -0,0 +1,126 @@
+# app/timeouts.py
+
+import re
+import threading
+import time
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from . import app
+
+# Per-route query deadlines enforced by the database. Each request gets a
+# deadline from STATEMENT_TIMEOUTS; every SELECT it issues carries the time
+# left as a MAX_EXECUTION_TIME hint on MySQL, and on SQLite a progress
+# handler aborts the statement once the deadline has passed. MySQL only
+# honours the hint on the top-level query block, so for a WITH statement it
+# goes on the first SELECT outside the CTEs' parentheses. Other statements
+# (INSERT ... SELECT, a parenthesised UNION) run without a MySQL limit.
+
+# MySQL: "Query execution was interrupted, maximum statement execution time exceeded"
+MYSQL_TIMEOUT_ERRNO = 3024
+
+# SQLite VM instructions between progress handler checks
+SQLITE_PROGRESS_STEPS = 1000
+
+_LEADING = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Quoted strings and identifiers are matched whole so that their contents
+# are skipped
+_TOKEN = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|[()]|\bSELECT\b", re.IGNORECASE
+)
+
+_lock = threading.Lock()
+_timeouts_by_route = {}
+
+
+def _deadline():
+    if not has_request_context():
+        return None
+    return g.get("statement_deadline")
+
+
+# Offset of the statement's top-level SELECT keyword, or None
+def _main_select(statement):
+    if not _LEADING.match(statement):
+        return None
+    depth = 0
+    for token in _TOKEN.finditer(statement):
+        text = token.group()
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0 and text.upper() == "SELECT":
+            return token.start()
+    return None
+
+
+@app.before_request
+def set_statement_deadline():
+    timeout = app.config["STATEMENT_TIMEOUTS"].get(
+        request.endpoint, app.config["STATEMENT_TIMEOUT_DEFAULT"]
+    )
+    if timeout:
+        g.statement_deadline = time.monotonic() + timeout / 1000
+
+
+@event.listens_for(Engine, "before_cursor_execute", retval=True)
+def apply_statement_deadline(conn, cursor, statement, parameters, context, executemany):
+    deadline = _deadline()
+    dialect = conn.dialect.name
+
+    if dialect == "sqlite":
+        dbapi_connection = conn.connection.dbapi_connection
+        if deadline is None:
+            dbapi_connection.set_progress_handler(None, 0)
+        else:
+            # A non-zero return aborts the statement with "interrupted"
+            dbapi_connection.set_progress_handler(
+                lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS
+            )
+    elif dialect == "mysql" and deadline is not None:
+        start = _main_select(statement)
+        if start is not None:
+            remaining = max(1, int((deadline - time.monotonic()) * 1000))
+            statement = (
+                f"{statement[:start]}SELECT /*+ MAX_EXECUTION_TIME({remaining}) */"
+                f"{statement[start + len('SELECT'):]}"
+            )
+
+    return statement, parameters
+
+
+def is_timeout(error):
+    orig = getattr(error, "orig", None)
+    if orig is None:
+        return False
+    if orig.args and orig.args[0] == MYSQL_TIMEOUT_ERRNO:
+        return True
+    return "interrupted" in str(orig)
+
+
+@app.errorhandler(OperationalError)
+def handle_statement_timeout(error):
+    if not is_timeout(error):
+        raise error
+
+    with _lock:
+        _timeouts_by_route[request.endpoint] = (
+            _timeouts_by_route.get(request.endpoint, 0) + 1
+        )
+    return jsonify({"error": "Query exceeded the time limit for this route"}), 504
+
+
+# Route to get statement timeout counters
+@app.route("/metrics/timeouts", methods=["GET"])
+def timeout_metrics():
+    with _lock:
+        by_route = dict(_timeouts_by_route)
+    return jsonify(
+        {
+            "timeouts": sum(by_route.values()),
+            "by_route": by_route,
+            "limits_ms": app.config["STATEMENT_TIMEOUTS"],
+        }
+    )
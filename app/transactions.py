@@ -0,0 +1,146 @@
+# app/transactions.py
+
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy.exc import DBAPIError
+from . import app, db
+
+# Request-scoped unit of work. Raw SQL runs on the connection db.session
+# holds for the request, so Core statements and ORM queries in one request
+# share a single pooled connection and transaction; Flask-SQLAlchemy rolls
+# back and returns it when the app context ends.
+#
+# Write routes are wrapped in retrying(): when the database aborts the
+# transaction as a deadlock victim or on a lock wait timeout, the session is
+# rolled back and the whole view runs again after an exponential backoff with
+# full jitter, up to TRANSACTION_MAX_ATTEMPTS times. Only work up to the
+# first commit is retried: once a view has committed, running it again would
+# repeat the write, so a later conflict is raised instead. Follow-up work
+# after the commit (rollup catch-ups, in-memory indexes) goes through
+# after_commit(), which logs conflicts rather than failing the request.
+
+# MySQL: ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+MYSQL_RETRYABLE_ERRNOS = (1213, 1205)
+
+_lock = threading.Lock()
+_retries_by_route = {}
+_exhausted_by_route = {}
+_post_commit_by_route = {}
+
+
+def is_retryable(error):
+    orig = getattr(error, "orig", None)
+    if orig is None:
+        return False
+    if orig.args and orig.args[0] in MYSQL_RETRYABLE_ERRNOS:
+        return True
+    # SQLite reports lock contention as "database is locked"
+    return "database is locked" in str(orig)
+
+
+# The request's connection, shared with db.session
+def connection():
+    return db.session.connection()
+
+
+# Run a block of reads on the request's connection
+@contextmanager
+def connect():
+    yield connection()
+
+
+# Record that the request has committed a write, so it is not retried
+def committed():
+    if has_request_context():
+        g.transaction_committed = True
+
+
+# Run a block of writes on the request's connection and commit them
+@contextmanager
+def begin():
+    yield connection()
+    db.session.commit()
+    committed()
+
+
+# Run fn(*args) after the request's commit. A conflict is logged and counted
+# instead of raised, since the committed write must not run again; the
+# skipped work is caught up by the next rollup or overdue refresh.
+def after_commit(fn, *args):
+    try:
+        return fn(*args)
+    except DBAPIError as error:
+        if not is_retryable(error):
+            raise
+        db.session.rollback()
+        _count(_post_commit_by_route, request.endpoint)
+        app.logger.warning(
+            "%s: %s skipped after commit: %s", request.endpoint, fn.__name__, error
+        )
+        return None
+
+
+def _count(counters, endpoint):
+    with _lock:
+        counters[endpoint] = counters.get(endpoint, 0) + 1
+
+
+def _backoff(attempt):
+    delay = min(
+        app.config["TRANSACTION_BACKOFF_MAX"],
+        app.config["TRANSACTION_BACKOFF_BASE"] * 2**attempt,
+    )
+    return random.uniform(0, delay)
+
+
+# Re-run the view when its transaction fails on a deadlock or lock wait timeout
+def retrying(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        attempts = app.config["TRANSACTION_MAX_ATTEMPTS"]
+        for attempt in range(attempts):
+            g.transaction_committed = False
+            try:
+                return view(*args, **kwargs)
+            except DBAPIError as error:
+                if not is_retryable(error) or g.pop("transaction_committed"):
+                    raise
+                db.session.rollback()
+                if attempt + 1 == attempts:
+                    break
+                _count(_retries_by_route, request.endpoint)
+                time.sleep(_backoff(attempt))
+
+        _count(_exhausted_by_route, request.endpoint)
+        app.logger.warning(
+            "%s gave up after %d conflicting attempts", request.endpoint, attempts
+        )
+        response = jsonify({"error": "Conflicting concurrent update, please retry"})
+        response.headers["Retry-After"] = str(app.config["ADMISSION_RETRY_AFTER"])
+        return response, 503
+
+    return wrapper
+
+
+# Route to get transaction retry counters
+@app.route("/metrics/transactions", methods=["GET"])
+def transaction_metrics():
+    with _lock:
+        retries = dict(_retries_by_route)
+        exhausted = dict(_exhausted_by_route)
+        post_commit = dict(_post_commit_by_route)
+    return jsonify(
+        {
+            "retries": sum(retries.values()),
+            "retries_by_route": retries,
+            "exhausted": sum(exhausted.values()),
+            "exhausted_by_route": exhausted,
+            "post_commit_conflicts": sum(post_commit.values()),
+            "post_commit_conflicts_by_route": post_commit,
+            "max_attempts": app.config["TRANSACTION_MAX_ATTEMPTS"],
+        }
+    )
@@ -0,0 +1,69 @@
+# misc/bench_analytics.py
+#
+# Compare the in-memory analytics engine against the equivalent SQL GROUP BY.
+#
+#   python misc/bench_analytics.py [rentals]
+
+import sys
+from bench_utils import best_of, build_database, load_app, scratch_path
+
+RENTALS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+# The grouped queries each engine call replaces
+QUERIES = {
+    ("film", None): """
+        SELECT i.film_id, COUNT(*) FROM rental r
+        JOIN inventory i ON i.inventory_id = r.inventory_id
+        GROUP BY i.film_id ORDER BY COUNT(*) DESC
+    """,
+    ("category", "month"): """
+        SELECT fc.category_id, strftime('%Y-%m', r.rental_date), COUNT(*) FROM rental r
+        JOIN inventory i ON i.inventory_id = r.inventory_id
+        JOIN film_category fc ON fc.film_id = i.film_id
+        GROUP BY 1, 2
+    """,
+    ("store", "day"): """
+        SELECT i.store_id, date(r.rental_date), COUNT(*) FROM rental r
+        JOIN inventory i ON i.inventory_id = r.inventory_id
+        GROUP BY 1, 2
+    """,
+    ("actor", None): """
+        SELECT fa.actor_id, COUNT(*) FROM rental r
+        JOIN inventory i ON i.inventory_id = r.inventory_id
+        JOIN film_actor fa ON fa.film_id = i.film_id
+        GROUP BY fa.actor_id ORDER BY COUNT(*) DESC
+    """,
+}
+
+
+def main():
+    path = scratch_path("sakila_bench_analytics.db")
+    build_database(path, films=1000, customers=5000, rentals=RENTALS)
+    app = load_app(path)
+
+    from sqlalchemy import text
+    from app import analytics, db
+
+    with app.app_context():
+        load = best_of(
+            lambda: analytics.RentalAnalytics().refresh(force=True), repeat=1
+        )
+        engine = analytics.engine
+        engine.refresh(force=True)
+        print(f"{RENTALS} rentals, initial load {load * 1000:.0f} ms")
+        print(f"{'aggregation':<18}{'sql ms':>10}{'engine ms':>12}{'speedup':>10}")
+
+        for (by, period), sql in QUERIES.items():
+            with db.engine.connect() as connection:
+                expected = len(connection.execute(text(sql)).all())
+                sql_time = best_of(lambda: connection.execute(text(sql)).all())
+            engine_time = best_of(lambda: engine.rentals(by=by, period=period))
+            assert len(engine.rentals(by=by, period=period)) == expected
+            print(
+                f"{by + '/' + (period or 'total'):<18}{sql_time * 1000:>10.1f}"
+                f"{engine_time * 1000:>12.1f}{sql_time / engine_time:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
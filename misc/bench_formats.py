@@ -0,0 +1,62 @@
+# misc/bench_formats.py
+#
+# Response size, serialization CPU and peak memory of the list routes in each
+# negotiated format (objects, columnar JSON, MessagePack), at 1x and 10x data.
+#
+#   python misc/bench_formats.py
+
+import time
+import tracemalloc
+from bench_utils import build_database, load_app, scratch_path
+
+ROUTES = ["/films_by_title?title=", "/customers"]
+FORMATS = ["json", "columnar", "msgpack"]
+SCALES = {
+    "1x": dict(films=1000, customers=600),
+    "10x": dict(films=10000, customers=6000),
+}
+
+
+def measure(client, url):
+    client.get(url)
+    start = time.process_time()
+    for _ in range(5):
+        client.get(url)
+    cpu = (time.process_time() - start) / 5
+
+    tracemalloc.start()
+    size = len(client.get(url).data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, cpu, peak
+
+
+def main():
+    path = scratch_path("sakila_bench_formats.db")
+    app = None
+    print(
+        f"{'route':<26}{'scale':>6}{'format':>10}{'bytes':>12}{'cpu ms':>9}{'peak KiB':>10}"
+    )
+    for scale, sizes in SCALES.items():
+        # Rebuild the database file in place and drop pooled connections to it
+        build_database(path, rentals=10, **sizes)
+        if app is None:
+            app = load_app(path)
+        with app.app_context():
+            from app import db
+
+            db.engine.dispose()
+        client = app.test_client()
+
+        for route in ROUTES:
+            for name in FORMATS:
+                separator = "&" if "?" in route else "?"
+                size, cpu, peak = measure(client, f"{route}{separator}format={name}")
+                print(
+                    f"{route:<26}{scale:>6}{name:>10}{size:>12}"
+                    f"{cpu * 1000:>9.1f}{peak / 1024:>10.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# misc/bench_statements.py
+#
+# Per-request Python overhead of the hot-path queries: rebuilding the ORM
+# query chain on every call (before) versus executing the prebuilt statements
+# in app/statements.py and app/rollups.py (after). The database is tiny so the
+# timings are dominated by query construction, compilation and result handling.
+#
+#   python misc/bench_statements.py [calls]
+
+import sys
+from bench_utils import build_database, load_app, scratch_path
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def before_queries(db, models, func):
+    Actor, Film, FilmActor, FilmRentalDaily, Inventory, Rental = models
+
+    def top_films():
+        rental_count = func.sum(FilmRentalDaily.rental_count)
+        return (
+            db.session.query(
+                Film.film_id,
+                Film.title,
+                Film.description,
+                Film.release_year,
+                Film.rating,
+                Film.special_features,
+                rental_count.label("rental_count"),
+            )
+            .join(FilmRentalDaily, Film.film_id == FilmRentalDaily.film_id)
+            .group_by(Film.film_id)
+            .order_by(rental_count.desc(), Film.film_id)
+            .limit(5)
+            .all()
+        )
+
+    def top_actors():
+        return (
+            db.session.query(
+                Actor.actor_id,
+                Actor.first_name,
+                Actor.last_name,
+                func.concat(Actor.first_name, " ", Actor.last_name).label("full_name"),
+                func.count(FilmActor.film_id).label("film_count"),
+            )
+            .join(FilmActor, Actor.actor_id == FilmActor.actor_id)
+            .group_by(Actor.actor_id, Actor.first_name, Actor.last_name)
+            .order_by(-func.count(FilmActor.film_id))
+            .limit(5)
+            .all()
+        )
+
+    def top_movies_for_actor():
+        rental_count = func.sum(FilmRentalDaily.rental_count)
+        return (
+            db.session.query(
+                Film.film_id,
+                Film.title,
+                Film.description,
+                Film.release_year,
+                Film.rating,
+                Film.special_features,
+                rental_count.label("rental_count"),
+            )
+            .join(FilmRentalDaily, Film.film_id == FilmRentalDaily.film_id)
+            .join(FilmActor, Film.film_id == FilmActor.film_id)
+            .filter(FilmActor.actor_id == 1)
+            .group_by(Film.film_id)
+            .order_by(rental_count.desc(), Film.film_id)
+            .limit(5)
+            .all()
+        )
+
+    def movie_copies_info():
+        return (
+            db.session.query(
+                Film.film_id,
+                Film.title.label("film_title"),
+                func.count(Inventory.inventory_id).label("number_of_copies"),
+            )
+            .outerjoin(Inventory, Film.film_id == Inventory.film_id)
+            .group_by(Film.film_id, Film.title)
+            .order_by(Film.film_id, func.count(Inventory.inventory_id).desc())
+            .all()
+        )
+
+    return {
+        "top_rented_movies": top_films,
+        "top_actors": top_actors,
+        "top_movies_for_actor": top_movies_for_actor,
+        "movie_copies_info": movie_copies_info,
+    }
+
+
+def after_queries(db, rollups, statements):
+    return {
+        "top_rented_movies": lambda: db.session.execute(
+            rollups.TOP_FILMS[(False, False)], {"limit": 5}
+        ).all(),
+        "top_actors": lambda: db.session.execute(
+            statements.TOP_ACTORS_BY_FILM_COUNT, {"limit": 5}
+        ).all(),
+        "top_movies_for_actor": lambda: db.session.execute(
+            rollups.TOP_FILMS[(False, True)], {"limit": 5, "actor_id": 1}
+        ).all(),
+        "movie_copies_info": lambda: db.session.execute(
+            statements.MOVIE_COPIES_INFO
+        ).all(),
+    }
+
+
+def per_call_us(fn):
+    import time
+
+    for _ in range(50):
+        fn()
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        fn()
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+def main():
+    path = scratch_path("sakila_bench_statements.db")
+    build_database(path, films=3, actors=3, customers=3, rentals=10)
+    app = load_app(path)
+
+    from sqlalchemy import func
+    from app import db, rollups, statements
+    from app.models import Actor, Film, FilmActor, FilmRentalDaily, Inventory, Rental
+
+    with app.app_context():
+        rollups.refresh_rollups(force=True)
+        before = before_queries(
+            db, (Actor, Film, FilmActor, FilmRentalDaily, Inventory, Rental), func
+        )
+        after = after_queries(db, rollups, statements)
+
+        print(f"{'query':<24}{'before us':>12}{'after us':>12}{'saved':>9}")
+        for name in before:
+            assert before[name]() == after[name](), name
+            old, new = per_call_us(before[name]), per_call_us(after[name])
+            print(f"{name:<24}{old:>12.1f}{new:>12.1f}{1 - new / old:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
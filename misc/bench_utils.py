@@ -0,0 +1,203 @@
+# misc/bench_utils.py
+#
+# Shared helpers for the benchmark scripts in misc/. They build a synthetic
+# Sakila-shaped SQLite database and point the Flask app at it, so the
+# benchmarks run without a MySQL server.
+
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SCHEMA = """
+CREATE TABLE film(film_id INTEGER PRIMARY KEY, title TEXT, description TEXT, release_year INT,
+    language_id INT DEFAULT 1, rental_duration INT DEFAULT 3, rental_rate NUMERIC DEFAULT 4.99,
+    length INT, replacement_cost NUMERIC DEFAULT 19.99, rating TEXT, special_features TEXT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE category(category_id INTEGER PRIMARY KEY, name TEXT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE film_category(film_id INT, category_id INT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY(film_id, category_id));
+CREATE TABLE actor(actor_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE film_actor(actor_id INT, film_id INT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY(actor_id, film_id));
+CREATE INDEX idx_fk_film_id ON film_actor(film_id);
+CREATE TABLE store(store_id INTEGER PRIMARY KEY);
+CREATE TABLE staff(staff_id INTEGER PRIMARY KEY, store_id INT);
+CREATE TABLE inventory(inventory_id INTEGER PRIMARY KEY, film_id INT, store_id INT,
+    available_copies INT DEFAULT 1, last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE INDEX idx_inventory_film ON inventory(film_id);
+CREATE TABLE country(country_id INTEGER PRIMARY KEY, country TEXT);
+CREATE TABLE city(city_id INTEGER PRIMARY KEY, city TEXT, country_id INT);
+CREATE TABLE address(address_id INTEGER PRIMARY KEY, address TEXT, city_id INT, phone TEXT);
+CREATE TABLE customer(customer_id INTEGER PRIMARY KEY AUTOINCREMENT, store_id INT,
+    first_name TEXT, last_name TEXT, email TEXT, address_id INT, active INT DEFAULT 1,
+    create_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE rental(rental_id INTEGER PRIMARY KEY AUTOINCREMENT, rental_date TIMESTAMP,
+    inventory_id INT, customer_id INT, return_date TIMESTAMP, staff_id INT,
+    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE INDEX idx_rental_inventory ON rental(inventory_id);
+CREATE INDEX idx_rental_customer ON rental(customer_id);
+CREATE TABLE payment(payment_id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id INT,
+    staff_id INT, rental_id INT REFERENCES rental(rental_id) ON DELETE SET NULL,
+    amount NUMERIC, payment_date TIMESTAMP, last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE INDEX idx_payment_rental ON payment(rental_id);
+"""
+
+FEATURES = ["Trailers", "Commentaries", "Deleted Scenes", "Behind the Scenes"]
+RATINGS = ["G", "PG", "PG-13", "R", "NC-17"]
+
+
+# Create a Sakila-shaped SQLite database filled with random data
+def build_database(path, films=1000, actors=200, customers=600, rentals=16000, seed=1):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+
+    connection.executemany(
+        "INSERT INTO category (category_id, name) VALUES (?, ?)",
+        [(i, f"Genre {i}") for i in range(1, 17)],
+    )
+    connection.executemany(
+        "INSERT INTO film (film_id, title, description, release_year, rental_duration,"
+        " rental_rate, rating, special_features) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f,
+                f"FILM {f:06d}",
+                "A synthetic film",
+                2000 + f % 7,
+                3 + f % 5,
+                [0.99, 2.99, 4.99][f % 3],
+                RATINGS[f % 5],
+                ",".join(x for x in FEATURES if rng.random() < 0.4),
+            )
+            for f in range(1, films + 1)
+        ],
+    )
+    connection.executemany(
+        "INSERT INTO film_category (film_id, category_id) VALUES (?, ?)",
+        [(f, 1 + f % 16) for f in range(1, films + 1)],
+    )
+    connection.executemany(
+        "INSERT INTO actor (actor_id, first_name, last_name) VALUES (?, ?, ?)",
+        [(a, f"FIRST{a}", f"LAST{a % 120}") for a in range(1, actors + 1)],
+    )
+    connection.executemany(
+        "INSERT INTO film_actor (actor_id, film_id) VALUES (?, ?)",
+        [
+            (a, f)
+            for a in range(1, actors + 1)
+            for f in rng.sample(range(1, films + 1), min(films, 27))
+        ],
+    )
+    connection.executemany("INSERT INTO store VALUES (?)", [(1,), (2,)])
+    connection.executemany("INSERT INTO staff VALUES (?, ?)", [(1, 1), (2, 2)])
+
+    inventory = []
+    for f in range(1, films + 1):
+        for copy in range(rng.randint(0, 8)):
+            inventory.append((len(inventory) + 1, f, 1 + copy % 2))
+    connection.executemany(
+        "INSERT INTO inventory (inventory_id, film_id, store_id) VALUES (?, ?, ?)",
+        inventory,
+    )
+
+    connection.execute("INSERT INTO country VALUES (1, 'Country')")
+    connection.execute("INSERT INTO city VALUES (1, 'City', 1)")
+    connection.execute("INSERT INTO address VALUES (1, '1 Main Street', 1, '5550100')")
+    connection.executemany(
+        "INSERT INTO customer (customer_id, store_id, first_name, last_name, email,"
+        " address_id) VALUES (?, ?, ?, ?, ?, 1)",
+        [
+            (c, 1 + c % 2, f"FIRST{c}", f"LAST{c:07d}", f"customer{c}@example.org")
+            for c in range(1, customers + 1)
+        ],
+    )
+
+    now = datetime.datetime.utcnow()
+    rows = []
+    for r in range(1, rentals + 1):
+        rented = now - datetime.timedelta(
+            days=400 * (rentals - r) / rentals, minutes=rng.randint(0, 600)
+        )
+        returned = None
+        if rng.random() > 0.02:
+            returned = rented + datetime.timedelta(days=rng.randint(1, 9))
+        rows.append(
+            (
+                r,
+                rented.isoformat(" "),
+                rng.randint(1, len(inventory)),
+                rng.randint(1, customers),
+                returned and returned.isoformat(" "),
+            )
+        )
+    connection.executemany(
+        "INSERT INTO rental (rental_id, rental_date, inventory_id, customer_id,"
+        " return_date, staff_id) VALUES (?, ?, ?, ?, ?, 1)",
+        rows,
+    )
+    # One payment per rental, as in Sakila
+    connection.executemany(
+        "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date)"
+        " VALUES (?, 1, ?, 2.99, ?)",
+        [(customer_id, r, rented) for r, rented, _, customer_id, _ in rows],
+    )
+    connection.commit()
+    connection.close()
+
+
+def _register_functions(dbapi_connection, connection_record):
+    # SQLite before 3.44 has no CONCAT(), which the MySQL-oriented queries use
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "concat",
+            -1,
+            lambda *parts: "".join("" if part is None else str(part) for part in parts),
+        )
+
+
+# Import the Flask app configured against the SQLite database at path
+def load_app(path, **settings):
+    import config
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    config.Config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+    # Benchmarks hammer the routes from one client and measure uncached work
+    config.Config.ADMISSION_ENABLED = False
+    config.Config.RESULT_CACHE_ENABLED = False
+    config.Config.SCHEDULER_ENABLED = False
+    for name, value in settings.items():
+        setattr(config.Config, name, value)
+    event.listen(Engine, "connect", _register_functions)
+
+    from app import app
+    from setup_db import setup
+
+    app.testing = True
+    setup(app)
+    return app
+
+
+def scratch_path(name):
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+# Best wall-clock time of fn() over several runs, in seconds
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
@@ -0,0 +1,120 @@
+# misc/check_film_details.py
+#
+# Check that /film_details issues a fixed number of SQL statements however
+# many actors, categories and copies the film has: one for the film, one
+# per eagerly loaded relationship and one for the copies rented out. An N+1
+# regression (a lazy load per actor or copy) makes the count grow with the
+# film and fails the check. The statements of a failing request are printed.
+#
+#   python misc/check_film_details.py
+
+import sqlite3
+import sys
+from bench_utils import build_database, load_app, scratch_path
+
+EXPECTED_STATEMENTS = 5
+
+FILMS = 50
+ACTORS = 80
+CATEGORIES = 16
+BIG_FILM = FILMS + 1
+BIG_COPIES = 40
+BIG_RENTED_OUT = 12
+
+
+# Add a film with every actor and category and many copies, some rented out
+def add_big_film(path):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "INSERT INTO film (film_id, title, description, release_year, rating,"
+        " special_features) VALUES (?, 'BIG FILM', 'A crowded film', 2006, 'PG',"
+        " 'Trailers')",
+        (BIG_FILM,),
+    )
+    connection.executemany(
+        "INSERT INTO film_actor (actor_id, film_id) VALUES (?, ?)",
+        [(actor_id, BIG_FILM) for actor_id in range(1, ACTORS + 1)],
+    )
+    connection.executemany(
+        "INSERT INTO film_category (film_id, category_id) VALUES (?, ?)",
+        [(BIG_FILM, category_id) for category_id in range(1, CATEGORIES + 1)],
+    )
+    first = connection.execute("SELECT MAX(inventory_id) FROM inventory").fetchone()[0]
+    copies = range(first + 1, first + BIG_COPIES + 1)
+    connection.executemany(
+        "INSERT INTO inventory (inventory_id, film_id, store_id) VALUES (?, ?, ?)",
+        [(inventory_id, BIG_FILM, 1 + inventory_id % 2) for inventory_id in copies],
+    )
+    connection.executemany(
+        "INSERT INTO rental (rental_date, inventory_id, customer_id, return_date,"
+        " staff_id) VALUES (datetime('now'), ?, 1, ?, 1)",
+        [
+            (inventory_id, None if number < BIG_RENTED_OUT else "2020-01-01")
+            for number, inventory_id in enumerate(copies)
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+
+def main():
+    path = scratch_path("sakila_film_details.db")
+    build_database(path, films=FILMS, actors=ACTORS, customers=10, rentals=500)
+    add_big_film(path)
+    app = load_app(path)
+
+    from flask import has_request_context
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = []
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            statements.append(statement)
+
+    client = app.test_client()
+    failures = []
+    for film_id, actors, categories, copies, rented_out in (
+        (1, None, None, None, None),
+        (BIG_FILM, ACTORS, CATEGORIES, BIG_COPIES, BIG_RENTED_OUT),
+    ):
+        statements.clear()
+        response = client.get(f"/film_details/{film_id}")
+        body = response.get_json()
+        if response.status_code != 200:
+            failures.append(f"film {film_id}: HTTP {response.status_code}")
+            continue
+        if len(statements) != EXPECTED_STATEMENTS:
+            listing = "\n".join(
+                f"  {number}. {' '.join(statement.split())}"
+                for number, statement in enumerate(statements, 1)
+            )
+            failures.append(
+                f"film {film_id}: {len(statements)} statements,"
+                f" expected {EXPECTED_STATEMENTS}\n{listing}"
+            )
+        if actors is None:
+            continue
+        availability = body["availability"]
+        found = (
+            len(body["actors"]),
+            len(body["categories"]),
+            availability["number_of_copies"],
+            availability["number_of_rentals_out"],
+        )
+        if found != (actors, categories, copies, rented_out):
+            failures.append(
+                f"film {film_id}: (actors, categories, copies, rented out) is"
+                f" {found}, expected {(actors, categories, copies, rented_out)}"
+            )
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    print(f"film_details: {len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
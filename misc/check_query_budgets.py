@@ -0,0 +1,144 @@
+# misc/check_query_budgets.py
+#
+# Run one request against every route with QUERY_BUDGET_MODE = "raise" and
+# fail if any route issues more SQL statements than its QUERY_BUDGETS entry,
+# or has no entry at all. The offending statements are printed.
+#
+#   python misc/check_query_budgets.py
+
+import sys
+from bench_utils import build_database, load_app, scratch_path
+
+ADMIN_TOKEN = "query-budget-check"
+
+# One representative request per route: (method, url, json body)
+REQUESTS = [
+    ("GET", "/check_customer/1", None),
+    ("GET", "/check_movie_availability/1", None),
+    ("POST", "/rent_movie/1/1", None),
+    ("GET", "/all_films", None),
+    ("GET", "/top_rented_movies", None),
+    ("GET", "/top_rented_movies?window=30d&limit=10", None),
+    ("GET", "/movie_details/FILM 000001", None),
+    ("GET", "/film_details/1", None),
+    ("GET", "/recommendations/1", None),
+    ("GET", "/recommendations/1", None),
+    ("GET", "/top_actors", None),
+    ("GET", "/top_actors?window=30d", None),
+    ("GET", "/top_movies_for_actor/1?window=365d", None),
+    ("GET", "/co_stars/1", None),
+    ("GET", "/actor_path/1/7", None),
+    ("GET", "/movie_copies_info", None),
+    ("GET", "/movie_info", None),
+    ("GET", "/movie_info?movie_id=1", None),
+    ("GET", "/remaining_inventory/1", None),
+    ("GET", "/customers", None),
+    ("GET", "/customers?limit=25&offset=10", None),
+    ("GET", "/customers/search?q=LAST", None),
+    ("GET", "/films_by_genre?genre_name=Genre", None),
+    ("GET", "/films_by_actor?actor_name=FIRST1", None),
+    ("GET", "/films_by_title?title=FILM", None),
+    ("GET", "/films_filter?genre=Genre 1,Genre 2&rating=PG&feature=Trailers", None),
+    ("POST", "/add_customer", {"first_name": "A", "last_name": "B", "email": "a@b.c"}),
+    (
+        "PUT",
+        "/update_customer/2",
+        {"first_name": "A", "last_name": "B", "email": "a@b.c"},
+    ),
+    ("DELETE", "/delete_customer/3", None),
+    ("GET", "/customer_rentals/1", None),
+    ("GET", "/customer_rentals/1?include_archive=true", None),
+    ("PUT", "/update_return_date/1", None),
+    ("POST", "/return_rentals", {"inventory_ids": [1, 2, 3]}),
+    ("POST", "/return_rentals", {"rental_ids": [1, 15999, 99999]}),
+    ("GET", "/overdue_rentals?limit=10", None),
+    ("GET", "/overdue_rentals/customers", None),
+    ("GET", "/overdue_rentals/customers/1", None),
+    ("GET", "/analytics/rentals?by=category&period=month", None),
+    ("GET", "/analytics/revenue?by=store", None),
+    ("GET", "/analytics/utilization?by=film", None),
+    ("GET", "/export/rentals?after_rental_id=15990", None),
+    ("POST", "/admin/catalog/reload", None),
+    ("POST", "/admin/archive/rentals?older_than_days=30", None),
+    ("GET", "/admin/profiles", None),
+    ("GET", "/admin/profiles/00000000000000000000-missing", None),
+    ("GET", "/admin/profiles/00000000000000000000-missing/download", None),
+    ("GET", "/metrics/singleflight", None),
+    ("GET", "/metrics/admission", None),
+    ("GET", "/metrics/timeouts", None),
+    ("GET", "/metrics/cache", None),
+    ("GET", "/metrics/scheduler", None),
+    ("GET", "/metrics/transactions", None),
+    (
+        "POST",
+        "/batch",
+        {
+            "requests": [
+                "/top_rented_movies",
+                "/top_actors?window=30d",
+                "/movie_info",
+                "/check_customer/1",
+            ]
+        },
+    ),
+]
+
+# Endpoints that never touch the database on their own
+SKIP = {"static"}
+
+
+def main():
+    path = scratch_path("sakila_query_budgets.db")
+    build_database(path, films=50, actors=20, customers=50, rentals=16000)
+    app = load_app(
+        path,
+        QUERY_BUDGET_MODE="raise",
+        ADMIN_TOKEN=ADMIN_TOKEN,
+        ROLLUP_REFRESH_SECONDS=3600,
+        ANALYTICS_REFRESH_SECONDS=3600,
+        RECOMMENDATIONS_REFRESH_SECONDS=3600,
+        CATALOG_CHECK_SECONDS=3600,
+    )
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+
+    from app import analytics, catalog, recommendations, rollups
+    from app.querybudget import QueryBudgetExceeded
+
+    # Warm the in-memory caches so the check measures steady-state requests
+    with app.app_context():
+        catalog.reload()
+        rollups.refresh_rollups(force=True)
+        analytics.engine.refresh(force=True)
+        recommendations.engine.refresh(force=True)
+
+    client = app.test_client()
+    covered, failures = set(), []
+    for method, url, body in REQUESTS:
+        try:
+            response = client.open(
+                url, method=method, json=body, headers={"X-Admin-Token": ADMIN_TOKEN}
+            )
+            response.get_data()
+        except QueryBudgetExceeded as error:
+            failures.append(f"{method} {url}: {error}")
+            covered.add(error.endpoint)
+            continue
+        with app.test_request_context(url, method=method):
+            from flask import request
+
+            covered.add(request.endpoint)
+        if response.status_code >= 500:
+            failures.append(f"{method} {url}: HTTP {response.status_code}")
+
+    missing = {rule.endpoint for rule in app.url_map.iter_rules()} - covered - SKIP
+    for endpoint in sorted(missing):
+        failures.append(f"{endpoint}: no request in misc/check_query_budgets.py")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    print(f"{len(REQUESTS)} requests, {len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+# misc/check_shards.py
+#
+# Run the same requests against one database and against the same data split
+# over two SQLite store shards, and fail on any response that differs. The
+# sharded run's main database keeps only the catalog, so a read that still
+# goes to the main database instead of the shards shows up as a difference.
+# Each side runs in its own process, since the app reads its configuration
+# once at import.
+#
+#   python misc/check_shards.py
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+from bench_utils import build_database, load_app, scratch_path
+
+ADMIN_TOKEN = "shard-check"
+STORES = (1, 2)
+
+# The second shard numbers new customers and rentals from here, so ids stay
+# unique across shards; the first continues where the unsplit data ends
+ID_OFFSET = 1000000
+
+# Tables of the store data; the main database of the sharded run keeps the rest
+STORE_TABLES = (
+    "staff",
+    "customer",
+    "address",
+    "city",
+    "country",
+    "inventory",
+    "rental",
+    "payment",
+)
+CATALOG_TABLES = ("film", "category", "film_category", "actor", "film_actor")
+
+# Settings of both runs: catch-ups run on every request, so the in-memory
+# engines are refreshed from the shards as the writes below land
+SETTINGS = dict(
+    ADMIN_TOKEN=ADMIN_TOKEN,
+    ANALYTICS_REFRESH_SECONDS=0,
+    RECOMMENDATIONS_REFRESH_SECONDS=0,
+    OVERDUE_REFRESH_SECONDS=0,
+    ROLLUP_REFRESH_SECONDS=0,
+)
+
+# Requests in order, as (method, url, json body). Writes only touch store 1,
+# so ids match in both runs. Each run stamps its own dates on what it
+# writes, so the new customer and {renter}'s rentals are never listed with
+# their dates. {copy} is a copy stocked by store 1 and {film} its film;
+# {customer} and {renter} are the first and last store 2 customers with
+# open rentals.
+REQUESTS = [
+    ("GET", "/check_customer/1", None),
+    ("GET", "/check_customer/2", None),
+    ("GET", "/check_customer/999999", None),
+    ("GET", "/check_movie_availability/1", None),
+    ("GET", "/all_films", None),
+    ("GET", "/film_details/1", None),
+    ("GET", "/film_details/7", None),
+    ("GET", "/movie_copies_info", None),
+    ("GET", "/movie_info", None),
+    ("GET", "/movie_info?movie_id=3", None),
+    ("GET", "/remaining_inventory/3", None),
+    ("GET", "/top_rented_movies", None),
+    ("GET", "/top_rented_movies?window=30d&limit=10", None),
+    ("GET", "/top_actors", None),
+    ("GET", "/top_actors?window=all", None),
+    ("GET", "/top_movies_for_actor/1", None),
+    ("GET", "/recommendations/1", None),
+    ("GET", "/customers", None),
+    ("GET", "/customers?limit=10&offset=5", None),
+    ("GET", "/customers?limit=7&offset=590", None),
+    ("GET", "/customers/search?q=LAST00000", None),
+    ("GET", "/customers/search?q=FIRST1&field=first_name", None),
+    ("GET", "/customer_rentals/{customer}", None),
+    ("GET", "/customer_rentals/{customer}?include_archive=true", None),
+    ("GET", "/export/rentals?after_rental_id=15000", None),
+    ("GET", "/export/rentals?format=ndjson&store_id=2&after_rental_id=14000", None),
+    ("GET", "/export/rentals?customer_id={customer}", None),
+    ("GET", "/overdue_rentals?limit=50", None),
+    ("GET", "/overdue_rentals/customers", None),
+    ("GET", "/overdue_rentals/customers/{customer}", None),
+    ("GET", "/analytics/rentals?by=store", None),
+    ("GET", "/analytics/rentals?by=category&period=month", None),
+    ("GET", "/analytics/revenue?by=film&limit=20", None),
+    ("GET", "/analytics/utilization?by=store", None),
+    # A new customer at store 1 is found everywhere customers are read
+    (
+        "POST",
+        "/add_customer",
+        {
+            "store_id": 1,
+            "first_name": "NEW",
+            "last_name": "SHARDED",
+            "email": "new@example.org",
+        },
+    ),
+    ("GET", "/check_customer/601", None),
+    ("GET", "/customers/search?q=SHARDED", None),
+    (
+        "PUT",
+        "/update_customer/601",
+        {"first_name": "NEW", "last_name": "SHARDED2", "email": "new@example.org"},
+    ),
+    ("GET", "/customers/search?q=SHARDED", None),
+    ("DELETE", "/delete_customer/601", None),
+    ("GET", "/check_customer/601", None),
+    # A store 2 customer rents a store 1 copy: the rental lives on shard 1
+    ("POST", "/rent_movie/{copy}/{renter}", None),
+    ("GET", "/check_movie_availability/{film}", None),
+    ("GET", "/film_details/{film}", None),
+    ("GET", "/remaining_inventory/{film}", None),
+    ("GET", "/movie_info?movie_id={film}", None),
+    ("GET", "/top_rented_movies?limit=20", None),
+    ("GET", "/analytics/rentals?by=store", None),
+    ("GET", "/recommendations/{film}", None),
+    ("GET", "/overdue_rentals/customers/{renter}", None),
+    ("PUT", "/update_return_date/16001", None),
+    ("GET", "/remaining_inventory/{film}", None),
+    ("POST", "/return_rentals", {"inventory_ids": [1, 2, 3, 4, 5, 6]}),
+    ("GET", "/overdue_rentals?limit=50", None),
+    ("GET", "/overdue_rentals/customers", None),
+    ("GET", "/movie_info", None),
+    # Archiving moves every old closed rental on the shards; the unsharded
+    # run keeps the rollups' rescan window, so only reads that include the
+    # archive are compared afterwards
+    ("POST", "/admin/archive/rentals?older_than_days=30", None),
+    ("GET", "/top_rented_movies", None),
+    ("GET", "/top_rented_movies?window=365d", None),
+    ("GET", "/customers?limit=10&offset=5", None),
+    ("GET", "/customer_rentals/{customer}?include_archive=true", None),
+    ("GET", "/export/rentals?include_archive=true&customer_id={customer}", None),
+    ("GET", "/analytics/rentals?by=film&limit=20", None),
+    ("GET", "/recommendations/1", None),
+]
+
+# Requests whose status alone is compared
+STATUS_ONLY = {"/admin/archive/rentals?older_than_days=30"}
+
+
+# Copy the database into a main database holding only the catalog and one
+# database per store holding only that store's data
+def split(path, main_path, shard_paths):
+    shutil.copyfile(path, main_path)
+    connection = sqlite3.connect(main_path)
+    for table in STORE_TABLES:
+        connection.execute(f"DELETE FROM {table}")
+    connection.commit()
+    connection.close()
+
+    for store_id, shard_path in shard_paths.items():
+        shutil.copyfile(path, shard_path)
+        connection = sqlite3.connect(shard_path)
+        for table in CATALOG_TABLES:
+            connection.execute(f"DELETE FROM {table}")
+        for table in ("staff", "customer", "inventory"):
+            connection.execute(f"DELETE FROM {table} WHERE store_id != ?", (store_id,))
+        connection.execute(
+            "DELETE FROM rental WHERE inventory_id NOT IN (SELECT inventory_id FROM inventory)"
+        )
+        connection.execute(
+            "DELETE FROM payment WHERE rental_id NOT IN (SELECT rental_id FROM rental)"
+        )
+        if store_id != STORES[0]:
+            connection.execute("UPDATE sqlite_sequence SET seq = seq + ?", (ID_OFFSET,))
+        connection.commit()
+        connection.close()
+
+
+# Fill in the copy, film and customers the requests use
+def placeholders(path):
+    connection = sqlite3.connect(path)
+    copy, film = connection.execute(
+        "SELECT inventory_id, film_id FROM inventory WHERE store_id = 1 AND inventory_id NOT IN"
+        " (SELECT inventory_id FROM rental WHERE return_date IS NULL) ORDER BY inventory_id LIMIT 1"
+    ).fetchone()
+    customer, renter = connection.execute(
+        "SELECT MIN(customer_id), MAX(customer_id) FROM customer WHERE store_id = 2 AND customer_id IN"
+        " (SELECT customer_id FROM rental WHERE return_date IS NULL)"
+    ).fetchone()
+    connection.close()
+    return {"copy": copy, "film": film, "customer": customer, "renter": renter}
+
+
+# Child process: run every request against one configuration and print
+# (status, body) per request as JSON
+def run(path, shards, values):
+    settings = dict(SETTINGS)
+    if shards:
+        settings["STORE_SHARDS"] = {
+            int(store_id): "sqlite:///" + shard_path
+            for store_id, shard_path in shards.items()
+        }
+    app = load_app(path, **settings)
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    client = app.test_client()
+
+    responses = []
+    for method, url, body in REQUESTS:
+        response = client.open(
+            url.format(**values),
+            method=method,
+            json=body,
+            headers={"X-Admin-Token": ADMIN_TOKEN},
+        )
+        responses.append((response.status_code, response.get_data(as_text=True)))
+    json.dump(responses, sys.stdout)
+
+
+def collect(path, shards, values):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-W",
+            "ignore",
+            __file__,
+            "--run",
+            path,
+            json.dumps(shards),
+            json.dumps(values),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    path = scratch_path("sakila_shards.db")
+    build_database(path, films=50, actors=20, customers=600, rentals=16000)
+    main_path = scratch_path("sakila_shards_main.db")
+    shard_paths = {
+        store_id: scratch_path(f"sakila_shard_{store_id}.db") for store_id in STORES
+    }
+    split(path, main_path, shard_paths)
+    values = placeholders(path)
+
+    single = collect(path, {}, values)
+    sharded = collect(main_path, shard_paths, values)
+
+    failures = []
+    for (method, url, _), expected, actual in zip(REQUESTS, single, sharded):
+        url = url.format(**values)
+        if expected[0] != actual[0]:
+            failures.append(
+                f"{method} {url}: HTTP {actual[0]} sharded, {expected[0]} unsharded"
+            )
+        elif expected[0] >= 500:
+            failures.append(f"{method} {url}: HTTP {expected[0]}")
+        elif url not in STATUS_ONLY and expected[1] != actual[1]:
+            failures.append(
+                f"{method} {url}: responses differ\n  unsharded: {expected[1][:300]}\n  sharded:   {actual[1][:300]}"
+            )
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    print(f"{len(REQUESTS)} requests on {len(STORES)} shards, {len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(sys.argv[2], json.loads(sys.argv[3]), json.loads(sys.argv[4]))
+    else:
+        sys.exit(main())
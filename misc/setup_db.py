@@ -0,0 +1,65 @@
+# misc/setup_db.py
+#
+# One-off schema setup for what the app adds to a stock Sakila database: its
+# own tables and the customer search indexes. The app never issues DDL while
+# serving requests, so run this once, as a database user allowed to create
+# tables, before starting the server:
+#
+#   python misc/setup_db.py
+#
+# Safe to re-run: tables and indexes that already exist are left alone, and
+# indexes added to an existing table are created on their own. With
+# STORE_SHARDS set, every shard gets the same tables and indexes, since
+# each one archives and searches its own store's customers and rentals.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+# Tables the app creates and maintains itself
+def app_tables(models):
+    return [
+        # Leaderboard rollups (app/rollups.py)
+        models.FilmRentalDaily.__table__,
+        models.RollupWatermark.__table__,
+        # Archived rentals and their payment links (app/archive.py)
+        models.RentalArchive.__table__,
+        models.PaymentRentalArchive.__table__,
+    ]
+
+
+# Sakila tables the app adds indexes to. Stock Sakila only indexes
+# customer.last_name; /customers/search also looks customers up by first
+# name, email and phone (app/models.py).
+def indexed_tables(models):
+    return [models.Customer.__table__, models.Address.__table__]
+
+
+# Create the app's tables and any missing indexes on them and on Sakila's,
+# on the main database and every store shard
+def setup(app):
+    from app import db, models, shards
+
+    with app.app_context():
+        engines = [db.engine]
+        if shards.enabled():
+            engines += shards.engines()
+        for engine in engines:
+            for table in app_tables(models):
+                table.create(engine, checkfirst=True)
+            for table in app_tables(models) + indexed_tables(models):
+                for index in table.indexes:
+                    index.create(engine, checkfirst=True)
+
+
+def main():
+    from app import app
+
+    setup(app)
+    print(f"Schema ready on {app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 # run.py
 
-from app import app
+from app import app, catalog, scheduler
 
 if __name__ == "__main__":
+    # Warm the in-memory film catalog before serving requests
+    with app.app_context():
+        catalog.reload()
+    # Start refreshing leaderboards and availability in the background
+    if app.config["SCHEDULER_ENABLED"]:
+        scheduler.jobs.start()
     app.run(debug=True)